@@ -0,0 +1,69 @@
+"""Compare gzip against Zstandard (with and without a trained dictionary) for Envoy responses.
+
+Usage:
+
+    uv run benchmarks/compression_ratio.py [--repeats 100]
+
+The dictionary is trained on the example responses in `example_envoy_json_data/`, and then used to
+compress the same responses, so the Zstandard + dictionary numbers are a little optimistic.
+"""
+
+import argparse
+import time
+from collections.abc import Callable
+from compression import zstd
+from functools import partial
+from pathlib import Path
+
+from envoy_recorder.payload_compression import Codec, compress, decompress, train_dictionary
+
+EXAMPLE_JSON_PATH = Path(__file__).parent.parent / "example_envoy_json_data"
+
+
+def _time_per_payload(
+    func: Callable[[bytes], bytes], payloads: list[bytes], repeats: int
+) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        for payload in payloads:
+            func(payload)
+    return (time.perf_counter() - t0) / (repeats * len(payloads))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=100)
+    args = parser.parse_args()
+
+    payloads = [path.read_bytes() for path in sorted(EXAMPLE_JSON_PATH.glob("*.json"))]
+    zstd_dict = train_dictionary(payloads)
+    dictionaries = {zstd_dict.dict_id: zstd_dict}
+    raw_bytes = sum(len(p) for p in payloads)
+
+    print(f"{len(payloads)} payloads, {raw_bytes / len(payloads):,.0f} bytes each on average.")
+    print(
+        f"{'method':<20}{'bytes/payload':>15}{'ratio':>8}{'compress µs':>14}{'decompress µs':>16}"
+    )
+    methods: dict[str, tuple[Codec, zstd.ZstdDict | None]] = {
+        "gzip": ("gzip", None),
+        "zstd": ("zstd", None),
+        "zstd + dictionary": ("zstd", zstd_dict),
+    }
+    for name, (codec, method_dict) in methods.items():
+        compressed = [compress(p, codec, method_dict) for p in payloads]
+        compressed_bytes = sum(len(c) for c in compressed)
+        compress_seconds = _time_per_payload(
+            partial(compress, codec=codec, zstd_dict=method_dict), payloads, args.repeats
+        )
+        decompress_seconds = _time_per_payload(
+            partial(decompress, codec=codec, dictionaries=dictionaries), compressed, args.repeats
+        )
+        print(
+            f"{name:<20}{compressed_bytes / len(payloads):>15,.0f}"
+            f"{raw_bytes / compressed_bytes:>8.1f}"
+            f"{compress_seconds * 1e6:>14.1f}{decompress_seconds * 1e6:>16.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
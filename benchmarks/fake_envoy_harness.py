@@ -0,0 +1,181 @@
+"""Run the recorder against a misbehaving fake Envoy at accelerated time, and measure data loss.
+
+Usage:
+
+    uv run benchmarks/fake_envoy_harness.py [--hours 24] [--server-error-probability 0.1] ...
+
+This starts a `FakeEnvoy` (see `envoy_recorder.fake_envoy`) on localhost, and then runs an
+`EnvoyRecorder` against it: one poll per simulated `--poll-every-seconds`, and one flush per
+simulated `--flush-every-n-minutes`. Simulated time runs `--speedup` times faster than real time
+(or, with `--speedup 0`, as fast as the recorder can poll, which measures poll throughput). The
+Envoy's clock is the simulated clock, so each inverter reports every 15 simulated minutes.
+
+The Envoy's misbehaviour (latency, stalls, 401s, 5xx errors and truncated bodies) is configured with
+the `--*-probability` and `--*-seconds` arguments. At the end, every reading which the Envoy could
+have served is compared with the readings in the archive, to measure end-to-end data loss. (Shrink
+`--request-timeout-seconds` and `--retry-window-seconds` in proportion to the speedup, so that
+retries don't eat into the next simulated poll.)
+
+The live buffer uses the "segment" format, because the "files" format names each file after the
+(real) second of the poll, so polls at accelerated time would overwrite each other.
+"""
+
+import argparse
+import logging
+import tempfile
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import polars as pl
+import requests
+
+from envoy_recorder.config_loader import EnvoyConfig, EnvoyRecorderConfig
+from envoy_recorder.envoy_recorder import EnvoyRecorder
+from envoy_recorder.fake_envoy import FakeEnvoy, Misbehaviour
+from envoy_recorder.logging import get_logger
+from envoy_recorder.reader import ArchiveReader
+from envoy_recorder.synthetic_payloads import SyntheticEnvoy
+
+log = get_logger(__name__)
+
+START = int(datetime(2026, 6, 1, tzinfo=UTC).timestamp())
+TOKEN = "harness"
+
+
+class SimulatedClock:
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_config(tmp_path: Path, port: int, args: argparse.Namespace) -> EnvoyRecorderConfig:
+    return EnvoyRecorderConfig(
+        paths={
+            "live_buffer": tmp_path / "live_buffer",
+            "parquet_archive": tmp_path / "parquet_archive",
+            "rollups": tmp_path / "rollups",
+            "hot_tier": tmp_path / "hot_tier",
+            "raw_bundles": tmp_path / "raw_bundles",
+            "state": tmp_path / "state",
+            "storage_bucket": "unused:bucket",
+        },
+        live_buffer={"format": "segment"},
+        envoy=EnvoyConfig(
+            ip_address="127.0.0.1",
+            port=port,
+            token=TOKEN,
+            request_timeout_seconds=args.request_timeout_seconds,
+            retry_window_seconds=args.retry_window_seconds,
+            retry_base_backoff_seconds=args.request_timeout_seconds / 10,
+            retry_max_backoff_seconds=args.request_timeout_seconds,
+        ),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-inverters", type=int, default=30)
+    parser.add_argument("--hours", type=float, default=24, help="Simulated hours.")
+    parser.add_argument("--poll-every-seconds", type=int, default=60)
+    parser.add_argument("--flush-every-n-minutes", type=int, default=60)
+    parser.add_argument("--speedup", type=float, default=0)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument("--latency-seconds", type=float, default=0.0)
+    parser.add_argument("--stall-probability", type=float, default=0.0)
+    parser.add_argument("--stall-seconds", type=float, default=1.0)
+    parser.add_argument("--unauthorized-probability", type=float, default=0.0)
+    parser.add_argument("--server-error-probability", type=float, default=0.0)
+    parser.add_argument("--truncated-probability", type=float, default=0.0)
+    parser.add_argument("--request-timeout-seconds", type=float, default=0.2)
+    parser.add_argument("--retry-window-seconds", type=float, default=1.0)
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(args.log_level)
+    misbehaviour = Misbehaviour(
+        latency_seconds=args.latency_seconds,
+        stall_probability=args.stall_probability,
+        stall_seconds=args.stall_seconds,
+        unauthorized_probability=args.unauthorized_probability,
+        server_error_probability=args.server_error_probability,
+        truncated_probability=args.truncated_probability,
+    )
+    synthetic_envoy = SyntheticEnvoy(
+        n_inverters=args.n_inverters, duplicate_ratio=args.duplicate_ratio
+    )
+    clock = SimulatedClock(START)
+    n_polls = round(args.hours * 3600 / args.poll_every_seconds)
+    polls_per_flush = max(1, args.flush_every_n_minutes * 60 // args.poll_every_seconds)
+    real_seconds_per_poll = args.poll_every_seconds / args.speedup if args.speedup > 0 else 0
+    n_failed_polls = 0
+    n_failed_flushes = 0
+    poll_seconds = []
+    flush_seconds = []
+
+    with (
+        tempfile.TemporaryDirectory() as tmp_dir,
+        FakeEnvoy(synthetic_envoy, misbehaviour, clock=clock, token=TOKEN) as envoy,
+    ):
+        config = make_config(Path(tmp_dir), envoy.port, args)
+        recorder = EnvoyRecorder(config)
+        t_start = time.perf_counter()
+        for i in range(n_polls):
+            clock.now = START + i * args.poll_every_seconds
+            t0 = time.perf_counter()
+            try:
+                recorder.fetch_and_buffer()
+            except requests.RequestException:
+                n_failed_polls += 1
+            poll_seconds.append(time.perf_counter() - t0)
+            if (i + 1) % polls_per_flush == 0 or i == n_polls - 1:
+                t0 = time.perf_counter()
+                try:
+                    recorder.flush()
+                except Exception:
+                    n_failed_flushes += 1
+                    log.exception("Flush %d failed!", len(flush_seconds) + 1)
+                flush_seconds.append(time.perf_counter() - t0)
+            # Sleep until the next simulated poll is due.
+            next_poll = t_start + (i + 1) * real_seconds_per_poll
+            time.sleep(max(0, next_poll - time.perf_counter()))
+        real_seconds = time.perf_counter() - t_start
+
+        archived = (
+            ArchiveReader(config.paths.parquet_archive, hot_tier_root=config.paths.hot_tier)
+            .scan_all()
+            .select(
+                pl.col("serial_number").cast(pl.String),
+                pl.col("period_end_time").dt.epoch(time_unit="s"),
+            )
+            .collect()
+            .rows()
+        )
+
+    stats = envoy.stats
+    n_lost = len(stats.readings - set(archived))
+    print(
+        f"Simulated {args.hours:g} hours ({n_polls:,} polls of {args.n_inverters} inverters) in"
+        f" {real_seconds:.1f} real seconds."
+    )
+    print(
+        f"Poll throughput: {n_polls / real_seconds:,.1f} polls per second. Median poll:"
+        f" {sorted(poll_seconds)[len(poll_seconds) // 2] * 1e3:.1f} ms. Median flush:"
+        f" {sorted(flush_seconds)[len(flush_seconds) // 2] * 1e3:.1f} ms."
+    )
+    print(
+        f"Requests: {stats.n_requests:,} ({stats.n_ok:,} OK, {stats.n_stalled:,} stalled,"
+        f" {stats.n_unauthorized:,} unauthorized, {stats.n_server_errors:,} server errors,"
+        f" {stats.n_truncated:,} truncated)."
+    )
+    print(f"Failed polls: {n_failed_polls:,} of {n_polls:,}. Failed flushes: {n_failed_flushes}.")
+    print(
+        f"Data loss: {n_lost:,} of the {len(stats.readings):,} readings which the Envoy served"
+        f" aren't in the archive ({n_lost / max(1, len(stats.readings)):.2%})."
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Compare Parquet layouts (see `config.archive`) for typical queries of a monthly partition.
+
+Usage:
+
+    uv run benchmarks/parquet_layout.py [--n-inverters 30] [--repeats 20]
+
+Writes one synthetic month of readings with each layout, and then times two typical queries:
+"one inverter over a week" and "all inverters for one day". "MB read" is the compressed size of the
+row groups which a reader has to decompress after pruning row groups using their min/max
+statistics. (Computing "MB read" needs pyarrow, to read the Parquet metadata. Without pyarrow, only
+the latency is reported.)
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+
+from envoy_recorder.config_loader import ArchiveConfig
+from envoy_recorder.parquet_archive import write_parquet_file
+from envoy_recorder.schemas import ProcessedEnvoyDataFrame
+
+MONTH_START = datetime(2026, 6, 1, tzinfo=UTC)
+N_DAYS = 30
+
+LAYOUTS = {
+    "polars, 1 row group": ArchiveConfig(row_groups="default", statistics="min_max"),
+    "polars, per inverter": ArchiveConfig(row_groups="per_serial_number"),
+    "pyarrow, per inverter": ArchiveConfig(
+        row_groups="per_serial_number", writer="pyarrow", serial_number_bloom_filter=True
+    ),
+}
+
+
+def make_month(n_inverters: int) -> pl.DataFrame:
+    rng = random.Random(42)
+    times = pl.datetime_range(
+        MONTH_START + timedelta(minutes=15),
+        MONTH_START + timedelta(days=N_DAYS),
+        interval="15m",
+        eager=True,
+    )
+    n_rows = n_inverters * times.len()
+
+    def noise(low: int, high: int) -> list[int]:
+        return [rng.randrange(low, high) for _ in range(n_rows)]
+
+    df = pl.DataFrame(
+        {
+            "serial_number": [f"4822020{i:05d}" for i in range(n_inverters) for _ in times],
+            "period_end_time": pl.concat([times] * n_inverters),
+            "period_duration": [timedelta(minutes=15)] * n_rows,
+            "joules_produced": noise(0, 270_000),
+            "ac_voltage_mV": noise(230_000, 250_000),
+            "ac_current_mA": noise(0, 1_300),
+            "dc_voltage_mV": noise(25_000, 40_000),
+            "dc_current_mA": noise(0, 10_000),
+            "ac_frequency_mHz": noise(49_900, 50_100),
+            "inverter_temperature_Celsius": noise(-5, 60),
+            "power_conversion_error_seconds": [0] * n_rows,
+            "power_conversion_max_error_cycles": [0] * n_rows,
+            "flags": [1] * n_rows,
+            "watt_hours_today": noise(0, 2_000),
+            "year": [MONTH_START.year] * n_rows,
+            "month": [MONTH_START.month] * n_rows,
+        }
+    )
+    return df.cast(pl.Schema(ProcessedEnvoyDataFrame.dtypes)).sort(
+        "serial_number", "period_end_time"
+    )
+
+
+def _mb_read(path: Path, serial_number: str | None, start: datetime, end: datetime) -> float:
+    """The compressed size of the row groups whose statistics overlap the query."""
+    import pyarrow.parquet as pq
+
+    metadata = pq.ParquetFile(path).metadata
+    names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+    serial_index = names.index("serial_number")
+    time_index = names.index("period_end_time")
+    n_bytes = 0
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        serials = row_group.column(serial_index).statistics
+        times = row_group.column(time_index).statistics
+        if serial_number is not None and not (serials.min <= serial_number <= serials.max):
+            continue
+        if times.max.replace(tzinfo=UTC) < start or times.min.replace(tzinfo=UTC) >= end:
+            continue
+        n_bytes += sum(
+            row_group.column(j).total_compressed_size for j in range(row_group.num_columns)
+        )
+    return n_bytes / 1e6
+
+
+def _query(path: Path, serial_number: str | None, start: datetime, end: datetime) -> pl.DataFrame:
+    predicate = pl.col("period_end_time").is_between(start, end, closed="left")
+    if serial_number is not None:
+        predicate &= pl.col("serial_number").cast(pl.String) == serial_number
+    return pl.scan_parquet(path, hive_partitioning=False).filter(predicate).collect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-inverters", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        has_pyarrow = False
+        print("pyarrow isn't installed, so the pyarrow layout and 'MB read' are skipped.")
+    else:
+        has_pyarrow = True
+
+    df = make_month(args.n_inverters)
+    one_inverter = df["serial_number"].cast(pl.String)[0]
+    queries = {
+        "one inverter, one week": (one_inverter, MONTH_START, MONTH_START + timedelta(days=7)),
+        "all inverters, one day": (None, MONTH_START, MONTH_START + timedelta(days=1)),
+    }
+    print(f"{df.height:,} rows ({args.n_inverters} inverters x {N_DAYS} days).")
+    print(f"{'layout':<24}{'query':<26}{'file MB':>9}{'MB read':>9}{'median ms':>11}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, layout in LAYOUTS.items():
+            if layout.writer == "pyarrow" and not has_pyarrow:
+                continue
+            path = Path(tmp_dir) / f"{name}.parquet"
+            with open(path, "wb") as f:
+                write_parquet_file(df, f, layout)
+            file_mb = path.stat().st_size / 1e6
+            for query_name, (serial_number, start, end) in queries.items():
+                latencies = []
+                for _ in range(args.repeats):
+                    t0 = time.perf_counter()
+                    _query(path, serial_number, start, end)
+                    latencies.append(time.perf_counter() - t0)
+                mb_read = (
+                    _mb_read(path, serial_number, start, end) if has_pyarrow else float("nan")
+                )
+                print(
+                    f"{name:<24}{query_name:<26}{file_mb:>9.2f}{mb_read:>9.2f}"
+                    f"{statistics.median(latencies) * 1e3:>11.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Time each stage of a flush, for a range of site sizes and backlogs, using synthetic responses.
+
+Usage:
+
+    uv run benchmarks/pipeline_scaling.py [--n-inverters 10 100 1000] [--backlog 1h 1d 30d]
+
+For each combination of inverter count and backlog (the time since the last flush), this generates a
+live buffer of synthetic responses (see `envoy_recorder.synthetic_payloads`), and then times the
+three stages of a flush:
+
+- "parse": `convert_directory_of_json_files_to_dataframe` (plus de-duplication);
+- "merge": merging the new rows with the archive's existing partitions (`merge_new_rows`);
+- "write": writing the Parquet partitions.
+
+The archive already holds the backlog before the one being flushed, so "merge" and "write" have
+realistic amounts of existing data to deal with. Combinations whose live buffer would be larger than
+`--max-raw-gb` (uncompressed) are skipped. Increase `--poll-every-seconds` to fit longer backlogs.
+
+Each result is appended (as one JSON line) to `--results`, along with the git commit and the
+versions of Python and Polars, so we can track trends across commits. Each result is also compared
+with the most recent previous result for the same parameters. Please only compare results from the
+same machine.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import polars as pl
+
+from envoy_recorder.parquet_archive import ParquetArchive
+from envoy_recorder.synthetic_payloads import SyntheticEnvoy, write_live_buffer
+
+BENCHMARKS_PATH = Path(__file__).parent
+BACKLOGS = {"1h": 3600, "1d": 86_400, "7d": 7 * 86_400, "30d": 30 * 86_400}
+STAGES = ("parse", "merge", "write")
+# The flushed backlog ends at midday (UTC), so even the shortest backlog is in daylight.
+END = int(datetime(2026, 6, 30, 12, tzinfo=UTC).timestamp())
+# The approximate size of each micro-inverter's JSON in a response.
+BYTES_PER_INVERTER = 1_100
+
+
+def _git_commit() -> str | None:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARKS_PATH,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except OSError, subprocess.CalledProcessError:
+        return None
+    return result.stdout.strip()
+
+
+def _previous_results(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_once(
+    n_inverters: int,
+    backlog_seconds: int,
+    poll_every_seconds: int,
+    duplicate_ratio: float,
+    n_other_devices: int,
+    tmp_path: Path,
+) -> dict:
+    envoy = SyntheticEnvoy(
+        n_inverters=n_inverters,
+        n_other_devices=n_other_devices,
+        duplicate_ratio=duplicate_ratio,
+    )
+    archive = ParquetArchive(tmp_path / "parquet_archive", tmp_path / "archive_manifest.json")
+
+    # Fill the archive with the previous backlog (untimed).
+    previous = tmp_path / "previous"
+    start = END - 2 * backlog_seconds
+    write_live_buffer(previous, envoy.payloads(start, start + backlog_seconds, poll_every_seconds))
+    df = archive.append_to_parquet_in_memory(previous)
+    if df is not None:
+        archive.write(df)
+
+    live_buffer = tmp_path / "live_buffer"
+    t0 = time.perf_counter()
+    n_payloads = write_live_buffer(
+        live_buffer,
+        envoy.payloads(END - backlog_seconds, END, poll_every_seconds),
+    )
+    seconds = {"generate": time.perf_counter() - t0}
+
+    t0 = time.perf_counter()
+    new_df = archive.load_new_rows(live_buffer)
+    seconds["parse"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    merged_df = archive.merge_new_rows(new_df)
+    seconds["merge"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if merged_df is not None:
+        archive.write(merged_df)
+    seconds["write"] = time.perf_counter() - t0
+
+    return {
+        "n_payloads": n_payloads,
+        "live_buffer_MB": sum(p.stat().st_size for p in live_buffer.iterdir()) / 1e6,
+        "n_new_rows": new_df.height,
+        "n_rows_in_touched_partitions": 0 if merged_df is None else merged_df.height,
+        "seconds": seconds,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-inverters", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument(
+        "--backlog", nargs="+", choices=list(BACKLOGS), default=["1h", "1d", "30d"]
+    )
+    parser.add_argument("--poll-every-seconds", type=int, default=60)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument("--n-other-devices", type=int, default=2)
+    parser.add_argument("--max-raw-gb", type=float, default=2.0)
+    parser.add_argument(
+        "--results", type=Path, default=BENCHMARKS_PATH / "results" / "pipeline_scaling.jsonl"
+    )
+    args = parser.parse_args()
+
+    previous_results = _previous_results(args.results)
+    environment = {
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+    print(
+        f"{'inverters':>9}{'backlog':>8}{'payloads':>10}{'new rows':>10}"
+        + "".join(f"{stage + ' s':>9}" for stage in STAGES)
+        + f"{'rows/s':>11}{'vs last':>9}"
+    )
+    args.results.parent.mkdir(parents=True, exist_ok=True)
+    for n_inverters in args.n_inverters:
+        for backlog in args.backlog:
+            backlog_seconds = BACKLOGS[backlog]
+            n_polls = backlog_seconds // args.poll_every_seconds
+            raw_gb = n_polls * n_inverters * BYTES_PER_INVERTER / 1e9
+            if raw_gb > args.max_raw_gb:
+                print(
+                    f"{n_inverters:>9}{backlog:>8}  Skipped: the live buffer would be about"
+                    f" {raw_gb:.1f} GB (see --max-raw-gb and --poll-every-seconds)."
+                )
+                continue
+            parameters = {
+                "n_inverters": n_inverters,
+                "backlog": backlog,
+                "poll_every_seconds": args.poll_every_seconds,
+                "duplicate_ratio": args.duplicate_ratio,
+                "n_other_devices": args.n_other_devices,
+            }
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                result = run_once(
+                    n_inverters,
+                    backlog_seconds,
+                    args.poll_every_seconds,
+                    args.duplicate_ratio,
+                    args.n_other_devices,
+                    Path(tmp_dir),
+                )
+            pipeline_seconds = sum(result["seconds"][stage] for stage in STAGES)
+            rows_per_second = result["n_new_rows"] / pipeline_seconds
+            record = {
+                "time": datetime.now(UTC).isoformat(),
+                **environment,
+                "parameters": parameters,
+                **result,
+                "rows_per_second": rows_per_second,
+            }
+            with open(args.results, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+            last = next(
+                (r for r in reversed(previous_results) if r["parameters"] == parameters), None
+            )
+            if last and last["rows_per_second"] > 0:
+                change = f"{rows_per_second / last['rows_per_second'] - 1:>+8.0%}"
+            else:
+                change = f"{'-':>8}"
+            print(
+                f"{n_inverters:>9}{backlog:>8}{result['n_payloads']:>10,}"
+                f"{result['n_new_rows']:>10,}"
+                + "".join(f"{result['seconds'][stage]:>9.2f}" for stage in STAGES)
+                + f"{rows_per_second:>11,.0f} {change}"
+            )
+    print(f"Results appended to {args.results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Benchmark the start-up time and run time of a fetch-only cycle (i.e. a minute with no flush).
+
+This starts a stand-in Envoy HTTP server on localhost, and then repeatedly launches a fresh Python
+process which imports `envoy_recorder.envoy_recorder` and runs `EnvoyRecorder.fetch_and_buffer()`,
+which is what cron does on most minutes.
+
+Usage:
+
+    uv run benchmarks/startup_time.py [--repeats 10] [--max-import-seconds 0.5]
+
+Exits with a non-zero status if a fetch-only cycle imports Polars, or if the median import time
+exceeds `--max-import-seconds`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+EXAMPLE_JSON = (
+    Path(__file__).parent.parent / "example_envoy_json_data" / "device_data_1767696755.json"
+)
+
+# This runs in a fresh Python process, so that we measure a cold start.
+CHILD_SCRIPT = """
+import json, sys, time
+t0 = time.perf_counter()
+from envoy_recorder.envoy_recorder import EnvoyRecorder
+t1 = time.perf_counter()
+EnvoyRecorder().fetch_and_buffer()
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_seconds": t1 - t0,
+    "fetch_and_buffer_seconds": t2 - t1,
+    "polars_imported": "polars" in sys.modules,
+}))
+"""
+
+
+class _EnvoyHandler(BaseHTTPRequestHandler):
+    body = EXAMPLE_JSON.read_bytes()
+
+    def do_GET(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # Keep the benchmark output clean.
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--max-import-seconds", type=float, default=None)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _EnvoyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = os.environ | {
+            "ENVOY_RECORDER_ENVOY__IP_ADDRESS": "127.0.0.1",
+            "ENVOY_RECORDER_ENVOY__PORT": str(server.server_address[1]),
+            "ENVOY_RECORDER_ENVOY__TOKEN": "benchmark",
+            "ENVOY_RECORDER_PATHS__STORAGE_BUCKET": "unused:bucket",
+            "ENVOY_RECORDER_PATHS__LIVE_BUFFER": str(Path(tmp_dir) / "live_buffer"),
+            "ENVOY_RECORDER_PATHS__PARQUET_ARCHIVE": str(Path(tmp_dir) / "parquet_archive"),
+        }
+        for _ in range(args.repeats):
+            t0 = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, "-c", CHILD_SCRIPT],
+                env=env,
+                cwd=tmp_dir,  # So we don't pick up the user's config.toml.
+                check=True,
+                capture_output=True,
+                text=True,
+            )
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+            result["process_wall_seconds"] = time.perf_counter() - t0
+            results.append(result)
+    server.shutdown()
+
+    print(f"{'metric':<28}{'min':>10}{'median':>10}{'max':>10}")
+    for metric in ("import_seconds", "fetch_and_buffer_seconds", "process_wall_seconds"):
+        values = [r[metric] for r in results]
+        print(
+            f"{metric:<28}{min(values):>10.4f}{statistics.median(values):>10.4f}"
+            f"{max(values):>10.4f}"
+        )
+
+    if any(r["polars_imported"] for r in results):
+        sys.exit("REGRESSION: a fetch-only cycle imported Polars!")
+    median_import_seconds = statistics.median(r["import_seconds"] for r in results)
+    if args.max_import_seconds is not None and median_import_seconds > args.max_import_seconds:
+        sys.exit(
+            f"REGRESSION: median import time {median_import_seconds:.3f} s exceeds"
+            f" {args.max_import_seconds:.3f} s!"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Compact the Arrow IPC hot tier into the Parquet archive now, rather than waiting.
+
+For example:
+
+    uv run scripts/compact_hot_tier.py
+
+Flushes compact the hot tier automatically (see `envoy_recorder/hot_tier.py`). Run this before
+copying the Parquet archive somewhere else, or after setting `archive.hot_tier = false`. The
+compacted Parquet files are queued for upload, and uploaded by the next run of `record.py`.
+"""
+
+import argparse
+
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.hot_tier import HotTier
+from envoy_recorder.logging import get_logger
+from envoy_recorder.parquet_archive import ParquetArchive
+from envoy_recorder.upload_queue import UploadQueue
+
+log = get_logger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+    for site_config in EnvoyRecorderConfig.load().site_configs():
+        paths = site_config.paths
+        archive = ParquetArchive(
+            paths.parquet_archive,
+            paths.archive_manifest,
+            config=site_config.archive,
+            hot_tier=HotTier(paths.hot_tier),
+        )
+        written_paths = archive.compact_hot_tier(force=True)
+        log.info("Compacted %d partition(s) of %s", len(written_paths), paths.hot_tier)
+        if written_paths:
+            UploadQueue(site_config).enqueue_changed_files()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Regenerate the Parquet archive from the raw monthly bundles of Envoy responses.
+
+For example:
+
+    uv run scripts/rebuild_archive.py [--max-workers 4]
+
+Requires `live_buffer.keep_raw_payloads = true` (see `envoy_recorder/raw_bundles.py`). Use this
+after changing how `json_to_dataframe.py` converts the Envoy's JSON. Each month is converted by its
+own worker process, and the new archive is only swapped in once it's complete. See
+`envoy_recorder/rebuild.py` for the details. Please stop the recorder first!
+
+The rollups are rebuilt from the new archive, and the new archive is queued for upload (and uploaded
+by the next run of `record.py`).
+"""
+
+import argparse
+
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.logging import get_logger
+from envoy_recorder.reader import ArchiveReader
+from envoy_recorder.rebuild import rebuild_archive
+from envoy_recorder.rollups import RollupTables
+from envoy_recorder.upload_queue import UploadQueue
+
+log = get_logger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--max-workers", type=int, default=None, help="Defaults to the number of CPUs."
+    )
+    args = parser.parse_args()
+    for site_config in EnvoyRecorderConfig.load().site_configs():
+        result = rebuild_archive(site_config, args.max_workers)
+        if result is None:
+            continue
+        paths = site_config.paths
+        # Only cache the neighbouring months which `RollupTables.rebuild` needs.
+        reader = ArchiveReader(paths.parquet_archive, max_cached_partitions=3)
+        RollupTables(paths.rollups).rebuild(reader.partitions(), reader.load_partitions)
+        UploadQueue(site_config).enqueue_changed_files()
+        print(
+            f"{paths.parquet_archive}: {result.n_rows:,} rows from {result.n_bundles} bundles in"
+            f" {result.seconds:.1f} s ({result.rows_per_second:,.0f} rows/s)."
+        )
+
+
+if __name__ == "__main__":
+    main()
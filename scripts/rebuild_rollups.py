@@ -0,0 +1,40 @@
+"""Recompute the hourly and daily rollup tables from the whole Parquet archive, month by month.
+
+For example:
+
+    uv run scripts/rebuild_rollups.py
+
+Flushes keep the rollups up to date incrementally (see `envoy_recorder/rollups.py`), so you only
+need to run this once, to build the rollups for an archive which was recorded before rollups
+existed.
+"""
+
+import argparse
+
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.logging import get_logger
+from envoy_recorder.reader import ArchiveReader
+from envoy_recorder.rollups import RollupTables
+
+log = get_logger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+    for site_config in EnvoyRecorderConfig.load().site_configs():
+        paths = site_config.paths
+        # Only cache the neighbouring months which `RollupTables.rebuild` needs.
+        reader = ArchiveReader(
+            paths.parquet_archive, max_cached_partitions=3, hot_tier_root=paths.hot_tier
+        )
+        partitions = reader.partitions()
+        if not partitions:
+            log.info("%s is empty. Nothing to do.", paths.parquet_archive)
+            continue
+        written_paths = RollupTables(paths.rollups).rebuild(partitions, reader.load_partitions)
+        log.info("Wrote %d rollup files to %s", len(written_paths), paths.rollups)
+
+
+if __name__ == "__main__":
+    main()
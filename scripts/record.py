@@ -1,33 +1,67 @@
+import argparse
+import cProfile
+import importlib
+import math
+import pstats
+import signal
+import time
+from collections.abc import Callable
 from functools import partial
-from typing import Final
+from pathlib import Path
+from typing import TYPE_CHECKING, Final
 
-import sentry_sdk
 from sentry_sdk.crons import capture_checkin
 from sentry_sdk.crons.consts import MonitorStatus
 
-from envoy_recorder.envoy_recorder import EnvoyRecorder
+from envoy_recorder import metrics
+from envoy_recorder.config_loader import IntervalsConfig
+from envoy_recorder.daemon import BackgroundTask, Scheduler
+from envoy_recorder.envoy_recorder import MultiSiteRecorder
+from envoy_recorder.live_power import LivePowerSampler
 from envoy_recorder.logging import get_logger
+from envoy_recorder.monitoring import init_sentry
+
+if TYPE_CHECKING:
+    from sentry_sdk._types import MonitorConfig, MonitorConfigSchedule
 
 log = get_logger(__name__)
 
 MONITOR_SLUG: Final[str] = "envoy_reader"
+N_PROFILE_LINES: Final[int] = 40
 
 
-def start_sentry() -> str:
-    sentry_sdk.init(
-        dsn="https://fed4b02053480412686e0cdb49e8c7bd@o4510693003034624.ingest.de.sentry.io/4510693008146512",
-        # Add data like request headers and IP for users,
-        # see https://docs.sentry.io/platforms/python/data-management/data-collected/ for more info
-        send_default_pii=True,
-        enable_logs=True,
-    )
+# When cron starts us, we check in once a minute.
+CRON_SCHEDULE: Final[MonitorConfigSchedule] = {"type": "crontab", "value": "* * * * *"}
+CHECKIN_MARGIN_MINUTES: Final[int] = 5
+
+
+def daemon_monitor_config(intervals: IntervalsConfig) -> MonitorConfig:
+    """The schedule of the Sentry monitor when we run with `--daemon`, which checks in once per
+    poll (every `poll_every_n_seconds`) rather than once a minute."""
+    checkin_margin = CHECKIN_MARGIN_MINUTES
+    if intervals.adaptive_night_polling:
+        # At night, the Envoy is only polled every `night_poll_every_n_minutes`, so allow at least
+        # that long before Sentry considers a check-in missed.
+        checkin_margin = max(checkin_margin, intervals.night_poll_every_n_minutes)
+    return {
+        # Sentry's intervals are in whole minutes.
+        "schedule": {
+            "type": "interval",
+            "value": max(1, math.ceil(intervals.poll_every_n_seconds / 60)),
+            "unit": "minute",
+        },
+        "checkin_margin": checkin_margin,
+    }
 
+
+def start_checkin(overrides: MonitorConfig | None = None) -> str | None:
+    """`overrides` replaces parts of the default (cron) config. See `daemon_monitor_config`."""
     # All keys except 'schedule' are optional
-    monitor_config = {
-        "schedule": {"type": "crontab", "value": "* * * * *"},
+    monitor_config: MonitorConfig = {
+        "schedule": CRON_SCHEDULE,
         "timezone": "Europe/London",
         # If an expected check-in doesn't come in 'checkin_margin' minutes, it'll be considered missed
-        "checkin_margin": 5,
+        "checkin_margin": CHECKIN_MARGIN_MINUTES,
         # The check-in is allowed to run for 'max_runtime' minutes before it's considered failed
         "max_runtime": 10,
         # It'll take 'failure_issue_threshold' consecutive failed check-ins to create an issue
@@ -35,6 +69,8 @@ def start_sentry() -> str:
         # It'll take 'recovery_threshold' OK check-ins to resolve an issue
         "recovery_threshold": 5,
     }
+    if overrides is not None:
+        monitor_config.update(overrides)
 
     check_in_id = capture_checkin(
         monitor_config=monitor_config,
@@ -44,21 +80,173 @@ def start_sentry() -> str:
     return check_in_id
 
 
-def main():
-    check_in_id = start_sentry()
-    log.info("---------------------- Starting up! -----------------------------")
+def run_with_checkin(
+    func: Callable[[], None], name: str, monitor_config: MonitorConfig | None = None
+) -> None:
+    check_in_id = start_checkin(monitor_config)
     stop_sentry = partial(capture_checkin, monitor_slug=MONITOR_SLUG, check_in_id=check_in_id)
     try:
-        envoy_recorder = EnvoyRecorder()
-        envoy_recorder.run()
+        func()
     except:
-        log.exception("Exception raised in main()!")
+        log.exception("Exception raised in %s!", name)
         stop_sentry(status=MonitorStatus.ERROR)
         raise
     else:
-        log.info("Finished successfully!")
+        log.info("Finished %s successfully!", name)
         stop_sentry(status=MonitorStatus.OK)
 
 
+def run_once() -> None:
+    # Cron starts us at the start of each minute, so this is how late the poll is (e.g. because the
+    # machine is busy with a flush).
+    poll_delay = time.time() % 60
+    recorder = MultiSiteRecorder()  # Loads the config, which says where to record metrics.
+    if recorder.config.live_power.enabled:
+        log.warning("`live_power.enabled` is ignored, because live power sampling needs --daemon.")
+    metrics.distribution(name="envoy.poll_delay", value=poll_delay, unit="seconds")
+    recorder.run()
+
+
+def run_once_with_profiler(profile_path: Path) -> None:
+    """Flush every site now (even if its live buffer isn't old enough to flush yet), without
+    polling the Envoy, under cProfile. The flush runs in this thread, so cProfile sees every call."""
+    recorder = MultiSiteRecorder()
+    # Import the flush code (and Polars) first, so the profile isn't dominated by the imports.
+    for module in ("envoy_recorder.parquet_archive", "envoy_recorder.rollups"):
+        importlib.import_module(module)
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(recorder.flush)
+    finally:
+        profiler.dump_stats(profile_path)
+        stats = pstats.Stats(profiler)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(N_PROFILE_LINES)
+        log.info("Saved the profile of the flush to %s", profile_path)
+    recorder.start_upload_worker_if_needed()
+
+
+def run_daemon() -> None:
+    """Keep the config, imports and HTTP session warm, instead of cold-starting every minute."""
+    recorder = MultiSiteRecorder()
+    intervals = recorder.config.intervals
+    # Upload in a background thread, so a slow uplink never delays polling the Envoy.
+    uploads = BackgroundTask(
+        intervals.poll_every_n_seconds, recorder.drain_upload_queues, name="upload"
+    )
+
+    def flush_then_upload() -> None:
+        try:
+            recorder.flush_unless_night()
+        finally:
+            uploads.wake()
+
+    # Flush in another background thread, so a slow flush never delays polling the Envoy. The first
+    # flush happens straight away, which also recovers any live buffers left behind by a crash.
+    flushes = BackgroundTask(
+        intervals.flush_buffer_every_n_minutes * 60, flush_then_upload, name="flush"
+    )
+    scheduler = Scheduler()
+    scheduler.every(
+        intervals.poll_every_n_seconds,
+        partial(
+            run_with_checkin,
+            recorder.fetch_and_buffer,
+            "fetch_and_buffer",
+            daemon_monitor_config(intervals),
+        ),
+        name="fetch_and_buffer",
+    )
+
+    # Sample each site's power every few seconds. See `envoy_recorder/live_power.py`.
+    live_power = recorder.config.live_power
+    samplers = []
+    if live_power.enabled:
+        samplers = [LivePowerSampler(r.config) for r in recorder.recorders]
+    # Each sampler gets its own `Scheduler`, in its own thread, because a poll of a stalled Envoy can
+    # retry for up to 45 seconds, which would otherwise delay the samples (and vice versa).
+    sampler_schedulers = []
+    for sampler in samplers:
+        sampler_scheduler = Scheduler()
+        sampler_scheduler.every(
+            live_power.sample_every_n_seconds, sampler.sample, name=f"live_power_{sampler.site}"
+        )
+        sampler_schedulers.append(sampler_scheduler)
+
+    def write_live_power() -> None:
+        for sampler in samplers:
+            sampler.write()
+
+    live_power_writes = BackgroundTask(
+        live_power.write_every_n_minutes * 60, write_live_power, name="live_power"
+    )
+
+    def stop_schedulers() -> None:
+        for s in [scheduler, *sampler_schedulers]:
+            s.stop()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_schedulers())
+    uploads.start()
+    flushes.start()
+    sampler_threads = [
+        s.start_thread(f"live_power_{sampler.site}")
+        for s, sampler in zip(sampler_schedulers, samplers)
+    ]
+    if samplers:
+        live_power_writes.start()
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        log.info("Interrupted by user.")
+    finally:
+        # Give a flush in progress a chance to finish. (If it doesn't, its live buffer is recovered
+        # by the next flush.)
+        flushes.stop(timeout=60)
+        uploads.stop(timeout=10)
+        stop_schedulers()
+        for thread in sampler_threads:
+            thread.join(timeout=live_power.sample_every_n_seconds)
+        if samplers:
+            live_power_writes.stop(timeout=10)
+            # Save the minutes which have finished since the last write.
+            write_live_power()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record data from an Enphase Envoy.")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Run forever, polling the Envoy every `intervals.poll_every_n_seconds`, instead of"
+        " running once (which is what cron expects).",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=Path("flush.prof"),
+        type=Path,
+        metavar="PATH",
+        help="Don't poll the Envoy. Instead, flush the live buffer now, and profile the flush with"
+        " cProfile. Prints the slowest functions, and saves the full profile to PATH (default:"
+        " flush.prof), which can be viewed with e.g. `python -m pstats` or snakeviz.",
+    )
+    args = parser.parse_args()
+    if args.daemon and args.profile:
+        parser.error("--profile can't be used with --daemon.")
+
+    init_sentry()
+    log.info("---------------------- Starting up! -----------------------------")
+    if args.daemon:
+        run_daemon()
+    elif args.profile:
+
+        def run_once_and_profile_flush() -> None:
+            run_once_with_profiler(args.profile)
+
+        run_with_checkin(run_once_and_profile_flush, "run_once_and_profile_flush")
+    else:
+        run_with_checkin(run_once, "run_once")
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,44 @@
+"""Train a Zstandard dictionary on sample responses from the Envoy.
+
+For example:
+
+    uv run scripts/train_zstd_dictionary.py example_envoy_json_data/*.json
+
+The dictionary is saved to `config.paths.zstd_dictionaries` and is used to compress new responses
+when `config.live_buffer.compression = "zstd"`. Old dictionaries are kept, so responses compressed
+with old dictionaries stay readable.
+"""
+
+import argparse
+from pathlib import Path
+
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.logging import get_logger
+from envoy_recorder.payload_compression import save_dictionary, train_dictionary
+
+log = get_logger(__name__)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("samples", nargs="+", type=Path, help="Uncompressed JSON responses.")
+    parser.add_argument("--dict-size", type=int, default=16 * 1024, help="In bytes.")
+    parser.add_argument(
+        "--site",
+        help="The name of the Envoy to train the dictionary for. Required if there are multiple"
+        " Envoys, because each site has its own dictionary.",
+    )
+    args = parser.parse_args()
+
+    site_configs = EnvoyRecorderConfig.load().site_configs()
+    if args.site is not None:
+        site_configs = [c for c in site_configs if c.envoy and c.envoy.name == args.site]
+    if len(site_configs) != 1:
+        parser.error("Please use --site to choose exactly one Envoy.")
+    samples = [path.read_bytes() for path in args.samples]
+    zstd_dict = train_dictionary(samples, dict_size=args.dict_size)
+    save_dictionary(zstd_dict, site_configs[0].paths.zstd_dictionaries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+from datetime import datetime
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from envoy_recorder.logging import get_logger
+
+log = get_logger(__name__)
+
+
+class ArchiveManifest(BaseModel):
+    """A small summary of the Parquet archive, stored as JSON next to the archive.
+
+    This lets the flush throw away rows which are already in the archive *before* reading any
+    Parquet. This matters at night, when the Envoy repeats the last reading from earlier in the day,
+    so none of the rows in the live buffer are new.
+
+    The manifest is updated *after* the Parquet has been written. So, if we crash between writing
+    the Parquet and writing the manifest, the watermarks will lag behind the archive, which is
+    safe: those rows will be de-duplicated against the archive the next time we flush.
+    """
+
+    # The latest `period_end_time` in the archive for each micro-inverter, keyed by serial number.
+    watermarks: dict[str, datetime] = {}
+
+    # The number of rows in each Hive partition, keyed by the partition's path relative to the
+    # archive, e.g. "year=2026/month=1".
+    partition_row_counts: dict[str, int] = {}
+
+    @classmethod
+    def load(cls, path: Path) -> ArchiveManifest | None:
+        """Returns None if the manifest doesn't exist or can't be parsed."""
+        try:
+            return cls.model_validate_json(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            log.exception("Failed to parse archive manifest %s. It will be rebuilt.", path)
+            return None
+
+    def save(self, path: Path) -> None:
+        """Atomically replace the manifest on disk."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(self.model_dump_json(indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path.replace(path)
@@ -3,37 +3,275 @@ import tomllib
 from pathlib import Path
 from typing import Literal
 
-from pydantic import BaseModel, Field, IPvAnyAddress
+from pydantic import BaseModel, Field, IPvAnyAddress, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from envoy_recorder import metrics
+
 
 class PathsConfig(BaseModel):
     # The live_buffer path will contain two directories: incoming and processing_<timestamp>
     live_buffer: Path = Path("./data/live_buffer")
     parquet_archive: Path = Path("./data/parquet_archive")
+    # Hourly and daily aggregates of the Parquet archive. See `rollups.py`.
+    rollups: Path = Path("./data/rollups")
+    # Recent rows which haven't been compacted into the Parquet archive yet, as Arrow IPC files.
+    # Only written to if `archive.hot_tier` is true. See `hot_tier.py`.
+    hot_tier: Path = Path("./data/hot_tier")
+    # Monthly bundles of every raw response from the Envoy. Only written to if
+    # `live_buffer.keep_raw_payloads` is true. See `raw_bundles.py`.
+    raw_bundles: Path = Path("./data/raw_bundles")
+    # 1-minute aggregates of the site's power, sampled every few seconds. Only written to if
+    # `live_power.enabled` is true. See `live_power.py`.
+    live_power: Path = Path("./data/live_power")
+    # Small bookkeeping files (e.g. the archive manifest). These can't live inside the
+    # parquet_archive directory because `pl.scan_parquet` refuses to read a directory which contains
+    # non-Parquet files.
+    state: Path = Path("./data/state")
     storage_bucket: str  #  remote_name:bucket_name/path
 
+    def for_site(self, site: str) -> PathsConfig:
+        """Each site gets its own live buffer and state, and its own Hive partition in the archive
+        and in the bucket."""
+        return self.model_copy(
+            update={
+                "live_buffer": self.live_buffer / site,
+                "parquet_archive": self.parquet_archive / f"site={site}",
+                "rollups": self.rollups / f"site={site}",
+                "hot_tier": self.hot_tier / f"site={site}",
+                "raw_bundles": self.raw_bundles / site,
+                "live_power": self.live_power / f"site={site}",
+                "state": self.state / site,
+                "storage_bucket": f"{self.storage_bucket.rstrip('/')}/site={site}",
+            }
+        )
+
     def create_directories(self) -> None:
         self.live_buffer_incoming.mkdir(parents=True, exist_ok=True)
         self.parquet_archive.mkdir(parents=True, exist_ok=True)
+        self.rollups.mkdir(parents=True, exist_ok=True)
+        self.state.mkdir(parents=True, exist_ok=True)
 
     @property
     def live_buffer_incoming(self) -> Path:
         return self.live_buffer / "incoming"
 
+    @property
+    def archive_manifest(self) -> Path:
+        return self.state / "archive_manifest.json"
+
+    @property
+    def zstd_dictionaries(self) -> Path:
+        return self.live_buffer / "zstd_dictionaries"
+
+    @property
+    def upload_manifest(self) -> Path:
+        return self.state / "upload_manifest.json"
+
+    @property
+    def upload_queue(self) -> Path:
+        return self.state / "upload_queue"
+
+    @property
+    def upload_lock(self) -> Path:
+        return self.state / "upload.lock"
+
+    @property
+    def rebuild(self) -> Path:
+        """Where `scripts/rebuild_archive.py` writes the new archive, and keeps the old archive."""
+        return self.state / "rebuild"
+
+    @property
+    def flush_lock(self) -> Path:
+        return self.state / "flush.lock"
+
+    @property
+    def fetch_lock(self) -> Path:
+        return self.state / "fetch.lock"
+
+    @property
+    def live_buffer_lock(self) -> Path:
+        return self.state / "live_buffer.lock"
+
+    @property
+    def last_payload_fingerprint(self) -> Path:
+        return self.state / "last_payload_fingerprint"
+
+    @property
+    def pending_rollup_days(self) -> Path:
+        """The days whose rollups still need recomputing. See `rollups.py`."""
+        return self.state / "pending_rollup_days.json"
+
+    @property
+    def last_production(self) -> Path:
+        """Touched whenever the Envoy reports a new reading with non-zero energy. See `night.py`."""
+        return self.state / "last_production"
+
 
 class IntervalsConfig(BaseModel):
     flush_buffer_every_n_minutes: int = 15
+    # Only used when `scripts/record.py` runs with `--daemon`. (When called from cron, the polling
+    # interval is set by the crontab.)
+    poll_every_n_seconds: int = 60
+
+    # At night, poll the Envoy every `night_poll_every_n_minutes` (instead of every poll), and don't
+    # flush. See `night.py`. It's night once no energy has been produced for
+    # `night_after_n_minutes_without_production` and (if the Envoy's `latitude` and `longitude` are
+    # set) whilst the sun is below `night_below_solar_elevation_degrees`.
+    adaptive_night_polling: bool = False
+    # Each micro-inverter reports every 15 minutes, so keep this below 15 to catch the first reading
+    # of the morning before it's replaced.
+    night_poll_every_n_minutes: int = Field(default=10, gt=0)
+    # Must be longer than `flush_buffer_every_n_minutes`, so the evening's readings are flushed
+    # before we stop flushing.
+    night_after_n_minutes_without_production: int = 60
+    # -6 degrees is the end of civil twilight.
+    night_below_solar_elevation_degrees: float = -6
+
+    @model_validator(mode="after")
+    def _check_night(self) -> IntervalsConfig:
+        if (
+            self.adaptive_night_polling
+            and self.night_after_n_minutes_without_production <= self.flush_buffer_every_n_minutes
+        ):
+            raise ValueError(
+                "`night_after_n_minutes_without_production` must be longer than"
+                " `flush_buffer_every_n_minutes`!"
+            )
+        return self
+
+
+class LiveBufferConfig(BaseModel):
+    # - "files": save each response from the Envoy to its own `<timestamp>.json.gz` file.
+    # - "segment": append each response to a single `segment.wal` file per buffer period. See
+    #   `segment.py`. Both formats can always be read, so it's safe to switch between formats.
+    format: Literal["files", "segment"] = "files"
+    # "zstd" uses the dictionary trained by `scripts/train_zstd_dictionary.py` (if there is one).
+    # Old responses stay readable if you change this.
+    compression: Literal["gzip", "zstd"] = "gzip"
+
+    # What to do with a response from the Envoy which contains exactly the same readings as the
+    # previous response:
+    # - "keep": save it to the live buffer anyway.
+    # - "marker": save a zero-byte `<timestamp>.dup` file, to record that the poll succeeded.
+    # - "skip": don't save anything.
+    # Responses which can't be parsed are always kept.
+    duplicate_payloads: Literal["keep", "marker", "skip"] = "marker"
+
+    # Before deleting the live buffer after each flush, append its responses to a compressed
+    # monthly bundle in `paths.raw_bundles`, so the whole archive can be regenerated from the raw
+    # responses with `scripts/rebuild_archive.py` (e.g. after changing `json_to_dataframe.py`).
+    keep_raw_payloads: bool = False
+
+    # The live buffer is parsed in chunks, so that a flush after a long backlog (e.g. after the
+    # flush has been failing for days) doesn't run out of memory. This is roughly the peak memory
+    # used by the parsing (on top of Python, Polars, and the archive partitions being merged).
+    flush_memory_budget_mb: int = Field(default=256, gt=0)
+
+    @property
+    def flush_chunk_json_bytes(self) -> int:
+        """How much (decompressed) JSON to parse in each chunk of the live buffer. Parsing a chunk
+        takes roughly twice as much memory as its JSON, plus some headroom."""
+        return self.flush_memory_budget_mb * 1_000_000 // 3
+
+
+class LivePowerConfig(BaseModel):
+    # Sample the site's power every `sample_every_n_seconds`, and save 1-minute aggregates to
+    # `paths.live_power`. Only works when `scripts/record.py` runs with `--daemon`. See
+    # `live_power.py`.
+    enabled: bool = False
+    sample_every_n_seconds: float = Field(default=5, gt=0)
+    # The number of recent samples kept in memory. Must hold at least two minutes of samples.
+    ring_buffer_size: int = Field(default=720, gt=0)
+    # The 1-minute aggregates are kept in memory until they're written to Parquet. (If the daemon
+    # is killed, up to this many minutes of aggregates are lost.)
+    write_every_n_minutes: int = Field(default=15, gt=0)
+
+    @model_validator(mode="after")
+    def _check_ring_buffer_size(self) -> LivePowerConfig:
+        if self.ring_buffer_size * self.sample_every_n_seconds < 120:
+            raise ValueError(
+                "`ring_buffer_size` must hold at least two minutes of samples (at one sample every"
+                f" {self.sample_every_n_seconds} seconds)!"
+            )
+        return self
+
+
+class ArchiveConfig(BaseModel):
+    # How to lay out each Parquet file in the archive. See `write_parquet_file` in
+    # `parquet_archive.py`. Most queries are "one inverter over a week" or "all inverters for one day".
+    # - "per_serial_number": start a new row group for each micro-inverter, so a reader which only
+    #   wants one inverter can skip the other inverters' row groups (using the min/max statistics
+    #   of `serial_number`). With the "polars" writer, the row-group size is set to the number of
+    #   rows of the largest inverter, so the row groups are only exactly aligned when every
+    #   inverter has the same number of rows (which is normally the case). The "pyarrow" writer
+    #   always aligns the row groups exactly.
+    # - "default": let the Parquet writer choose (Polars' default is 512^2 rows per row group, so
+    #   each monthly partition is a single row group).
+    # `benchmarks/parquet_layout.py` shows that "per_serial_number" reads about 20x fewer bytes for
+    # a one-inverter query, which matters when reading over the network (e.g. from the bucket). But
+    # files are a little larger, and reading a local file is a little slower, so it's not the
+    # default.
+    row_groups: Literal["per_serial_number", "default"] = "default"
+    # - "min_max": write min/max statistics for every column.
+    # - "full": also write the number of distinct values and the number of nulls.
+    statistics: Literal["min_max", "full"] = "full"
+    # The "pyarrow" writer needs `pyarrow` to be installed. It also writes the Parquet page index
+    # and records that the rows are sorted by `serial_number` and `period_end_time`.
+    writer: Literal["polars", "pyarrow"] = "polars"
+    # Write a Bloom filter for `serial_number`. Requires the "pyarrow" writer.
+    serial_number_bloom_filter: bool = False
+    compression_level: int | None = None
+    # Append each flush's new rows to the Arrow IPC "hot tier" (see `hot_tier.py`) instead of
+    # re-writing the current month's Parquet partition. The hot tier is compacted into Parquet at the
+    # end of each month, and whenever the oldest IPC file in a partition is older than
+    # `compact_hot_tier_every_n_minutes`. Only compacted rows are uploaded to the bucket.
+    hot_tier: bool = False
+    compact_hot_tier_every_n_minutes: int = 24 * 60
+
+    @model_validator(mode="after")
+    def _check_bloom_filter(self) -> ArchiveConfig:
+        if self.serial_number_bloom_filter and self.writer != "pyarrow":
+            raise ValueError("`serial_number_bloom_filter` requires `writer = 'pyarrow'`!")
+        return self
+
+
+class UploadConfig(BaseModel):
+    # - "rclone": upload to `paths.storage_bucket` with `rclone copyto`.
+    # - "local": treat `paths.storage_bucket` as a local directory. Useful for testing.
+    uploader: Literal["rclone", "local"] = "rclone"
+    # Failed uploads are retried with jittered exponential backoff, by later runs.
+    retry_base_backoff_seconds: float = 60
+    retry_max_backoff_seconds: float = 60 * 60
 
 
 class EnvoyConfig(BaseModel):
+    # The name of the site. Only required if there are multiple Envoys. Used in paths, and as the
+    # value of the `site` Hive partition in the Parquet archive.
+    name: str | None = Field(default=None, pattern=r"^[A-Za-z0-9_-]+$")
     ip_address: IPvAnyAddress
     token: str
+    port: int = 80
+    request_timeout_seconds: float = 10
+    # Failed requests are retried (with jittered exponential backoff) until we've made
+    # `max_attempts`, or until we'd overrun `retry_window_seconds`, which should be shorter than the
+    # polling interval.
+    max_attempts: int = 5
+    retry_window_seconds: float = 45
+    retry_base_backoff_seconds: float = 1
+    retry_max_backoff_seconds: float = 10
+    # The location of the site, in degrees. Optional. Used to compute the sun's elevation when
+    # `intervals.adaptive_night_polling` is enabled, so polling speeds up again just before dawn.
+    latitude: float | None = Field(default=None, ge=-90, le=90)
+    longitude: float | None = Field(default=None, ge=-180, le=180)
 
 
 class LoggingConfig(BaseModel):
     level: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
     log_file_for_record_script: Path | None = None
+    # Append every metric (including the duration of each stage of each run) to this JSON-lines
+    # file, as well as sending the metrics to Sentry. See `metrics.py`.
+    metrics_file: Path | None = None
 
 
 class EnvoyRecorderConfig(BaseSettings):
@@ -41,9 +279,47 @@ class EnvoyRecorderConfig(BaseSettings):
 
     paths: PathsConfig = Field(default_factory=PathsConfig)
     intervals: IntervalsConfig = Field(default_factory=IntervalsConfig)
-    envoy: EnvoyConfig
+    live_buffer: LiveBufferConfig = Field(default_factory=LiveBufferConfig)
+    archive: ArchiveConfig = Field(default_factory=ArchiveConfig)
+    upload: UploadConfig = Field(default_factory=UploadConfig)
+    live_power: LivePowerConfig = Field(default_factory=LivePowerConfig)
+    # Set *either* `envoy` (if you have a single Envoy) *or* `envoys` (if you have multiple sites).
+    envoy: EnvoyConfig | None = None
+    envoys: list[EnvoyConfig] = []
     logging: LoggingConfig = Field(default_factory=LoggingConfig)
 
+    @model_validator(mode="after")
+    def _check_envoys(self) -> EnvoyRecorderConfig:
+        if (self.envoy is None) == (len(self.envoys) == 0):
+            raise ValueError("Exactly one of `envoy` or `envoys` must be set!")
+        names = [envoy.name for envoy in self.envoys]
+        if None in names:
+            raise ValueError("Every Envoy in `envoys` must have a `name`!")
+        if len(set(names)) != len(names):
+            raise ValueError(f"The names of the Envoys must be unique, not {names}!")
+        return self
+
+    def site_configs(self) -> list[EnvoyRecorderConfig]:
+        """Split into one config per Envoy. Each config has a single `envoy`.
+
+        A single `envoy` keeps the original (un-partitioned by site) paths.
+        """
+        if self.envoy is not None:
+            return [self]
+        return [
+            # A deep copy, so the sites don't share (and can't modify) each other's nested configs.
+            self.model_copy(
+                update={
+                    "envoy": envoy.model_copy(deep=True),
+                    "envoys": [],
+                    "paths": self.paths.for_site(envoy.name),
+                },
+                deep=True,
+            )
+            for envoy in self.envoys
+            if envoy.name is not None
+        ]
+
     @classmethod
     def load(cls, path: str = "config.toml") -> EnvoyRecorderConfig:
         user_data = {}
@@ -60,3 +336,4 @@ class EnvoyRecorderConfig(BaseSettings):
         if self.logging.log_file_for_record_script:
             file_handler = logging.FileHandler(self.logging.log_file_for_record_script)
             log.addHandler(file_handler)
+        metrics.set_metrics_file(self.logging.metrics_file)
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from envoy_recorder import metrics
+from envoy_recorder.logging import get_logger
+
+log = get_logger(__name__)
+
+
+@dataclass
+class _Task:
+    name: str
+    interval_seconds: float
+    func: Callable[[], None]
+    next_run: float  # In `time.monotonic()` seconds.
+
+
+class Scheduler:
+    """A minimal timer loop which calls each task on a fixed cadence, in a single thread.
+
+    Running as a long-lived daemon means we only pay once for importing Polars, parsing the config,
+    and opening a connection to the Envoy, instead of paying for all of that every minute.
+
+    Tasks run one after the other. If a task overruns (e.g. a poll which is retrying a stalled Envoy)
+    then the other tasks' missed runs are skipped (not queued up), so we don't hammer the Envoy to
+    catch up. Slow work (like flushing and uploading) belongs in a `BackgroundTask`.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: list[_Task] = []
+        self._stop_event = threading.Event()
+
+    def every(
+        self,
+        interval_seconds: float,
+        func: Callable[[], None],
+        name: str = "",
+        delay_first_run: bool = False,
+    ) -> None:
+        """Call `func` every `interval_seconds`.
+
+        The first call happens as soon as `run_forever` starts, unless `delay_first_run` is True, in
+        which case the first call happens after `interval_seconds`.
+        """
+        assert interval_seconds > 0, f"interval_seconds must be positive, not {interval_seconds}"
+        next_run = time.monotonic()
+        if delay_first_run:
+            next_run += interval_seconds
+        task = _Task(
+            name=name or getattr(func, "__name__", repr(func)),
+            interval_seconds=interval_seconds,
+            func=func,
+            next_run=next_run,
+        )
+        self._tasks.append(task)
+
+    def stop(self) -> None:
+        """Ask `run_forever` to return. Safe to call from a signal handler or another thread."""
+        self._stop_event.set()
+
+    def start_thread(self, name: str) -> threading.Thread:
+        """Call `run_forever` in its own (daemon) thread. So tasks which can stall for a long time
+        (e.g. polling an unresponsive Envoy) don't delay the tasks of another `Scheduler`."""
+        thread = threading.Thread(target=self.run_forever, name=name, daemon=True)
+        thread.start()
+        return thread
+
+    def run_forever(self) -> None:
+        assert len(self._tasks) > 0, "No tasks have been scheduled!"
+        log.info("Scheduler starting with tasks: %s", [t.name for t in self._tasks])
+        while not self._stop_event.is_set():
+            task = min(self._tasks, key=lambda t: t.next_run)
+            delay = task.next_run - time.monotonic()
+            if delay > 0 and self._stop_event.wait(timeout=delay):
+                break
+            # How late the task starts (e.g. because another task overran).
+            metrics.distribution(
+                name="daemon.task_delay",
+                value=max(0, -delay),
+                unit="seconds",
+                attributes={"task": task.name},
+            )
+            self._run_task(task)
+
+            # Schedule the next run on the fixed cadence, skipping any runs we've missed.
+            now = time.monotonic()
+            task.next_run += task.interval_seconds
+            if task.next_run <= now:
+                n_missed = int((now - task.next_run) // task.interval_seconds) + 1
+                log.warning("Task '%s' skipped %d run(s) because it overran.", task.name, n_missed)
+                metrics.count(
+                    name="daemon.skipped_runs", value=n_missed, attributes={"task": task.name}
+                )
+                task.next_run += n_missed * task.interval_seconds
+        log.info("Scheduler stopped.")
+
+    def _run_task(self, task: _Task) -> None:
+        log.debug("Running task '%s'", task.name)
+        try:
+            task.func()
+        except Exception:
+            # Keep the daemon alive. The next cycle might well succeed (e.g. if the Envoy was
+            # temporarily unresponsive).
+            log.exception("Exception raised by task '%s'!", task.name)
+
+
+class BackgroundTask:
+    """Call `func` in its own thread, every `interval_seconds`, or sooner if `wake` is called.
+
+    This is for slow work (e.g. uploading to the cloud) which mustn't delay the `Scheduler`'s tasks.
+    """
+
+    def __init__(self, interval_seconds: float, func: Callable[[], None], name: str = "") -> None:
+        assert interval_seconds > 0, f"interval_seconds must be positive, not {interval_seconds}"
+        self._interval_seconds = interval_seconds
+        self._func = func
+        self._name = name or getattr(func, "__name__", repr(func))
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def wake(self) -> None:
+        """Run `func` as soon as the current run (if any) has finished."""
+        self._wake_event.set()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop_event.set()
+        self._wake_event.set()
+        self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                self._func()
+            except Exception:
+                log.exception("Exception raised by background task '%s'!", self._name)
+            self._wake_event.wait(timeout=self._interval_seconds)
+            self._wake_event.clear()
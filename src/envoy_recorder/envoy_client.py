@@ -0,0 +1,126 @@
+import random
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from envoy_recorder import metrics
+from envoy_recorder.config_loader import EnvoyConfig
+from envoy_recorder.logging import get_logger
+
+log = get_logger(__name__)
+
+# `requests` refuses a timeout of zero (or less), which is what's left of the retry window if
+# `time.sleep` overshoots the deadline.
+_MIN_TIMEOUT_SECONDS = 0.1
+
+
+class EnvoyClient:
+    """Fetch data from the Envoy over a persistent (keep-alive) HTTP connection.
+
+    The Envoy often stops responding for a few seconds (perhaps whilst it uploads to Enphase). So,
+    if a request fails, we retry with jittered exponential backoff, for as long as we can whilst
+    still finishing within `EnvoyConfig.retry_window_seconds` (which should be shorter than the
+    polling interval).
+    """
+
+    def __init__(self, config: EnvoyConfig) -> None:
+        self._config = config
+        self._session = requests.Session()
+        # We poll a single host, from a single thread, so we only need a tiny connection pool.
+        # Retries are handled by `fetch_device_data` (not urllib3), so they respect the deadline.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._session.headers["Authorization"] = f"Bearer {config.token}"
+        # The Envoy uses self-signed certs.
+        self._session.verify = False
+        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    @property
+    def device_data_url(self) -> str:
+        return f"http://{self._config.ip_address}:{self._config.port}/ivp/pdm/device_data"
+
+    @property
+    def production_url(self) -> str:
+        return f"http://{self._config.ip_address}:{self._config.port}/production.json"
+
+    def fetch_device_data(self) -> str:
+        """Returns the Envoy's response text. Raises the last exception if every attempt fails."""
+        return self._get(self.device_data_url, self._config.retry_window_seconds)
+
+    def fetch_production(self, retry_window_seconds: float | None = None) -> str:
+        """Returns the Envoy's `/production.json` (the current power of the whole site). See
+        `live_power.py`. Pass a `retry_window_seconds` which is shorter than the sampling interval."""
+        if retry_window_seconds is None:
+            retry_window_seconds = self._config.retry_window_seconds
+        return self._get(self.production_url, retry_window_seconds)
+
+    def _get(self, url: str, retry_window_seconds: float) -> str:
+        deadline = time.monotonic() + retry_window_seconds
+        attempt = 0
+        last_error: requests.RequestException | None = None
+        while True:
+            attempt += 1
+            remaining_seconds = deadline - time.monotonic()
+            if last_error is not None and remaining_seconds <= 0:
+                log.warning("The retry window for %s has passed. Giving up.", url)
+                raise last_error
+            timeout = max(
+                _MIN_TIMEOUT_SECONDS,
+                min(self._config.request_timeout_seconds, remaining_seconds),
+            )
+            log.debug("Fetching data from %s (attempt %d)...", url, attempt)
+            t0 = time.monotonic()
+            try:
+                response = self._session.get(url, timeout=timeout)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self._record_request_metrics(time.monotonic() - t0, success=False)
+                backoff = self._backoff_seconds(attempt)
+                if (
+                    not _is_retryable(e)
+                    or attempt >= self._config.max_attempts
+                    or time.monotonic() + backoff >= deadline
+                ):
+                    log.warning("Attempt %d to fetch %s failed: %r. Giving up.", attempt, url, e)
+                    raise
+                last_error = e
+                log.warning(
+                    "Attempt %d to fetch %s failed: %r. Retrying in %.1f seconds.",
+                    attempt,
+                    url,
+                    e,
+                    backoff,
+                )
+                time.sleep(backoff)
+            else:
+                self._record_request_metrics(time.monotonic() - t0, success=True)
+                metrics.distribution(name="envoy.request.attempts", value=attempt)
+                log.debug("Successfully retrieved data from %s.", url)
+                return response.text
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        """Exponential backoff with "full jitter"."""
+        cap = self._config.retry_max_backoff_seconds
+        return random.uniform(
+            0, min(cap, self._config.retry_base_backoff_seconds * 2 ** (attempt - 1))
+        )
+
+    def _record_request_metrics(self, latency_seconds: float, success: bool) -> None:
+        metrics.distribution(
+            name="envoy.request.latency",
+            value=latency_seconds,
+            unit="seconds",
+            attributes={"success": success},
+        )
+        if not success:
+            metrics.count(name="envoy.request.failures", value=1)
+
+
+def _is_retryable(e: requests.RequestException) -> bool:
+    """Retry connection errors, timeouts and server errors. Don't retry e.g. 401 Unauthorized."""
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code >= 500
+    return True
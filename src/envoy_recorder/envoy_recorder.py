@@ -1,68 +1,253 @@
-import gzip
+# This module is imported every minute by cron, so it should be quick to import! Please don't
+# import Polars or Patito here (not even indirectly). The flush code, which needs Polars, lives in
+# `parquet_archive.py` and is only imported when it's time to flush the live buffer.
+import resource
 import shutil
-import subprocess
+import sys
 import time
-from datetime import date
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import patito as pt
-import polars as pl
-import requests
-import sentry_sdk
-import urllib3
-from requests import Response
-
+from envoy_recorder import flush_worker, metrics
 from envoy_recorder.config_loader import EnvoyRecorderConfig
-from envoy_recorder.json_to_dataframe import (
-    PRIMARY_KEYS,
-    convert_directory_of_json_files_to_dataframe,
+from envoy_recorder.envoy_client import EnvoyClient
+from envoy_recorder.live_buffer import (
+    contains_production,
+    fingerprint_payload,
+    list_payload_files,
+    read_fingerprint,
+    timestamp_of_payload_file,
+    write_fingerprint,
 )
+from envoy_recorder.locks import lock, try_lock
 from envoy_recorder.logging import get_logger
-from envoy_recorder.schemas import ProcessedEnvoyDataFrame
+from envoy_recorder.night import NightSchedule
+from envoy_recorder.payload_compression import (
+    FILE_SUFFIXES,
+    compress,
+    copy_dictionary_into,
+    current_dictionary_path,
+    load_dictionary,
+)
+from envoy_recorder.raw_bundles import append_to_bundles
+from envoy_recorder.segment import SEGMENT_FILENAME, append_frame, read_first_timestamp
+from envoy_recorder.upload_queue import UploadQueue, start_worker_process
 
 log = get_logger(__name__)
 
 
 class EnvoyRecorder:
-    def __init__(self) -> None:
-        self._config = EnvoyRecorderConfig.load()
+    """Record data from a single Envoy. See `MultiSiteRecorder` for recording multiple Envoys."""
+
+    def __init__(self, config: EnvoyRecorderConfig | None = None) -> None:
+        self._config = EnvoyRecorderConfig.load() if config is None else config
+        assert self._config.envoy is not None, "Use `MultiSiteRecorder` for multiple Envoys."
+        self._envoy = self._config.envoy
         self._config.paths.create_directories()
+        # Re-use the same HTTP connection across polls when we're running as a daemon.
+        self._envoy_client = EnvoyClient(self._envoy)
+        self._upload_queue = UploadQueue(self._config)
+        # Created on the first flush (because it needs Polars). When we're running as a daemon, this
+        # keeps the partitions we've just flushed in memory, ready for the next flush.
+        self._archive_reader = None
+        self._zstd_dictionary_path = None
+        self._zstd_dict = None
+        if self._config.live_buffer.compression == "zstd":
+            self._zstd_dictionary_path = current_dictionary_path(
+                self._config.paths.zstd_dictionaries
+            )
+            if self._zstd_dictionary_path is None:
+                log.warning(
+                    "No Zstandard dictionary found in %s. Compressing without a dictionary. Run"
+                    " `scripts/train_zstd_dictionary.py` to train a dictionary.",
+                    self._config.paths.zstd_dictionaries,
+                )
+            else:
+                self._zstd_dict = load_dictionary(self._zstd_dictionary_path)
+        self._night_schedule = None
+        if self._config.intervals.adaptive_night_polling:
+            self._night_schedule = NightSchedule(
+                self._config.intervals, self._envoy, self._config.paths.last_production
+            )
+
+    @property
+    def config(self) -> EnvoyRecorderConfig:
+        return self._config
+
+    @property
+    def site(self) -> str | None:
+        return self._envoy.name
+
+    @property
+    def upload_queue(self) -> UploadQueue:
+        return self._upload_queue
 
     def run(self) -> None:
-        envoy_data = self._fetch_data_from_envoy()
-        self._save_to_live_buffer(envoy_data)
-        if self._live_buffer_is_old_enough_to_flush():
-            log.info("Flushing incoming live buffer to parquet archive...")
-            new_live_buffer_path = self._move_live_buffer()
-            merged_df = self._append_to_parquet_in_memory(new_live_buffer_path)
-            shutil.rmtree(new_live_buffer_path)
-            if merged_df is None:
-                # Don't bother writing a new Parquet to disk if there's no new data. For example, this
-                # will happen at night, when the inverters stop reporting data but the envoy repeats the
-                # last reading from earlier in the day.
-                log.info("merged dataframe == old dataframe. Nothing to save to disk.")
+        """Run one complete cycle. This is what cron calls once per minute."""
+        self.fetch_and_buffer()
+        self.flush_if_old_enough()
+
+    def flush_if_old_enough(self) -> None:
+        if self.wants_to_flush():
+            self.flush()
+
+    def wants_to_flush(self) -> bool:
+        """True if the live buffer is old enough to flush (and it isn't night). This is quick, and
+        doesn't import Polars."""
+        # Also flush straight away if a crashed flush left a live buffer behind (e.g. after a
+        # power cut), so that the data isn't stuck there.
+        if self._live_buffer_is_old_enough_to_flush() or self._has_orphaned_live_buffers():
+            return not self._skip_flush_at_night()
+        return False
+
+    def flush_unless_night(self) -> None:
+        """Flush, unless `adaptive_night_polling` is enabled and it's night. See `night.py`."""
+        if not self._skip_flush_at_night():
+            self.flush()
+
+    def is_flushing(self) -> bool:
+        """True if another process (or thread) is flushing this site right now."""
+        with try_lock(self._config.paths.flush_lock) as locked:
+            return not locked
+
+    def fetch_and_buffer(self) -> None:
+        with metrics.with_attributes(**self._metric_attributes):
+            if self._night_schedule is not None and not self._night_schedule.should_poll():
+                log.debug("It's night, so we're polling less often. Skipping this poll.")
+                metrics.count(name="envoy.polls_skipped_at_night")
+                return
+            # The previous minute's cron job might still be retrying a stalled Envoy. Don't pile
+            # more requests onto the Envoy.
+            with try_lock(self._config.paths.fetch_lock) as locked:
+                if not locked:
+                    log.warning("The previous poll is still running. Skipping this poll.")
+                    metrics.count(name="envoy.polls_skipped_overlapping")
+                    return
+                with metrics.timed("envoy.fetch"):
+                    envoy_data = self._fetch_data_from_envoy()
+                with metrics.timed("live_buffer.write"):
+                    self._save_to_live_buffer(envoy_data)
+
+    def flush(self) -> None:
+        with metrics.with_attributes(**self._metric_attributes):
+            try:
+                with metrics.timed("flush"):
+                    self._flush()
+            finally:
+                self._record_peak_memory()
+
+    def _flush(self) -> None:
+        # A flush (e.g. from the previous minute's cron job) might still be running. Its live buffer
+        # would look like it had been left behind by a crashed flush, so we mustn't touch it.
+        with try_lock(self._config.paths.flush_lock) as locked:
+            if locked:
+                self._flush_while_locked()
             else:
-                merged_df.write_parquet(
-                    self._config.paths.parquet_archive,
-                    partition_by=["year", "month"],
-                    compression="zstd",
+                log.info("Another process is already flushing. Skipping this flush.")
+                metrics.count(name="flush.skipped_already_running")
+
+    def _flush_while_locked(self) -> None:
+        orphaned_paths = self._orphaned_live_buffers()
+        if self._timestamp_of_oldest_file_in_live_buffer() is None and not orphaned_paths:
+            log.info("The live buffer is empty. Nothing to flush.")
+            return
+        log.info("Flushing incoming live buffer to parquet archive...")
+        # Import lazily, because importing Polars is slow. See the comment at the top of this file.
+        from envoy_recorder.hot_tier import HotTier
+        from envoy_recorder.parquet_archive import ParquetArchive
+        from envoy_recorder.reader import ArchiveReader
+        from envoy_recorder.rollups import RollupTables
+
+        paths = self._config.paths
+        if self._archive_reader is None:
+            # We only need the current month (plus the previous month, at the end of the month).
+            self._archive_reader = ArchiveReader(
+                paths.parquet_archive, max_cached_partitions=2, hot_tier_root=paths.hot_tier
+            )
+        archive = ParquetArchive(
+            paths.parquet_archive,
+            paths.archive_manifest,
+            self._archive_reader,
+            self._config.archive,
+            HotTier(paths.hot_tier),
+        )
+        live_buffer_paths = orphaned_paths
+        if orphaned_paths:
+            log.warning(
+                "Recovering %d live buffer(s) left behind by earlier flushes: %s",
+                len(orphaned_paths),
+                [path.name for path in orphaned_paths],
+            )
+            metrics.distribution(name="flush.n_orphaned_live_buffers", value=len(orphaned_paths))
+        if self._timestamp_of_oldest_file_in_live_buffer() is not None:
+            with metrics.timed("live_buffer.move"):
+                live_buffer_paths = [*orphaned_paths, self._move_live_buffer()]
+        if self._config.live_buffer.keep_raw_payloads:
+            # Bundle the raw responses *before* parsing them, so they're kept even if parsing fails.
+            # (If we crashed after bundling an orphaned live buffer, its responses are bundled again,
+            # which is harmless.)
+            with metrics.timed("flush.bundle_raw_payloads"):
+                for path in live_buffer_paths:
+                    append_to_bundles(path, paths.raw_bundles, self._zstd_dictionary_path)
+        # Every live buffer is merged in one pass, so the archive is only loaded and written once.
+        new_df = archive.load_new_rows(
+            live_buffer_paths, self._config.live_buffer.flush_chunk_json_bytes
+        )
+        merged_df = archive.merge_new_rows(new_df)
+        rollups = RollupTables(paths.rollups, paths.pending_rollup_days)
+        if merged_df is None:
+            # Don't bother writing a new Parquet to disk if there's no new data. For example, this
+            # will happen at night, when the inverters stop reporting data but the envoy repeats the
+            # last reading from earlier in the day.
+            log.info("No new rows. Nothing to save to disk.")
+        else:
+            # Once the new rows are in the archive, a retry of this flush won't see them as new. So
+            # remember which days' rollups need recomputing, in case we don't get that far.
+            rollups.mark_days_pending(new_df)
+            archive.write(merged_df, new_df)
+        # Only delete the live buffers once their rows are safely in the archive. If we crash
+        # before this, they'll be recovered by the next flush.
+        for path in live_buffer_paths:
+            shutil.rmtree(path)
+        if merged_df is not None:
+            # Don't wait for the uploads. See `upload_queue.py`.
+            with metrics.timed("flush.enqueue_uploads"):
+                self._upload_queue.enqueue_changed_files()
+        if merged_df is not None or rollups.has_pending_days():
+            with metrics.timed("flush.rollups"):
+                rollups.update(
+                    new_df if merged_df is None else merged_df, new_df, archive.load_partitions
                 )
-                self._copy_to_cloud_bucket()
+
+    def drain_upload_queue(self) -> None:
+        with metrics.with_attributes(**self._metric_attributes):
+            self._upload_queue.drain()
+
+    def _skip_flush_at_night(self) -> bool:
+        if self._night_schedule is None or not self._night_schedule.is_night():
+            return False
+        log.debug("It's night, so there's nothing new to flush.")
+        with metrics.with_attributes(**self._metric_attributes):
+            metrics.count(name="flush.skipped_at_night")
+        return True
+
+    def _record_peak_memory(self) -> None:
+        """Record the peak resident set size of this process (so far), to check that flushes stay
+        within `live_buffer.flush_memory_budget_mb`. (When running as a daemon, this is the peak
+        since the daemon started.)"""
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes. macOS reports bytes.
+        max_rss_mb = max_rss / 1e6 if sys.platform == "darwin" else max_rss / 1e3
+        log.info("Peak memory use so far: %.0f MB.", max_rss_mb)
+        metrics.distribution(name="flush.max_rss", value=max_rss_mb, unit="megabyte")
+
+    @property
+    def _metric_attributes(self) -> dict[str, str]:
+        return {} if self.site is None else {"site": self.site}
 
     def _fetch_data_from_envoy(self) -> str:
-        # Disable SSL Warnings because the Envoy uses self-signed certs.
-        urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-
-        token = self._config.envoy.token
-        ip_address = self._config.envoy.ip_address
-        headers = {"Authorization": f"Bearer {token}"}
-        url = f"http://{ip_address}/ivp/pdm/device_data"
-
-        log.debug("Fetching data from %s...", url)
-        response: Response = requests.get(url, headers=headers, verify=False, timeout=10)
-        response.raise_for_status()
-        envoy_json: str = response.text
-        log.debug("Successfully retrieved data from %s.", url)
+        envoy_json = self._envoy_client.fetch_device_data()
         N_CHARS = 100
         log.debug(
             "First %d characters of response text (after removing whitespace for logging): '%s'",
@@ -73,12 +258,57 @@ class EnvoyRecorder:
         return envoy_json
 
     def _save_to_live_buffer(self, envoy_json: str):
+        # A flush might be moving the live buffer right now. If we wrote into the live buffer just
+        # after the flush had listed its files, our response would be deleted without being parsed.
+        with lock(self._config.paths.live_buffer_lock) as seconds_waited:
+            metrics.distribution(
+                name="live_buffer.lock_wait", value=seconds_waited, unit="seconds"
+            )
+            self._save_to_live_buffer_while_locked(envoy_json)
+
+    def _save_to_live_buffer_while_locked(self, envoy_json: str):
         t = round(time.time())
-        filename = self._config.paths.live_buffer_incoming / f"{t}.json.gz"
+        incoming = self._config.paths.live_buffer_incoming
+        # `incoming` won't exist if the previous flush moved it and we're running as a daemon.
+        incoming.mkdir(parents=True, exist_ok=True)
+        use_segment = self._config.live_buffer.format == "segment"
+        fingerprint = fingerprint_payload(envoy_json)
+        fingerprint_path = self._config.paths.last_payload_fingerprint
+        duplicate_payloads = self._config.live_buffer.duplicate_payloads
+        is_duplicate = fingerprint is not None and fingerprint == read_fingerprint(
+            fingerprint_path
+        )
+        if (
+            self._night_schedule is not None
+            and not is_duplicate
+            and contains_production(envoy_json)
+        ):
+            self._night_schedule.record_production()
+        if duplicate_payloads != "keep" and is_duplicate:
+            log.debug("The Envoy's response contains the same readings as the previous response.")
+            if duplicate_payloads == "marker":
+                if use_segment:
+                    append_frame(incoming / SEGMENT_FILENAME, t, b"")
+                else:
+                    (incoming / f"{t}.dup").touch()
+            return
+
         envoy_json: bytes = envoy_json.encode("UTF-8")
-        log.debug("Writing Envoy JSON data to %s", filename)
-        with gzip.open(filename, "wb") as f:
-            f.write(envoy_json)
+        codec = self._config.live_buffer.compression
+        if self._zstd_dictionary_path is not None:
+            # Keep a copy of the dictionary with the data, so the data can always be decompressed.
+            copy_dictionary_into(self._zstd_dictionary_path, incoming)
+        if use_segment:
+            filename = incoming / SEGMENT_FILENAME
+            log.debug("Appending Envoy JSON data to %s", filename)
+            append_frame(filename, t, envoy_json, codec, self._zstd_dict)
+        else:
+            filename = incoming / f"{t}.json{FILE_SUFFIXES[codec]}"
+            log.debug("Writing Envoy JSON data to %s", filename)
+            filename.write_bytes(compress(envoy_json, codec, self._zstd_dict))
+        if fingerprint is not None:
+            # Only record the fingerprint once the response is safely on disk.
+            write_fingerprint(fingerprint_path, fingerprint)
 
     def _live_buffer_is_old_enough_to_flush(self) -> bool:
         oldest_buffer_file_ts = self._timestamp_of_oldest_file_in_live_buffer()
@@ -88,7 +318,7 @@ class EnvoyRecorder:
         log.debug(
             "It has been %d seconds since the current live buffer was started.", age_in_seconds
         )
-        sentry_sdk.metrics.distribution(
+        metrics.distribution(
             name="live_buffer.age",
             value=age_in_seconds,
             unit="seconds",
@@ -97,99 +327,147 @@ class EnvoyRecorder:
         age_of_live_file_in_minutes = round(age_in_seconds / 60)
         return age_of_live_file_in_minutes > self._config.intervals.flush_buffer_every_n_minutes
 
-    def _timestamp_of_oldest_file_in_live_buffer(self) -> int | None:
-        p = self._config.paths.live_buffer_incoming
-        filenames = list(p.glob("*.json")) + list(p.glob("*.json.gz"))
-        filenames.sort()
-        if len(filenames) == 0:
+    def _has_orphaned_live_buffers(self) -> bool:
+        return any(self._config.paths.live_buffer.glob("processing_*"))
+
+    def _orphaned_live_buffers(self) -> list[Path]:
+        """The `processing_<timestamp>` directories left behind by flushes which crashed, oldest
+        first. Directories which don't contain any responses are deleted."""
+        orphaned_paths = []
+        for path in sorted(
+            self._config.paths.live_buffer.glob("processing_*"),
+            key=lambda path: int(path.name.removeprefix("processing_")),
+        ):
+            if self._timestamp_of_oldest_file_in_live_buffer(path) is None:
+                # e.g. we crashed whilst deleting it, or it only holds duplicate responses.
+                log.info("Deleting %s, which doesn't contain any responses.", path)
+                shutil.rmtree(path)
+            else:
+                orphaned_paths.append(path)
+        return orphaned_paths
+
+    def _timestamp_of_oldest_file_in_live_buffer(self, p: Path | None = None) -> int | None:
+        """The timestamp of the oldest response in the live buffer `p` (by default, the incoming
+        live buffer), or None if there are no responses."""
+        if p is None:
+            p = self._config.paths.live_buffer_incoming
+        if not p.exists():
             return None
-        else:
-            return int(filenames[0].stem.split(".")[0])
+        timestamps = []
+        # Reading the start of the segment is O(1) (unless it starts with duplicate responses). We
+        # still look for individual files, in case the live buffer format has just been changed.
+        segment_timestamp = read_first_timestamp(p / SEGMENT_FILENAME)
+        if segment_timestamp is not None:
+            timestamps.append(segment_timestamp)
+        filenames = list_payload_files(p)
+        if len(filenames) > 0:
+            timestamps.append(min(timestamp_of_payload_file(f) for f in filenames))
+        return min(timestamps, default=None)
 
     def _move_live_buffer(self) -> Path:
         """Moving is an atomic filesystem operation."""
         old_path = self._config.paths.live_buffer_incoming
         t = round(time.time())
-        new_path = self._config.paths.live_buffer / f"processing_{t}"
+        # A live buffer left behind by a crashed flush might already have this name.
+        while (new_path := self._config.paths.live_buffer / f"processing_{t}").exists():
+            t += 1
         log.info("Moving %s to %s", old_path, new_path)
-        return old_path.rename(new_path)
-
-    def _append_to_parquet_in_memory(self, buffer_processing_path: Path) -> pl.DataFrame | None:
-        new_df = convert_directory_of_json_files_to_dataframe(buffer_processing_path)
-        old_df = self._load_last_month_of_parquet_archive()
-        merged_df = old_df.vstack(new_df)
-        merged_df = merged_df.unique(subset=PRIMARY_KEYS)
-        merged_df = merged_df.sort(PRIMARY_KEYS)
-        start, end = merged_df.select(
-            start=pl.col("period_end_time").min(), end=pl.col("period_end_time").max()
-        )
-        n_rows_appended = merged_df.height - old_df.height
-        log.info(
-            "Appended %d rows. The merged dataframe now has %d rows of data, from %s to %s.",
-            n_rows_appended,
-            merged_df.height,
-            start.item(),
-            end.item(),
-        )
-        sentry_sdk.metrics.distribution(
-            name="dataframe.n_rows_after_merging",
-            value=merged_df.height,
-            unit="rows",
-        )
-        sentry_sdk.metrics.distribution(
-            name="dataframe.n_rows_appended_after_de_dupe",
-            value=n_rows_appended,
-            unit="rows",
-        )
-        if merged_df.equals(old_df):
-            return None
-        else:
-            return merged_df
+        with lock(self._config.paths.live_buffer_lock) as seconds_waited:
+            metrics.distribution(
+                name="live_buffer.lock_wait", value=seconds_waited, unit="seconds"
+            )
+            return old_path.rename(new_path)
 
-    def _load_last_month_of_parquet_archive(self) -> pt.DataFrame[ProcessedEnvoyDataFrame]:
-        """Load from disk.
 
-        If there is no parquet on disk then return an empty dataframe.
-        """
-        is_empty = not any(self._config.paths.parquet_archive.iterdir())
-        if is_empty:
-            # Return empty DataFrame.
-            log.info("The parquet archive is currently empty.")
-            df = pl.DataFrame(schema=ProcessedEnvoyDataFrame.dtypes)
-            return pt.DataFrame[ProcessedEnvoyDataFrame](df)
-
-        df = pl.scan_parquet(self._config.paths.parquet_archive)
-
-        # The Parquet archive uses monthly Hive partitions. Load the last month of data:
-        last_date: date = df.select(pl.col("period_end_time").max()).collect().item().date()
-        first_day_of_last_month = last_date.replace(day=1)
-        df = df.filter(pl.col("period_end_time") >= first_day_of_last_month)
-        df = df.collect()
-        log.info(
-            "Loaded %d rows from the parquet archive, starting at %s.",
-            df.height,
-            first_day_of_last_month.strftime("%Y-%m-%d"),
-        )
+class MultiSiteRecorder:
+    """Record data from every Envoy in the config.
 
-        sentry_sdk.metrics.distribution(
-            name="dataframe.n_rows_loaded_from_parquet_archive",
-            value=df.height,
-            unit="rows",
-        )
-        return pt.DataFrame[ProcessedEnvoyDataFrame](df)
-
-    def _copy_to_cloud_bucket(self) -> None:
-        log.info("Uploading to bucket %s", self._config.paths.storage_bucket)
-        cmd: list[str | Path] = [
-            "rclone",
-            "copy",
-            self._config.paths.parquet_archive,
-            self._config.paths.storage_bucket,
-            "--fast-list",  # Use fewer API calls to list objects (saves Class B ops)
+    The Envoys are polled concurrently, so one slow Envoy never delays the others. Each Envoy has its
+    own live buffer, and its own `site=<name>` Hive partition in the Parquet archive.
+    """
+
+    def __init__(self, config: EnvoyRecorderConfig | None = None) -> None:
+        self._config = EnvoyRecorderConfig.load() if config is None else config
+        self._recorders = [
+            EnvoyRecorder(site_config) for site_config in self._config.site_configs()
         ]
+
+    @property
+    def config(self) -> EnvoyRecorderConfig:
+        return self._config
+
+    @property
+    def recorders(self) -> list[EnvoyRecorder]:
+        return self._recorders
+
+    def run(self) -> None:
+        """Run one complete cycle. This is what cron calls once per minute.
+
+        The flush (if it's due) runs in a separate process (see `flush_worker.py`), so this process
+        exits promptly, and the next minute's poll isn't delayed by a slow flush.
+        """
         try:
-            subprocess.run(cmd, check=True, text=True, capture_output=True)
-        except subprocess.CalledProcessError as e:
-            log.exception("Upload Failed: %s", e.stderr)
-        else:
-            log.info("Successful upload!")
+            self.fetch_and_buffer()
+        finally:
+            self.start_flush_worker_if_needed()
+            # Also retry uploads which failed in earlier runs.
+            self.start_upload_worker_if_needed()
+
+    def start_flush_worker_if_needed(self) -> None:
+        """Flush in a background process, unless a flush is already running."""
+        if not any(r.wants_to_flush() for r in self._recorders):
+            return
+        if any(r.is_flushing() for r in self._recorders):
+            # The running flush will be followed by another flush within a minute or so.
+            log.info("A flush is already running. Not starting another flush worker.")
+            metrics.count(name="flush.worker_already_running")
+            return
+        flush_worker.start_worker_process()
+
+    def flush_if_old_enough(self) -> None:
+        self._for_each_site("flush_if_old_enough", EnvoyRecorder.flush_if_old_enough)
+
+    def start_upload_worker_if_needed(self) -> None:
+        """Drain the upload queues in a background process, so this process can exit quickly."""
+        if any(r.upload_queue.has_due_entries() for r in self._recorders):
+            start_worker_process()
+
+    def drain_upload_queues(self) -> None:
+        """Upload everything which is due, in this process. Blocks until the uploads finish."""
+        self._for_each_site("drain_upload_queue", EnvoyRecorder.drain_upload_queue)
+
+    def fetch_and_buffer(self) -> None:
+        if len(self._recorders) == 1:
+            self._recorders[0].fetch_and_buffer()
+            return
+        with ThreadPoolExecutor(max_workers=len(self._recorders)) as executor:
+            futures = [executor.submit(r.fetch_and_buffer) for r in self._recorders]
+            exceptions: list[Exception] = []
+            for future in futures:
+                e = future.exception()
+                if e is None:
+                    continue
+                if not isinstance(e, Exception):
+                    # E.g. `KeyboardInterrupt`, which mustn't be hidden inside an `ExceptionGroup`.
+                    raise e
+                exceptions.append(e)
+        if exceptions:
+            raise ExceptionGroup("Failed to fetch data from some Envoys", exceptions)
+
+    def flush(self) -> None:
+        self._for_each_site("flush", EnvoyRecorder.flush)
+
+    def flush_unless_night(self) -> None:
+        self._for_each_site("flush_unless_night", EnvoyRecorder.flush_unless_night)
+
+    def _for_each_site(self, name: str, method: Callable[[EnvoyRecorder], None]) -> None:
+        """Call `method` on each site in turn. A failure at one site doesn't stop the other sites."""
+        exceptions = []
+        for recorder in self._recorders:
+            try:
+                method(recorder)
+            except Exception as e:
+                log.exception("Exception raised for site %s!", recorder.site)
+                exceptions.append(e)
+        if exceptions:
+            raise ExceptionGroup(f"{name} failed for some sites", exceptions)
@@ -0,0 +1,173 @@
+"""A stand-in Envoy HTTP server, for testing and benchmarking the poller without a real Envoy.
+
+`FakeEnvoy` serves synthetic `device_data` responses (see `synthetic_payloads.py`) at the same URL as
+a real Envoy, and can misbehave in the ways that real Envoys misbehave (see `Misbehaviour`): slow
+responses, stalls (which the client has to time out), 401 Unauthorized (e.g. after the token
+expires), 5xx server errors, and truncated bodies (which are served with a 200 status, so the
+client can't tell that anything is wrong until it parses the JSON).
+
+The time which the server reports (i.e. the `created` and `endDate` timestamps of each reading) comes
+from `clock`, so a harness can run the recorder against the server at accelerated time. See
+`benchmarks/fake_envoy_harness.py`. For example:
+
+    misbehaviour = Misbehaviour(server_error_probability=0.1)
+    with FakeEnvoy(SyntheticEnvoy(n_inverters=30), misbehaviour) as envoy:
+        config = EnvoyConfig(ip_address="127.0.0.1", port=envoy.port, token="fake")
+        ...
+"""
+
+import json
+import random
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Self
+
+from envoy_recorder.synthetic_payloads import SyntheticEnvoy
+
+DEVICE_DATA_PATH = "/ivp/pdm/device_data"
+
+
+@dataclass
+class Misbehaviour:
+    # Added to every response.
+    latency_seconds: float = 0.0
+    # The probability that the server waits `stall_seconds` before responding (or until the client
+    # gives up).
+    stall_probability: float = 0.0
+    stall_seconds: float = 30.0
+    unauthorized_probability: float = 0.0
+    server_error_probability: float = 0.0
+    # The probability that only the first half of the JSON is sent (with a 200 status).
+    truncated_probability: float = 0.0
+
+
+@dataclass
+class FakeEnvoyStats:
+    n_requests: int = 0
+    n_ok: int = 0
+    n_stalled: int = 0
+    n_unauthorized: int = 0
+    n_server_errors: int = 0
+    n_truncated: int = 0
+    # Every `(serial number, endDate)` which the Envoy could have served, whether or not the
+    # response was actually delivered. The recorder can't record readings which it never saw, so
+    # compare the archive with this set to measure end-to-end data loss.
+    readings: set[tuple[str, int]] = field(default_factory=set)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    fake_envoy: FakeEnvoy
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Enables keep-alive, like the real Envoy.
+    # The headers and the body are sent separately, so, with keep-alive, Nagle's algorithm (and the
+    # client's delayed ACKs) would add about 40 ms to every response.
+    disable_nagle_algorithm = True
+    server: _Server
+
+    def do_GET(self) -> None:
+        if self.path != DEVICE_DATA_PATH:
+            self._send(404, b"Not found")
+        else:
+            self._send(*self.server.fake_envoy.respond(self.headers["Authorization"]))
+
+    def _send(self, status: int, body: bytes) -> None:
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except ConnectionError:
+            pass  # The client gave up waiting (e.g. during a stall).
+
+    def log_message(self, format: str, *args) -> None:
+        pass  # Don't clutter the output with every request.
+
+
+class FakeEnvoy:
+    def __init__(
+        self,
+        synthetic_envoy: SyntheticEnvoy | None = None,
+        misbehaviour: Misbehaviour | None = None,
+        clock: Callable[[], float] = time.time,
+        token: str | None = None,
+        seed: int = 0,
+    ) -> None:
+        """`clock` returns the Envoy's current Unix time, which must never go backwards. If `token`
+        is given then requests without the header `Authorization: Bearer <token>` are rejected."""
+        self._synthetic_envoy = SyntheticEnvoy() if synthetic_envoy is None else synthetic_envoy
+        self.misbehaviour = Misbehaviour() if misbehaviour is None else misbehaviour
+        self._clock = clock
+        self._token = token
+        self._rng = random.Random(seed)
+        self.stats = FakeEnvoyStats()
+        # The handler threads share the synthetic Envoy (and its random number generator).
+        self._lock = threading.Lock()
+        self._server: _Server | None = None
+
+    @property
+    def port(self) -> int:
+        assert self._server is not None, "Please start the server first."
+        return self._server.server_address[1]
+
+    def start(self) -> Self:
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.fake_envoy = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> Self:
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def respond(self, authorization: str | None) -> tuple[int, bytes]:
+        """Returns the status code and body of the response to one request."""
+        misbehaviour = self.misbehaviour
+        with self._lock:
+            self.stats.n_requests += 1
+            payload = self._synthetic_envoy.payload(int(self._clock()))
+            self.stats.readings.update(
+                (device["sn"], device["channels"][0]["lastReading"]["endDate"])
+                for device in json.loads(payload).values()
+                if isinstance(device, dict) and device.get("devName") == "pcu"
+            )
+            # Draw every random number up front, so each request uses the same number of draws.
+            stall, unauthorized, server_error, truncated = (self._rng.random() for _ in range(4))
+            if stall < misbehaviour.stall_probability:
+                self.stats.n_stalled += 1
+            if (
+                self._token is not None
+                and authorization != f"Bearer {self._token}"
+                or unauthorized < misbehaviour.unauthorized_probability
+            ):
+                status, body = 401, b"Unauthorized"
+            elif server_error < misbehaviour.server_error_probability:
+                status, body = 503, b"Service Unavailable"
+            elif truncated < misbehaviour.truncated_probability:
+                status, body = 200, payload[: len(payload) // 2]
+                self.stats.n_truncated += 1
+            else:
+                status, body = 200, payload
+                self.stats.n_ok += 1
+            if status == 401:
+                self.stats.n_unauthorized += 1
+            elif status >= 500:
+                self.stats.n_server_errors += 1
+        time.sleep(misbehaviour.latency_seconds)
+        if stall < misbehaviour.stall_probability:
+            time.sleep(misbehaviour.stall_seconds)
+        return status, body
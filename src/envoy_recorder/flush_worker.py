@@ -0,0 +1,46 @@
+"""Flush the live buffer(s) in a detached process, so a slow flush never delays polling the Envoy.
+
+Cron starts `record.py` every minute, whether or not the previous run has finished. So, when it's
+time to flush, `record.py` polls the Envoy as usual, and then starts a detached
+`python -m envoy_recorder.flush_worker` process to do the flush, and exits. The next minute's poll
+runs on time, even if the flush takes several minutes.
+
+At most one flush runs at a time: each site's flush holds `<state>/flush.lock`, and we don't start
+a worker whilst another worker is still flushing. (When running as a daemon, the flush runs in a
+background thread instead. See `scripts/record.py`.)
+"""
+
+import subprocess
+import sys
+
+from envoy_recorder.logging import get_logger
+from envoy_recorder.monitoring import run_worker
+
+log = get_logger(__name__)
+
+
+def start_worker_process() -> subprocess.Popen:
+    """Flush in a detached process, so the caller doesn't wait for the flush.
+
+    The worker inherits our working directory (so it finds the same `config.toml`) and our stdout
+    and stderr (so its logs end up in the same log file).
+    """
+    cmd = [sys.executable, "-m", "envoy_recorder.flush_worker"]
+    log.info("Starting background flush worker: %s", cmd)
+    return subprocess.Popen(cmd, stdin=subprocess.DEVNULL, start_new_session=True)
+
+
+def main() -> None:
+    """Flush each site whose live buffer is old enough, and then start the upload worker."""
+    # Import here, because `envoy_recorder.py` imports this module.
+    from envoy_recorder.envoy_recorder import MultiSiteRecorder
+
+    recorder = MultiSiteRecorder()
+    try:
+        recorder.flush_if_old_enough()
+    finally:
+        recorder.start_upload_worker_if_needed()
+
+
+if __name__ == "__main__":
+    run_worker(main, "Flush worker")
@@ -0,0 +1,84 @@
+"""An append-only "hot tier" of Arrow IPC files, which holds recent rows until they're compacted.
+
+Appending to a Parquet file means re-writing the whole file. So, without the hot tier, every flush
+re-writes the entire current-month Parquet partition, just to add about 15 minutes of rows.
+
+With the hot tier (`config.archive.hot_tier = true`), each flush writes its new rows to a new,
+small, uncompressed Arrow IPC file (`<hot_tier>/year=<y>/month=<m>/<time_ns>.arrow`). Uncompressed
+IPC files are cheap to write, and Polars reads them zero-copy, by memory-mapping them.
+
+`ParquetArchive.compact_hot_tier` converts the hot tier into the sorted, zstd-compressed Parquet
+partition (and then deletes the IPC files): at the end of each month, when the oldest IPC file in
+a partition is older than `config.archive.compact_hot_tier_every_n_minutes`, or on demand (see
+`scripts/compact_hot_tier.py`). `ArchiveReader` always returns a unified view of both tiers.
+"""
+
+import os
+import time
+from pathlib import Path
+
+import polars as pl
+
+from envoy_recorder.json_to_dataframe import PARTITION_KEYS
+from envoy_recorder.logging import get_logger
+from envoy_recorder.reader import HOT_TIER_SUFFIX, PartitionKey, partition_path
+
+log = get_logger(__name__)
+
+
+class HotTier:
+    def __init__(self, root: Path) -> None:
+        self._root = root
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    def files(self, key: PartitionKey) -> list[Path]:
+        """The IPC files in partition `key`, oldest first."""
+        directory = partition_path(self._root, PARTITION_KEYS, key)
+        return sorted(directory.glob(f"*{HOT_TIER_SUFFIX}"), key=_time_ns_of_file)
+
+    def partitions(self) -> list[PartitionKey]:
+        """The partitions which have at least one IPC file."""
+        keys = []
+        for directory in self._root.glob("year=*/month=*"):
+            key = tuple(int(part.split("=")[1]) for part in directory.parts[-2:])
+            if self.files(key):
+                keys.append(key)
+        return sorted(keys)
+
+    def append(self, df: pl.DataFrame) -> list[Path]:
+        """Write the rows of `df` to a new IPC file in each partition. Returns the new files."""
+        written_paths = []
+        for key, partition_df in df.partition_by(PARTITION_KEYS, as_dict=True).items():
+            directory = partition_path(self._root, PARTITION_KEYS, key)
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / f"{time.time_ns()}{HOT_TIER_SUFFIX}"
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            with open(tmp_path, "wb") as f:
+                # Uncompressed, so readers can memory-map the file.
+                partition_df.write_ipc(f, compression="uncompressed")
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_path.replace(path)
+            log.info("Appended %d rows to the hot tier: %s", partition_df.height, path)
+            written_paths.append(path)
+        return written_paths
+
+    def age_of_oldest_file(self, key: PartitionKey) -> float | None:
+        """In seconds. Returns None if the partition has no IPC files."""
+        files = self.files(key)
+        if not files:
+            return None
+        return (time.time_ns() - _time_ns_of_file(files[0])) / 1e9
+
+    def remove(self, paths: list[Path]) -> None:
+        """Remove IPC files whose rows have been compacted into Parquet."""
+        for path in paths:
+            path.unlink(missing_ok=True)
+        log.info("Removed %d compacted file(s) from the hot tier.", len(paths))
+
+
+def _time_ns_of_file(path: Path) -> int:
+    return int(path.name.removesuffix(HOT_TIER_SUFFIX))
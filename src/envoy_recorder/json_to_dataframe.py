@@ -1,11 +1,20 @@
+import itertools
+import json
+from collections.abc import Iterator
+from compression import zstd
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
 import patito as pt
 import polars as pl
-import sentry_sdk
 
+from envoy_recorder import metrics
+from envoy_recorder.live_buffer import list_payload_files
 from envoy_recorder.logging import get_logger
+from envoy_recorder.payload_compression import FILE_SUFFIXES, decompress, load_dictionaries
 from envoy_recorder.schemas import ProcessedEnvoyDataFrame
+from envoy_recorder.segment import SEGMENT_SUFFIX, iter_frames
 
 log = get_logger(__name__)
 
@@ -17,87 +26,206 @@ PRIMARY_KEYS = ("serial_number", "period_end_time")
 
 PARTITION_KEYS = ("year", "month")
 
+# The fields we keep from each micro-inverter's `lastReading`, mapped to the names we give them.
+# We ignore "eid", "interval_type", "flags" (we use "flags_hex" instead, see below), "joulesUsed",
+# "leadingVArs", "laggingVArs", "l1NAcVoltageInmV", "l2NAcVoltageInmV", "l3NAcVoltageInmV",
+# "rssi", and "issi".
+LAST_READING_FIELDS = {
+    "endDate": "period_end_time",
+    "duration": "period_duration",
+    "flags_hex": "flags_hex",
+    "joulesProduced": "joules_produced",
+    "acVoltageINmV": "ac_voltage_mV",
+    "acCurrentInmA": "ac_current_mA",
+    "dcVoltageINmV": "dc_voltage_mV",
+    "dcCurrentINmA": "dc_current_mA",
+    "acFrequencyINmHz": "ac_frequency_mHz",
+    "channelTemp": "inverter_temperature_Celsius",
+    "pwrConvErrSecs": "power_conversion_error_seconds",
+    "pwrConvMaxErrCycles": "power_conversion_max_error_cycles",
+}
 
-def convert_directory_of_json_files_to_dataframe(
-    directory: Path,
-) -> pt.DataFrame[ProcessedEnvoyDataFrame]:
-    assert directory.exists(), f"{directory} does not exist!"
-    assert directory.is_dir(), f"{directory} is not a directory!"
-    files = list(directory.glob("*.json")) + list(directory.glob("*.json.gz"))
-    log.info("Loading %d json files into Polars DataFrame...", len(files))
-    assert len(files) > 0, f"No *.json or *.json.gz files found in directory {directory}!"
+# The schema of the rows produced by `_parse_payload`. Declaring the schema up front means Polars
+# doesn't have to infer it. Integers are Int64 here (because that's what JSON gives us); they're
+# cast to narrower types at the end of `convert_directory_of_json_files_to_dataframe`.
+RAW_SCHEMA = pl.Schema(
+    {
+        "serial_number": pl.String,
+        "created": pl.Int64,
+        "watt_hours_today": pl.Int64,
+        **{
+            name: pl.String if name == "flags_hex" else pl.Int64
+            for name in LAST_READING_FIELDS.values()
+        },
+    }
+)
 
-    df = pl.concat([pl.read_json(f) for f in files])
+type RawRow = tuple[str | int | None, ...]
 
-    # After `scan_ndjson` there's a column per device, and columns "deviceCount" and
-    # "deviceDataLimit". Each device column contains a struct that looks like this:
+# The number of responses which are decompressed and parsed at once.
+_PAYLOADS_IN_FLIGHT = 64
 
-    #     {"devName": "pcu", "sn": "482202080196", "active": true, "modGone": true, "channels": [
-    #         {"chanEid": 1627390225, "created": 1767802330, etc...
 
-    # Drop columns we don't care about
-    df = df.drop(["deviceCount", "deviceDataLimit"], strict=False)
+def _read_file(path: Path, dictionaries: dict[int, zstd.ZstdDict]) -> bytes:
+    data = path.read_bytes()
+    for codec, suffix in FILE_SUFFIXES.items():
+        if path.suffix == suffix:
+            return decompress(data, codec, dictionaries)
+    return data
 
-    # Turn the wide format (where each device ID is its own column) to a tall and long format where
-    # there's a single device ID column, and a `stats` column which holds a struct containing data
-    # for just that device ID.
-    df = df.unpivot(variable_name="device_id", value_name="stats")
 
-    # `unnest("stats")` moves the struct's fields into separate DataFrame columns:
-    df = df.unnest("stats")
+def _parse_payload(payload: bytes) -> list[RawRow]:
+    """Parse one `device_data` response from the Envoy into rows which match `RAW_SCHEMA`.
 
-    # `channels` is a list of length 1 (because each IQ7+ micro-inverter only has a single PV panel
-    # connected to it.) So, here, `explode("channels")` effectively just changes `channels` from a
-    # list containing one struct, into that struct (removing the list).
-    df = df.explode("channels").unnest("channels")
+    The Envoy's JSON has one key per device (plus "deviceCount" and "deviceDataLimit"). Each device
+    looks like this:
 
-    # The code that saves Envoy data to JSONL is deliberately very simple. It doesn't check for
-    # duplicates. It just grabs data from the Envoy and saves it to disk. So let's remove duplicates
-    # now. 'sn' = 'serial number'; 'created' = the unix timestamp (in seconds) when the recording
-    # was created.
-    df = df.unique(subset=["sn", "created"])
+        {"devName": "pcu", "sn": "482202080196", "active": true, "modGone": true, "channels": [
+            {"chanEid": 1627390225, "created": 1767802330, "wattHours": {"today": 113, ...},
+             "lastReading": {"endDate": 1767802330, "joulesProduced": 101422, etc...
 
-    # We're only after data for micro-inverters (not batteries or any other kit).
-    # PCU = Power Conditioning Unit (an inverter that "conditions" DC power to AC power).
-    df = df.filter(pl.col("devName") == "pcu")
+    We only keep the fields we need, and we only keep micro-inverters (not batteries or any other
+    kit). PCU = Power Conditioning Unit (an inverter that "conditions" DC power to AC power).
 
-    # Now let's select just the columns we want:
-    df = df.select(
-        pl.col("sn").alias("serial_number"),
-        pl.col("wattHours").struct.field("today").alias("watt_hours_today"),
-        pl.col("lastReading").struct.unnest(),
+    Returns no rows if the response isn't valid JSON (e.g. because the Envoy truncated its
+    response), or doesn't match the structure above (e.g. because a firmware update changed the
+    Envoy's JSON schema), so that one bad response doesn't stop the rest of the live buffer being
+    flushed.
+    """
+    try:
+        devices = json.loads(payload)
+    except ValueError:
+        log.warning("Skipping a response which isn't valid JSON: %r...", payload[:100])
+        metrics.count(name="flush.invalid_json_payloads")
+        return []
+    rows = []
+    try:
+        for device in devices.values():
+            if not isinstance(device, dict) or device.get("devName") != "pcu":
+                continue
+            # `channels` is a list of length 1 (because each IQ7+ micro-inverter only has a single
+            # PV panel connected to it).
+            for channel in device["channels"]:
+                last_reading = channel["lastReading"]
+                rows.append(
+                    (
+                        device["sn"],
+                        channel["created"],
+                        channel["wattHours"]["today"],
+                        *(last_reading.get(field) for field in LAST_READING_FIELDS),
+                    )
+                )
+    except (KeyError, TypeError, AttributeError) as e:
+        log.warning(
+            "Skipping a response which doesn't match the expected schema (%r): %r...",
+            e,
+            payload[:100],
+        )
+        metrics.count(name="flush.unparseable_payloads")
+        return []
+    return rows
+
+
+def _parse_and_measure_payload(payload: bytes) -> tuple[int, list[RawRow]]:
+    return len(payload), _parse_payload(payload)
+
+
+def _load_parse_and_measure_file(
+    path: Path, dictionaries: dict[int, zstd.ZstdDict]
+) -> tuple[int, list[RawRow]]:
+    return _parse_and_measure_payload(_read_file(path, dictionaries))
+
+
+def _iter_parsed_payloads(
+    directory: Path, max_workers: int | None
+) -> Iterator[tuple[int, list[RawRow]]]:
+    """Yield `(size of the JSON in bytes, rows)` for each response in `directory`.
+
+    Files are decompressed and parsed in parallel by a pool of `max_workers` threads. (zlib and
+    Zstandard release the GIL whilst decompressing, and the JSON parsing runs in parallel on
+    free-threaded builds of Python.) Only `_PAYLOADS_IN_FLIGHT` responses are decompressed at once,
+    so memory use doesn't grow with the size of the live buffer.
+    """
+    assert directory.exists(), f"{directory} does not exist!"
+    assert directory.is_dir(), f"{directory} is not a directory!"
+    files = list_payload_files(directory)
+    segments = list(directory.glob(f"*{SEGMENT_SUFFIX}"))
+    log.info(
+        "Loading %d json files and %d segment files into Polars DataFrame...",
+        len(files),
+        len(segments),
     )
-    df = df.drop(
-        [
-            "eid",
-            "interval_type",
-            "flags",
-            "joulesUsed",
-            "leadingVArs",
-            "laggingVArs",
-            "l1NAcVoltageInmV",
-            "l2NAcVoltageInmV",
-            "l3NAcVoltageInmV",
-            "rssi",
-            "issi",
-        ],
-        strict=False,
+    assert len(files) + len(segments) > 0, (
+        f"No Envoy responses or *{SEGMENT_SUFFIX} files found in directory {directory}!"
     )
-    df = df.rename(
-        {
-            "endDate": "period_end_time",
-            "duration": "period_duration",
-            "joulesProduced": "joules_produced",
-            "acVoltageINmV": "ac_voltage_mV",
-            "acCurrentInmA": "ac_current_mA",
-            "dcVoltageINmV": "dc_voltage_mV",
-            "dcCurrentINmA": "dc_current_mA",
-            "acFrequencyINmHz": "ac_frequency_mHz",
-            "channelTemp": "inverter_temperature_Celsius",
-            "pwrConvErrSecs": "power_conversion_error_seconds",
-            "pwrConvMaxErrCycles": "power_conversion_max_error_cycles",
-        }
+    dictionaries = load_dictionaries(directory)
+    tasks = itertools.chain(
+        (partial(_load_parse_and_measure_file, path, dictionaries) for path in files),
+        # Frames are streamed from each segment. (Empty frames record duplicate responses.)
+        (
+            partial(_parse_and_measure_payload, payload)
+            for segment in segments
+            for _, payload in iter_frames(segment, dictionaries)
+            if payload
+        ),
     )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in itertools.batched(tasks, _PAYLOADS_IN_FLIGHT):
+            yield from executor.map(lambda task: task(), batch)
+
+
+def convert_directory_of_json_files_to_dataframe(
+    directory: Path,
+    max_workers: int | None = None,
+) -> pt.DataFrame[ProcessedEnvoyDataFrame]:
+    """Load all the Envoy responses in `directory`.
+
+    `directory` can contain individual `*.json`, `*.json.gz` and `*.json.zst` files and/or `*.wal`
+    segment files (see `segment.py`), plus any Zstandard dictionaries used to compress them.
+
+    This holds every row in memory. Use `iter_dataframe_chunks` for large live buffers.
+    """
+    rows = [
+        row
+        for _, rows_of_payload in _iter_parsed_payloads(directory, max_workers)
+        for row in rows_of_payload
+    ]
+    return _rows_to_dataframe(rows)
+
+
+def iter_dataframe_chunks(
+    directory: Path,
+    max_chunk_json_bytes: int,
+    max_workers: int | None = None,
+) -> Iterator[pt.DataFrame[ProcessedEnvoyDataFrame]]:
+    """Like `convert_directory_of_json_files_to_dataframe`, but yields the rows in chunks, each
+    parsed from at most about `max_chunk_json_bytes` of (decompressed) JSON.
+
+    Duplicate rows are only removed within each chunk, not across chunks.
+    """
+    chunk: list[RawRow] = []
+    chunk_json_bytes = 0
+    n_chunks = 0
+    for n_bytes, rows in _iter_parsed_payloads(directory, max_workers):
+        chunk.extend(rows)
+        chunk_json_bytes += n_bytes
+        if chunk_json_bytes >= max_chunk_json_bytes:
+            yield _rows_to_dataframe(chunk)
+            n_chunks += 1
+            chunk = []
+            chunk_json_bytes = 0
+    # Always yield at least one chunk (even if it's empty).
+    if chunk or n_chunks == 0:
+        yield _rows_to_dataframe(chunk)
+
+
+def _rows_to_dataframe(rows: list[RawRow]) -> pt.DataFrame[ProcessedEnvoyDataFrame]:
+    df = pl.DataFrame(rows, schema=RAW_SCHEMA, orient="row")
+
+    # The code that saves Envoy data to JSONL is deliberately very simple. It doesn't check for
+    # duplicates. It just grabs data from the Envoy and saves it to disk. So let's remove duplicates
+    # now. 'created' = the unix timestamp (in seconds) when the recording was created.
+    df = df.unique(subset=["serial_number", "created"]).drop("created")
 
     # Convert the `flags_hex` string to a UInt64. `flags` is almost certainly a 64-bit bit mask,
     # because `flags_hex` is a 16-character hex string. 16 chars x 4 bits per char = 64 bits. We use
@@ -194,8 +322,6 @@ def convert_directory_of_json_files_to_dataframe(
     )
 
     log.info("Successfully read %d rows of data into a Polars DataFrame.", df.height)
-    sentry_sdk.metrics.distribution(
-        name="dataframe.n_rows_loaded_from_json", value=df.height, unit="rows"
-    )
+    metrics.distribution(name="dataframe.n_rows_loaded_from_json", value=df.height, unit="rows")
 
     return ProcessedEnvoyDataFrame.validate(df)
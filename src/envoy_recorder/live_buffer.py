@@ -0,0 +1,71 @@
+import hashlib
+import json
+from pathlib import Path
+
+from envoy_recorder.logging import get_logger
+
+log = get_logger(__name__)
+
+# Each response from the Envoy can be saved to its own file in the live buffer. The filename is the
+# unix timestamp (in seconds) of the poll.
+PAYLOAD_FILE_PATTERNS = ("*.json", "*.json.gz", "*.json.zst")
+
+
+def list_payload_files(directory: Path) -> list[Path]:
+    return [path for pattern in PAYLOAD_FILE_PATTERNS for path in directory.glob(pattern)]
+
+
+def timestamp_of_payload_file(path: Path) -> int:
+    return int(path.name.split(".")[0])
+
+
+def fingerprint_payload(envoy_json: str) -> str | None:
+    """Fingerprint the readings in an Envoy `device_data` response.
+
+    Each micro-inverter only reports once every 15 minutes, so most minute-by-minute responses
+    contain exactly the same readings as the previous response. Two responses have the same
+    fingerprint if they contain the same set of `(serial number, created)` tuples.
+
+    Returns None if the response can't be parsed, or doesn't contain any readings. Callers should
+    always keep those responses, so we can debug changes to the Envoy's JSON schema.
+    """
+    try:
+        devices = json.loads(envoy_json)
+        readings = sorted(
+            (device["sn"], channel["created"])
+            for device in devices.values()
+            if isinstance(device, dict)
+            for channel in device.get("channels", [])
+        )
+    except ValueError, KeyError, TypeError, AttributeError:
+        log.warning("Failed to parse the Envoy's response, so we can't fingerprint it.")
+        return None
+    if len(readings) == 0:
+        return None
+    return hashlib.sha256(repr(readings).encode()).hexdigest()
+
+
+def contains_production(envoy_json: str) -> bool:
+    """True if any micro-inverter's last reading in the response produced some energy."""
+    try:
+        return any(
+            channel["lastReading"].get("joulesProduced", 0) > 0
+            for device in json.loads(envoy_json).values()
+            if isinstance(device, dict) and device.get("devName") == "pcu"
+            for channel in device.get("channels", [])
+        )
+    except ValueError, KeyError, TypeError, AttributeError:
+        return False
+
+
+def read_fingerprint(path: Path) -> str | None:
+    try:
+        return path.read_text().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_fingerprint(path: Path, fingerprint: str) -> None:
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(fingerprint)
+    tmp_path.replace(path)
@@ -0,0 +1,274 @@
+"""Sample the site's power every few seconds, and save 1-minute aggregates.
+
+`device_data` (which is what the rest of envoy_recorder records) only changes when a micro-inverter
+reports, once every 15 minutes. For live dashboards, we also want the site's power in near-real
+time. So, with `live_power.enabled = true` (and `scripts/record.py --daemon`), the daemon polls the
+Envoy's `/production.json` every `live_power.sample_every_n_seconds`.
+
+The samples are kept in memory, in a fixed-size ring buffer (`PowerRingBuffer`). As soon as a
+minute has passed, that minute's samples are downsampled to a single row (the mean, min and max
+production, and the mean consumption). The 1-minute rows are written to their own Hive-partitioned
+Parquet table in `paths.live_power` (see `LivePowerDataFrame`) every
+`live_power.write_every_n_minutes`. So we record high-resolution data without writing anything to
+the live buffer, and without creating a file per sample.
+
+Envoys with consumption meters (CTs) measure the site's production and consumption every second.
+Envoys without meters only report the total of the micro-inverters' last readings, which doesn't
+change very often. (And the consumption is null.)
+
+This module is imported by `scripts/record.py`, so it mustn't import Polars (except when writing).
+"""
+
+import json
+import math
+import threading
+import time
+from array import array
+from collections.abc import Callable, Sequence
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import requests
+
+from envoy_recorder import metrics
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.envoy_client import EnvoyClient
+from envoy_recorder.logging import get_logger
+
+log = get_logger(__name__)
+
+
+@dataclass(frozen=True)
+class PowerSample:
+    timestamp: float  # Unix time, in seconds.
+    production_W: float
+    consumption_W: float | None
+
+
+@dataclass(frozen=True)
+class MinuteOfPower:
+    """One row of `LivePowerDataFrame` (without the partition keys)."""
+
+    period_start: int  # Unix time, in seconds. Always a whole minute.
+    mean_production_W: float
+    min_production_W: float
+    max_production_W: float
+    mean_consumption_W: float | None
+    n_samples: int
+
+
+def parse_production(production_json: str) -> tuple[float, float | None]:
+    """Returns the site's production and consumption (or None, if the Envoy doesn't have
+    consumption meters), in watts, from the Envoy's `/production.json`."""
+    data = json.loads(production_json)
+    production_W = _read_meter(data.get("production", []), "production")
+    if production_W is None:
+        # No production meter, so use the total of the micro-inverters' last readings.
+        for entry in data.get("production", []):
+            if entry.get("type") == "inverters":
+                production_W = float(entry["wNow"])
+                break
+        else:
+            raise ValueError("The Envoy didn't report any production!")
+    return production_W, _read_meter(data.get("consumption", []), "total-consumption")
+
+
+def _read_meter(entries: list[dict], measurement_type: str) -> float | None:
+    for entry in entries:
+        if (
+            entry.get("type") == "eim"
+            and entry.get("measurementType") == measurement_type
+            and entry.get("activeCount", 0) > 0
+        ):
+            return float(entry["wNow"])
+    return None
+
+
+class PowerRingBuffer:
+    """A fixed-size ring buffer of the most recent power samples.
+
+    The samples are stored in pre-allocated arrays of doubles, so appending a sample never allocates
+    memory, and the daemon can sample every few seconds, forever, in constant memory. Once the
+    buffer is full, each new sample overwrites the oldest sample.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        assert capacity > 0, f"capacity must be positive, not {capacity}"
+        self._capacity = capacity
+        self._timestamps = array("d", bytes(8 * capacity))
+        self._production_W = array("d", bytes(8 * capacity))
+        # NaN means that there's no consumption meter.
+        self._consumption_W = array("d", bytes(8 * capacity))
+        self._next = 0  # The index of the next sample to be written.
+        self._len = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        return self._len
+
+    def append(self, timestamp: float, production_W: float, consumption_W: float | None) -> None:
+        if self._len > 0:
+            newest = self._timestamps[(self._next - 1) % self._capacity]
+            assert timestamp >= newest, f"Samples must be in time order ({timestamp} < {newest})!"
+        i = self._next
+        self._timestamps[i] = timestamp
+        self._production_W[i] = production_W
+        self._consumption_W[i] = math.nan if consumption_W is None else consumption_W
+        self._next = (i + 1) % self._capacity
+        self._len = min(self._len + 1, self._capacity)
+
+    def samples(self, start: float = -math.inf, end: float = math.inf) -> list[PowerSample]:
+        """The samples with `start <= timestamp < end`, oldest first."""
+        oldest = (self._next - self._len) % self._capacity
+        samples = []
+        for j in range(self._len):
+            i = (oldest + j) % self._capacity
+            timestamp = self._timestamps[i]
+            if start <= timestamp < end:
+                consumption_W = self._consumption_W[i]
+                samples.append(
+                    PowerSample(
+                        timestamp,
+                        self._production_W[i],
+                        None if math.isnan(consumption_W) else consumption_W,
+                    )
+                )
+        return samples
+
+
+def downsample(samples: Sequence[PowerSample], period_start: int) -> MinuteOfPower:
+    """Aggregate one minute of samples."""
+    assert len(samples) > 0, "Can't downsample zero samples!"
+    production_W = [sample.production_W for sample in samples]
+    consumption_W = [s.consumption_W for s in samples if s.consumption_W is not None]
+    return MinuteOfPower(
+        period_start=period_start,
+        mean_production_W=sum(production_W) / len(production_W),
+        min_production_W=min(production_W),
+        max_production_W=max(production_W),
+        mean_consumption_W=sum(consumption_W) / len(consumption_W) if consumption_W else None,
+        n_samples=len(samples),
+    )
+
+
+class LivePowerSampler:
+    """Samples the power of one site. `sample` is called by the daemon's `Scheduler`, and `write` is
+    called from a `BackgroundTask`, so the (slow) Parquet writes never delay the samples."""
+
+    def __init__(
+        self, config: EnvoyRecorderConfig, clock: Callable[[], float] = time.time
+    ) -> None:
+        assert config.envoy is not None, "Create one `LivePowerSampler` per site."
+        self._config = config
+        self._envoy = config.envoy
+        # Our own connection to the Envoy, because `requests.Session` isn't thread-safe.
+        self._envoy_client = EnvoyClient(self._envoy)
+        self._clock = clock
+        self._ring_buffer = PowerRingBuffer(config.live_power.ring_buffer_size)
+        # The start of the minute which is currently being sampled, in Unix time.
+        self._current_minute: int | None = None
+        # The 1-minute aggregates which haven't been written to Parquet yet.
+        self._pending: list[MinuteOfPower] = []
+        # `sample` and `write` are called from different threads.
+        self._lock = threading.Lock()
+
+    @property
+    def site(self) -> str | None:
+        return self._envoy.name
+
+    @property
+    def ring_buffer(self) -> PowerRingBuffer:
+        return self._ring_buffer
+
+    def sample(self) -> None:
+        timestamp = self._clock()
+        try:
+            production_W, consumption_W = parse_production(self._fetch_production())
+        except (requests.RequestException, ValueError, KeyError) as e:
+            # Don't fill the logs with stack traces every few seconds whilst the Envoy is down.
+            log.warning("Failed to sample the power of site %s: %r", self.site, e)
+            metrics.count(name="live_power.failed_samples", attributes=self._metric_attributes)
+            return
+        with self._lock:
+            self._close_finished_minute(timestamp)
+            self._ring_buffer.append(timestamp, production_W, consumption_W)
+            if self._current_minute is None:
+                self._current_minute = _start_of_minute(timestamp)
+
+    def write(self) -> list[Path]:
+        """Write the 1-minute aggregates of every finished minute to Parquet. Returns the paths of
+        the Parquet files which were written."""
+        with self._lock:
+            self._close_finished_minute(self._clock())
+            minutes, self._pending = self._pending, []
+        if not minutes:
+            return []
+        try:
+            return write_minutes(minutes, self._config.paths.live_power)
+        except BaseException:
+            # Try again next time.
+            with self._lock:
+                self._pending = minutes + self._pending
+            raise
+
+    def _fetch_production(self) -> str:
+        return self._envoy_client.fetch_production(
+            retry_window_seconds=self._config.live_power.sample_every_n_seconds
+        )
+
+    def _close_finished_minute(self, now: float) -> None:
+        """If the current minute has finished, downsample its samples."""
+        if self._current_minute is None or now < self._current_minute + 60:
+            return
+        samples = self._ring_buffer.samples(self._current_minute, self._current_minute + 60)
+        if samples:
+            self._pending.append(downsample(samples, self._current_minute))
+        # The next minute starts with the next sample.
+        self._current_minute = None
+
+    @property
+    def _metric_attributes(self) -> dict[str, str]:
+        return {} if self.site is None else {"site": self.site}
+
+
+def write_minutes(minutes: Sequence[MinuteOfPower], root: Path) -> list[Path]:
+    """Merge 1-minute aggregates into the Hive-partitioned table at `root`. Minutes which are already
+    in the table are replaced. Returns the paths of the Parquet files which were written."""
+    # Import lazily, because importing Polars is slow. See the comment at the top of this file.
+    import patito as pt
+    import polars as pl
+
+    from envoy_recorder.json_to_dataframe import PARTITION_KEYS
+    from envoy_recorder.parquet_archive import write_hive_partitions
+    from envoy_recorder.reader import partition_path
+    from envoy_recorder.schemas import LivePowerDataFrame
+
+    df = (
+        pl.DataFrame([asdict(minute) for minute in minutes])
+        .with_columns(
+            pl.from_epoch("period_start", time_unit="s").dt.replace_time_zone("UTC"),
+            pl.col("mean_consumption_W").cast(pl.Float64),
+        )
+        .with_columns(
+            year=pl.col("period_start").dt.year(),
+            month=pl.col("period_start").dt.month(),
+        )
+        .select(LivePowerDataFrame.columns)
+        .cast(pl.Schema(LivePowerDataFrame.dtypes))
+    )
+    old_paths = []
+    for key in df.select(PARTITION_KEYS).unique().rows():
+        old_paths.extend(sorted(partition_path(root, PARTITION_KEYS, key).glob("*.parquet")))
+    if old_paths:
+        old_df = pl.read_parquet(old_paths, hive_partitioning=False)
+        df = pl.concat([old_df, df]).unique("period_start", keep="last")
+    df = pt.DataFrame[LivePowerDataFrame](df.sort("period_start"))
+    log.info("Writing %d new 1-minute aggregate(s) of power to %s", len(minutes), root)
+    return write_hive_partitions(df, root)
+
+
+def _start_of_minute(timestamp: float) -> int:
+    return int(timestamp // 60 * 60)
@@ -0,0 +1,52 @@
+"""Advisory file locks, which coordinate the processes (and threads) which share a data directory.
+
+Cron starts a new process every minute, whether or not the previous process has finished, so:
+
+- `<state>/fetch.lock` is held whilst polling the Envoy, so that a poll which is still retrying a
+  stalled Envoy isn't joined by another poll.
+- `<state>/live_buffer.lock` is held briefly whilst writing to (or moving) the incoming live buffer,
+  so that a response is never written into a live buffer which a flush has just started parsing.
+- `<state>/flush.lock` is held for the whole of a flush, so that only one process flushes at a time.
+- `<state>/upload.lock` is held whilst draining the upload queue.
+"""
+
+import fcntl
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from pathlib import Path
+
+
+@contextmanager
+def try_lock(path: Path) -> Generator[bool]:
+    """Try to take an exclusive lock on `path`, without waiting. Yields True if we got the lock.
+
+    The lock is an advisory `flock`, so it's released automatically by the OS if the process dies.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def lock(path: Path) -> Generator[float]:
+    """Take an exclusive lock on `path`, waiting for as long as it takes. Yields the number of
+    seconds we waited for the lock.
+
+    Only use this for locks which are held briefly (e.g. whilst writing a single file)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        t0 = time.perf_counter()
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield time.perf_counter() - t0
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
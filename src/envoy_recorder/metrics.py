@@ -0,0 +1,113 @@
+"""Metrics, sent to Sentry and (optionally) appended to a local JSON-lines file.
+
+Please send every metric through this module (rather than calling `sentry_sdk.metrics` directly),
+so that the metrics are still recorded on machines which don't use Sentry. Set
+`logging.metrics_file` in `config.toml` to append each metric to a local file. Each line is a JSON
+object like:
+
+    {"time": "2026-01-06T10:52:35.123456+00:00", "type": "distribution",
+     "name": "flush.write_archive.duration", "value": 0.31, "unit": "seconds", "attributes": {}}
+
+Use `timed` to time a stage of a run. Each stage is recorded as a Sentry span (so it shows up in
+Sentry's trace view) and as a `<stage>.duration` distribution, in seconds. For example:
+
+    with metrics.timed("flush.parse_json"):
+        df = convert_directory_of_json_files_to_dataframe(path)
+
+Use `with_attributes` to attach attributes (e.g. the site) to every metric recorded in a block.
+
+This module is imported by `envoy_recorder.py`, so it must stay quick to import.
+"""
+
+import json
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, Literal
+
+import sentry_sdk
+
+_metrics_file: Path | None = None
+# The daemon records metrics from several threads.
+_lock = threading.Lock()
+# Set by `with_attributes`.
+_default_attributes: ContextVar[dict[str, Any] | None] = ContextVar(
+    "_default_attributes", default=None
+)
+
+
+def set_metrics_file(path: Path | None) -> None:
+    """Append every metric to `path` (or, if `path` is None, stop writing metrics locally)."""
+    global _metrics_file
+    if path is not None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    _metrics_file = path
+
+
+@contextmanager
+def with_attributes(**kwargs: Any) -> Generator[None]:
+    """Attach `kwargs` to every metric recorded (in this thread) inside the `with` block."""
+    token = _default_attributes.set((_default_attributes.get() or {}) | kwargs)
+    try:
+        yield
+    finally:
+        _default_attributes.reset(token)
+
+
+def distribution(
+    name: str, value: float, unit: str | None = None, attributes: dict[str, Any] | None = None
+) -> None:
+    attributes = (_default_attributes.get() or {}) | (attributes or {})
+    sentry_sdk.metrics.distribution(name=name, value=value, unit=unit, attributes=attributes)
+    _write_locally("distribution", name, value, unit, attributes)
+
+
+def count(
+    name: str, value: float = 1, unit: str | None = None, attributes: dict[str, Any] | None = None
+) -> None:
+    attributes = (_default_attributes.get() or {}) | (attributes or {})
+    sentry_sdk.metrics.count(name=name, value=value, unit=unit, attributes=attributes)
+    _write_locally("count", name, value, unit, attributes)
+
+
+@contextmanager
+def timed(name: str, attributes: dict[str, Any] | None = None) -> Generator[None]:
+    """Time the body of the `with` block, as a Sentry span and as a `<name>.duration` metric.
+
+    The duration is recorded even if the body raises an exception.
+    """
+    t0 = time.perf_counter()
+    with sentry_sdk.start_span(op=name, name=name):
+        try:
+            yield
+        finally:
+            distribution(f"{name}.duration", time.perf_counter() - t0, "seconds", attributes)
+
+
+def _write_locally(
+    metric_type: Literal["distribution", "count"],
+    name: str,
+    value: float,
+    unit: str | None,
+    attributes: dict[str, Any],
+) -> None:
+    path = _metrics_file
+    if path is None:
+        return
+    record = {
+        "time": datetime.now(UTC).isoformat(),
+        "type": metric_type,
+        "name": name,
+        "value": value,
+        "unit": unit,
+        "attributes": attributes,
+    }
+    line = json.dumps(record, default=str) + "\n"
+    # Each line is written with a single `write` to a file opened in append mode, so lines from
+    # different processes (e.g. the upload worker) don't get interleaved.
+    with _lock, open(path, "a") as f:
+        f.write(line)
@@ -0,0 +1,51 @@
+"""Report errors and metrics to Sentry, from `scripts/record.py` and from the detached workers.
+
+Set the environment variable `SENTRY_DSN` to report to your own Sentry project (or set it to an
+empty string to disable Sentry, e.g. in tests).
+
+The workers are imported by `envoy_recorder.py`, so this module must stay quick to import.
+"""
+
+import os
+from collections.abc import Callable
+
+import sentry_sdk
+
+from envoy_recorder.logging import get_logger
+
+log = get_logger(__name__)
+
+_DEFAULT_SENTRY_DSN = "https://fed4b02053480412686e0cdb49e8c7bd@o4510693003034624.ingest.de.sentry.io/4510693008146512"
+
+
+def init_sentry() -> None:
+    sentry_sdk.init(
+        dsn=os.environ.get("SENTRY_DSN", _DEFAULT_SENTRY_DSN),
+        # Add data like request headers and IP for users,
+        # see https://docs.sentry.io/platforms/python/data-management/data-collected/ for more info
+        send_default_pii=True,
+        enable_logs=True,
+    )
+
+
+def run_worker(main: Callable[[], None], name: str) -> None:
+    """Run the `main` function of a detached worker process (see `flush_worker.py` and
+    `upload_queue.py`).
+
+    The workers run after `record.py` has already checked in with Sentry, so a worker's failures
+    aren't covered by `record.py`'s check-in. Instead, any exception raised by `main` is sent to
+    Sentry as an error (and then re-raised, so the worker exits with a non-zero status).
+    """
+    init_sentry()
+    log.info("%s started (pid %d).", name, os.getpid())
+    try:
+        main()
+    except BaseException as e:
+        log.exception("Exception raised in %s!", name)
+        sentry_sdk.capture_exception(e)
+        raise
+    else:
+        log.info("%s finished successfully!", name)
+    finally:
+        # Send the errors and metrics before the process exits.
+        sentry_sdk.flush()
@@ -0,0 +1,96 @@
+"""Poll the Envoy less often, and don't flush, at night.
+
+Overnight, the Envoy just repeats the last reading from the evening. So, with
+`intervals.adaptive_night_polling = true`, we only poll every `night_poll_every_n_minutes` at night,
+and we skip flushes altogether (there's nothing new to flush, and nothing new to upload).
+
+It's night once no micro-inverter has reported a new reading with non-zero energy for
+`night_after_n_minutes_without_production`. (The time of the last such reading is the mtime of
+`paths.last_production`, so this also works when cron starts a fresh process every minute.) Polling
+ramps back up as soon as a poll sees a new reading with non-zero energy. If the Envoy's `latitude`
+and `longitude` are configured then it's also only night whilst the sun is below
+`night_below_solar_elevation_degrees`, so polling ramps up just before dawn, rather than up to
+`night_poll_every_n_minutes` after the first reading of the morning.
+
+The night-time polls are aligned to multiples of `night_poll_every_n_minutes` (in Unix time), so
+this module doesn't need to remember when we last polled.
+
+This module is imported by `envoy_recorder.py`, so it must stay quick to import.
+"""
+
+import math
+import time
+from pathlib import Path
+
+from envoy_recorder.config_loader import EnvoyConfig, IntervalsConfig
+
+# 2000-01-01T12:00:00Z, the J2000.0 epoch.
+_J2000_UNIX_TIMESTAMP = 946_728_000
+
+
+def solar_elevation_degrees(timestamp: float, latitude: float, longitude: float) -> float:
+    """The elevation of the centre of the sun above the horizon, ignoring atmospheric refraction.
+
+    Uses the US Naval Observatory's low-precision formulae, which are accurate to about a degree,
+    which is plenty for our purposes.
+    """
+    days = (timestamp - _J2000_UNIX_TIMESTAMP) / 86_400
+    mean_anomaly = math.radians((357.529 + 0.98560028 * days) % 360)
+    mean_longitude = (280.459 + 0.98564736 * days) % 360
+    ecliptic_longitude = math.radians(
+        mean_longitude + 1.915 * math.sin(mean_anomaly) + 0.020 * math.sin(2 * mean_anomaly)
+    )
+    obliquity = math.radians(23.439 - 0.00000036 * days)
+    declination = math.asin(math.sin(obliquity) * math.sin(ecliptic_longitude))
+    right_ascension = math.atan2(
+        math.cos(obliquity) * math.sin(ecliptic_longitude), math.cos(ecliptic_longitude)
+    )
+    sidereal_time_hours = (18.697374558 + 24.06570982441908 * days) % 24
+    hour_angle = math.radians(sidereal_time_hours * 15 + longitude) - right_ascension
+    latitude_radians = math.radians(latitude)
+    return math.degrees(
+        math.asin(
+            math.sin(latitude_radians) * math.sin(declination)
+            + math.cos(latitude_radians) * math.cos(declination) * math.cos(hour_angle)
+        )
+    )
+
+
+class NightSchedule:
+    def __init__(
+        self, intervals: IntervalsConfig, envoy: EnvoyConfig, last_production: Path
+    ) -> None:
+        self._intervals = intervals
+        self._envoy = envoy
+        self._last_production = last_production
+
+    def is_night(self, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        try:
+            last_production = self._last_production.stat().st_mtime
+        except FileNotFoundError:
+            # We haven't seen any production yet, so we can't tell whether it's night.
+            return False
+        minutes_without_production = (now - last_production) / 60
+        if minutes_without_production < self._intervals.night_after_n_minutes_without_production:
+            return False
+        if self._envoy.latitude is None or self._envoy.longitude is None:
+            return True
+        elevation = solar_elevation_degrees(now, self._envoy.latitude, self._envoy.longitude)
+        return elevation < self._intervals.night_below_solar_elevation_degrees
+
+    def should_poll(self, now: float | None = None) -> bool:
+        """Always poll during the day. At night, only poll once every `night_poll_every_n_minutes`.
+
+        Each poll is assumed to happen about `poll_every_n_seconds` after the previous poll (which
+        is also roughly right when cron polls every minute, with the default config).
+        """
+        now = time.time() if now is None else now
+        if not self.is_night(now):
+            return True
+        seconds_since_night_poll = now % (self._intervals.night_poll_every_n_minutes * 60)
+        return seconds_since_night_poll < self._intervals.poll_every_n_seconds
+
+    def record_production(self) -> None:
+        """Record that the Envoy has just reported a new reading with non-zero energy."""
+        self._last_production.touch()
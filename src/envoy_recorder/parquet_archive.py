@@ -0,0 +1,437 @@
+import os
+import tempfile
+from collections.abc import Iterable, Sequence
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import BinaryIO
+
+import patito as pt
+import polars as pl
+
+from envoy_recorder import metrics
+from envoy_recorder.archive_manifest import ArchiveManifest
+from envoy_recorder.config_loader import ArchiveConfig, LiveBufferConfig
+from envoy_recorder.hot_tier import HotTier
+from envoy_recorder.json_to_dataframe import (
+    PARTITION_KEYS,
+    PRIMARY_KEYS,
+    iter_dataframe_chunks,
+)
+from envoy_recorder.logging import get_logger
+from envoy_recorder.reader import HOT_TIER_SUFFIX, ArchiveReader, PartitionKey, partition_path
+from envoy_recorder.schemas import ProcessedEnvoyDataFrame
+
+log = get_logger(__name__)
+
+# The filename that `pl.DataFrame.write_parquet(partition_by=...)` uses for each partition. We use
+# the same name so that archives written by older versions of envoy_recorder are updated in place.
+PARTITION_FILENAME = "00000000.parquet"
+
+DEFAULT_CHUNK_JSON_BYTES = LiveBufferConfig().flush_chunk_json_bytes
+
+
+def write_parquet_file(df: pl.DataFrame, file: BinaryIO, layout: ArchiveConfig) -> None:
+    """Write `df` (which must be sorted by `PRIMARY_KEYS`) using the Parquet layout in `layout`."""
+    statistics = "full" if layout.statistics == "full" else True
+    if layout.writer == "polars":
+        row_group_size = None
+        if layout.row_groups == "per_serial_number" and df.height > 0:
+            row_group_size = df.group_by("serial_number").len().select(pl.max("len")).item()
+        df.write_parquet(
+            file,
+            compression="zstd",
+            compression_level=layout.compression_level,
+            statistics=statistics,
+            row_group_size=row_group_size,
+        )
+        return
+
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(
+            "`config.archive.writer = 'pyarrow'` requires pyarrow. Please `pip install pyarrow`."
+        ) from None
+    table = df.to_arrow()
+    bloom_filter_options = None
+    if layout.serial_number_bloom_filter:
+        n_serial_numbers = max(df["serial_number"].n_unique(), 1)
+        bloom_filter_options = {"serial_number": {"ndv": n_serial_numbers, "fpp": 0.01}}
+    with pq.ParquetWriter(
+        file,
+        table.schema,
+        compression="zstd",
+        compression_level=layout.compression_level,
+        write_statistics=True,
+        write_page_index=True,
+        sorting_columns=[
+            pq.SortingColumn(table.schema.get_field_index(name)) for name in PRIMARY_KEYS
+        ],
+        bloom_filter_options=bloom_filter_options,
+    ) as writer:
+        if layout.row_groups == "per_serial_number":
+            # Each call to `write_table` starts a new row group.
+            offset = 0
+            for length in df["serial_number"].rle().struct.field("len"):
+                writer.write_table(table.slice(offset, length), row_group_size=length)
+                offset += length
+        else:
+            writer.write_table(table)
+
+
+def write_hive_partitions(
+    df: pl.DataFrame,
+    root: Path,
+    partition_keys: Sequence[str] = PARTITION_KEYS,
+    layout: ArchiveConfig | None = None,
+    **write_parquet_kwargs,
+) -> list[Path]:
+    """Replace the Hive partitions present in `df`. Leave all other partitions untouched.
+
+    Each partition is written to a temporary file in a staging directory next to `root`, and then
+    atomically renamed over the old partition file. So a crash mid-write never leaves a half-written
+    Parquet file in the archive. (We don't write the temporary file into `root` itself because
+    `pl.scan_parquet(root)` refuses to read a directory which contains non-Parquet files).
+
+    If `layout` is given then each partition is written with `write_parquet_file`. Otherwise,
+    `write_parquet_kwargs` are passed to `pl.DataFrame.write_parquet`.
+
+    Returns the paths of the Parquet files which were written.
+    """
+    write_parquet_kwargs.setdefault("compression", "zstd")
+    staging_dir = root.parent / f".{root.name}.staging"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    written_paths = []
+    for key, partition_df in df.partition_by(partition_keys, as_dict=True).items():
+        directory = partition_path(root, partition_keys, key)
+        directory.mkdir(parents=True, exist_ok=True)
+        final_path = directory / PARTITION_FILENAME
+        fd, tmp_name = tempfile.mkstemp(dir=staging_dir, suffix=".parquet")
+        tmp_path = Path(tmp_name)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if layout is None:
+                    partition_df.write_parquet(f, **write_parquet_kwargs)
+                else:
+                    write_parquet_file(partition_df, f, layout)
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_path.replace(final_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        _fsync_directory(directory)
+
+        # Remove any other Parquet files in this partition (e.g. if an old version of Polars split
+        # the partition across multiple files), because their rows are now in `final_path`.
+        for other_path in directory.glob("*.parquet"):
+            if other_path != final_path:
+                other_path.unlink()
+
+        log.info("Wrote %d rows to %s", partition_df.height, final_path)
+        written_paths.append(final_path)
+    return written_paths
+
+
+def _fsync_directory(directory: Path) -> None:
+    """Make sure a rename within `directory` has been persisted to disk."""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ParquetArchive:
+    """The Hive-partitioned Parquet archive on local disk.
+
+    This module imports Polars and Patito, which are slow to import. So `envoy_recorder.py` only
+    imports this module when it's time to flush the live buffer.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        manifest_path: Path,
+        reader: ArchiveReader | None = None,
+        config: ArchiveConfig | None = None,
+        hot_tier: HotTier | None = None,
+    ) -> None:
+        """Pass in a long-lived `reader` to keep recently flushed partitions cached in memory
+        between flushes (e.g. when running as a daemon). The `reader` must read the same
+        `hot_tier`."""
+        self._path = path
+        self._config = ArchiveConfig() if config is None else config
+        self._manifest_path = manifest_path
+        self._manifest: ArchiveManifest | None = None
+        self._hot_tier = hot_tier
+        hot_tier_root = None if hot_tier is None else hot_tier.root
+        self._reader = (
+            ArchiveReader(path, hot_tier_root=hot_tier_root) if reader is None else reader
+        )
+        assert self._reader.root == path, f"The reader reads {self._reader.root}, not {path}!"
+        assert self._reader.hot_tier_root == hot_tier_root, (
+            "The reader reads a different hot tier!"
+        )
+        assert not self._config.hot_tier or hot_tier is not None, "Please pass in the `hot_tier`."
+
+    @property
+    def manifest(self) -> ArchiveManifest:
+        if self._manifest is None:
+            self._manifest = ArchiveManifest.load(self._manifest_path)
+        if self._manifest is None:
+            self._manifest = self._rebuild_manifest()
+            self._manifest.save(self._manifest_path)
+        return self._manifest
+
+    def append_to_parquet_in_memory(
+        self,
+        buffer_processing_paths: Path | Sequence[Path],
+        max_chunk_json_bytes: int = DEFAULT_CHUNK_JSON_BYTES,
+    ) -> pl.DataFrame | None:
+        """Merge the live buffer into the archive partitions which the new rows touch.
+
+        Returns the merged rows of the touched partitions, or None if there's no new data.
+        """
+        new_df = self.load_new_rows(buffer_processing_paths, max_chunk_json_bytes)
+        return self.merge_new_rows(new_df)
+
+    def load_new_rows(
+        self,
+        buffer_processing_paths: Path | Sequence[Path],
+        max_chunk_json_bytes: int = DEFAULT_CHUNK_JSON_BYTES,
+    ) -> pl.DataFrame:
+        """Load the rows from the live buffer(s) which aren't in the archive yet.
+
+        Pass several live buffer directories (e.g. left behind by flushes which crashed) to load
+        them all in one pass. Each directory is parsed in chunks of `max_chunk_json_bytes` of JSON,
+        and each chunk is de-duplicated (and compared with the archive) before the next chunk is
+        parsed. The Envoy repeats each reading until the micro-inverter sends a new reading, so the
+        new rows are much smaller than the live buffer.
+        """
+        if isinstance(buffer_processing_paths, Path):
+            buffer_processing_paths = [buffer_processing_paths]
+        new_df = None
+        with metrics.timed("flush.parse_json"):
+            for path in buffer_processing_paths:
+                for chunk in iter_dataframe_chunks(path, max_chunk_json_bytes):
+                    chunk = self._filter_rows_newer_than_watermarks(chunk)
+                    if new_df is not None:
+                        chunk = pl.concat([new_df, chunk])
+                    new_df = chunk.unique(subset=PRIMARY_KEYS, maintain_order=True)
+        assert new_df is not None, "No live buffer directories were given!"
+        return new_df
+
+    def merge_new_rows(self, new_df: pl.DataFrame) -> pl.DataFrame | None:
+        """Merge `new_df` (from `load_new_rows`) with the archive partitions which it touches.
+
+        Returns the merged rows of the touched partitions, or None if there's no new data.
+        """
+        if new_df.height == 0:
+            # This is the common case at night. We haven't had to read any Parquet!
+            log.info("None of the rows in the live buffer are newer than the archive.")
+            return None
+        touched_partitions = new_df.select(PARTITION_KEYS).unique().rows()
+        with metrics.timed("flush.load_archive"):
+            old_df = self.load_partitions(touched_partitions)
+        n_old_rows = old_df.height
+        with metrics.timed("flush.merge"):
+            # Polars' streaming engine avoids materialising the intermediate steps, so we don't hold
+            # several copies of the partitions at once.
+            merged_df = (
+                pl.concat([old_df.lazy(), new_df.lazy()])
+                .unique(subset=PRIMARY_KEYS)
+                .sort(PRIMARY_KEYS)
+                .collect(engine="streaming")
+            )
+        del old_df
+        start, end = merged_df.select(
+            start=pl.col("period_end_time").min(), end=pl.col("period_end_time").max()
+        )
+        n_rows_appended = merged_df.height - n_old_rows
+        log.info(
+            "Appended %d rows. The merged dataframe now has %d rows of data, from %s to %s.",
+            n_rows_appended,
+            merged_df.height,
+            start.item(),
+            end.item(),
+        )
+        metrics.distribution(
+            name="dataframe.n_rows_after_merging",
+            value=merged_df.height,
+            unit="rows",
+        )
+        metrics.distribution(
+            name="dataframe.n_rows_appended_after_de_dupe",
+            value=n_rows_appended,
+            unit="rows",
+        )
+        if n_rows_appended == 0:
+            return None
+        else:
+            return merged_df
+
+    def write(self, df: pl.DataFrame, new_df: pl.DataFrame | None = None) -> list[Path]:
+        """Save the partitions present in `df` (from `merge_new_rows`), and then update the manifest.
+
+        If the hot tier is enabled (and `new_df`, the rows which are new in `df`, is given) then
+        `new_df` is appended to the hot tier, instead of re-writing the Parquet partitions. Either
+        way, any hot-tier partitions which are due to be compacted are then compacted.
+
+        Returns the paths of the Parquet files which were written.
+        """
+        with metrics.timed("flush.write_archive"):
+            if self._config.hot_tier and new_df is not None:
+                assert self._hot_tier is not None
+                self._hot_tier.append(new_df)
+                self._remember_partitions(df)
+                written_paths = []
+            else:
+                written_paths = self._write_parquet_partitions(df)
+            self._update_manifest(df)
+        # If the hot tier has been disabled then compact whatever is left in it.
+        return written_paths + self.compact_hot_tier(force=not self._config.hot_tier)
+
+    def compact_hot_tier(self, force: bool = False, now: datetime | None = None) -> list[Path]:
+        """Convert hot-tier partitions into sorted, compressed Parquet partitions.
+
+        A partition is compacted if it's from an earlier month than `now`, or if its oldest IPC
+        file is older than `compact_hot_tier_every_n_minutes`. Or, if `force`, every partition is
+        compacted.
+
+        Returns the paths of the Parquet files which were written.
+        """
+        if self._hot_tier is None:
+            return []
+        now = datetime.now(UTC) if now is None else now
+        max_age_seconds = self._config.compact_hot_tier_every_n_minutes * 60
+        written_paths = []
+        for key in self._hot_tier.partitions():
+            age_seconds = self._hot_tier.age_of_oldest_file(key)
+            is_due = key < (now.year, now.month) or (
+                age_seconds is not None and age_seconds >= max_age_seconds
+            )
+            if not (force or is_due):
+                continue
+            # The reader returns the union of the Parquet partition and the hot tier.
+            df = self._reader.load_partition(key)
+            if df is not None:
+                log.info("Compacting the hot tier of partition %s...", key)
+                with metrics.timed("flush.compact_hot_tier"):
+                    written_paths += self._write_parquet_partitions(df)
+        return written_paths
+
+    def _write_parquet_partitions(self, df: pl.DataFrame) -> list[Path]:
+        """Atomically replace the partitions present in `df`, which must hold every row of each
+        partition in both tiers. Then remove those partitions' hot-tier files."""
+        keys = df.select(PARTITION_KEYS).unique().rows()
+        hot_tier = self._hot_tier
+        hot_tier_paths = []
+        if hot_tier is not None:
+            hot_tier_paths = [path for key in keys for path in hot_tier.files(key)]
+        written_paths = write_hive_partitions(df, self._path, layout=self._config)
+        if hot_tier is not None and hot_tier_paths:
+            # Only remove the IPC files once their rows are safely in Parquet. If we crash before
+            # then, the reader ignores the duplicate rows.
+            hot_tier.remove(hot_tier_paths)
+        self._remember_partitions(df)
+        return written_paths
+
+    def _remember_partitions(self, df: pl.DataFrame) -> None:
+        for key, partition_df in df.partition_by(PARTITION_KEYS, as_dict=True).items():
+            self._reader.remember(key, partition_df)
+
+    def _filter_rows_newer_than_watermarks(self, df: pl.DataFrame) -> pl.DataFrame:
+        """Drop rows which are no newer than the latest row in the archive for that inverter.
+
+        Each micro-inverter's readings arrive in chronological order, so any row at or before that
+        inverter's watermark must already be in the archive.
+        """
+        watermarks = pl.DataFrame(
+            {
+                "serial_number": list(self.manifest.watermarks.keys()),
+                "_watermark": list(self.manifest.watermarks.values()),
+            },
+            schema={"serial_number": pl.String, "_watermark": pl.Datetime("us", "UTC")},
+        )
+        n_rows_before = df.height
+        df = (
+            df.with_columns(_serial_number=pl.col("serial_number").cast(pl.String))
+            .join(watermarks, left_on="_serial_number", right_on="serial_number", how="left")
+            .filter(
+                pl.col("_watermark").is_null() | (pl.col("period_end_time") > pl.col("_watermark"))
+            )
+            .drop("_serial_number", "_watermark")
+        )
+        log.info(
+            "%d of the %d rows from the live buffer are newer than the archive's watermarks.",
+            df.height,
+            n_rows_before,
+        )
+        return df
+
+    def _update_manifest(self, df: pl.DataFrame) -> None:
+        """Update the manifest after writing `df`, which must contain *complete* partitions."""
+        manifest = self.manifest
+        latest = df.group_by("serial_number").agg(pl.col("period_end_time").max())
+        for serial_number, period_end_time in latest.iter_rows():
+            old_watermark = manifest.watermarks.get(serial_number)
+            if old_watermark is None or period_end_time > old_watermark:
+                manifest.watermarks[serial_number] = period_end_time
+        row_counts = df.group_by(PARTITION_KEYS).len()
+        for *key, n_rows in row_counts.iter_rows():
+            relative_path = partition_path(Path(), PARTITION_KEYS, tuple(key))
+            manifest.partition_row_counts[relative_path.as_posix()] = n_rows
+        manifest.save(self._manifest_path)
+
+    def _rebuild_manifest(self) -> ArchiveManifest:
+        """Build the manifest by scanning the archive. This only happens if the manifest is lost."""
+        paths = sorted(self._path.glob("**/*.parquet"))
+        hot_tier_paths = []
+        if self._hot_tier is not None:
+            hot_tier_paths = sorted(self._hot_tier.root.glob(f"**/*{HOT_TIER_SUFFIX}"))
+        if len(paths) + len(hot_tier_paths) == 0:
+            return ArchiveManifest()
+        log.info(
+            "Rebuilding the archive manifest from %d Parquet file(s) and %d hot-tier file(s)...",
+            len(paths),
+            len(hot_tier_paths),
+        )
+        columns = ["serial_number", "period_end_time", *PARTITION_KEYS]
+        lazy_dfs = []
+        if paths:
+            lazy_dfs.append(pl.scan_parquet(paths, hive_partitioning=False).select(columns))
+        if hot_tier_paths:
+            lazy_dfs.append(pl.scan_ipc(hot_tier_paths, hive_partitioning=False).select(columns))
+        df = pl.concat(lazy_dfs).unique()
+        latest = (
+            df.group_by("serial_number").agg(pl.col("period_end_time").max()).collect().iter_rows()
+        )
+        row_counts = df.group_by(PARTITION_KEYS).len().collect().iter_rows()
+        return ArchiveManifest(
+            watermarks={serial_number: t for serial_number, t in latest},
+            partition_row_counts={
+                partition_path(Path(), PARTITION_KEYS, tuple(key)).as_posix(): n_rows
+                for *key, n_rows in row_counts
+            },
+        )
+
+    def load_partitions(
+        self, partitions: Iterable[PartitionKey]
+    ) -> pt.DataFrame[ProcessedEnvoyDataFrame]:
+        """Load the given `(year, month)` partitions (from the reader's cache, or from disk).
+
+        Partitions which don't exist on disk yet are ignored. If none of the partitions exist then
+        return an empty dataframe.
+        """
+        df = self._reader.load_partitions(partitions)
+        if df.height == 0:
+            log.info("None of the partitions touched by the new data exist in the archive yet.")
+            return df
+        log.info("Loaded %d rows from the archive.", df.height)
+        metrics.distribution(
+            name="dataframe.n_rows_loaded_from_parquet_archive",
+            value=df.height,
+            unit="rows",
+        )
+        return df
@@ -0,0 +1,97 @@
+"""Compress Envoy responses with gzip, or with Zstandard and a trained dictionary.
+
+Each response from the Envoy is small, and very repetitive: the same keys and the same serial numbers
+appear every minute. gzip can't exploit that repetition across responses, so it gets a poor
+compression ratio. A Zstandard dictionary, trained on sample responses, captures the repetition
+once, so each compressed response only needs to encode what's different.
+
+Each trained dictionary has a (random) 32-bit dictionary ID, which Zstandard writes into the header
+of every frame compressed with that dictionary. Dictionaries are saved as `<dictionary ID>.zdict`
+and are never modified or deleted, so re-training a dictionary never makes old responses unreadable.
+A copy of the dictionary is also saved into each live buffer directory, so each live buffer
+directory can be decompressed on its own.
+"""
+
+import gzip
+import shutil
+from compression import zstd
+from pathlib import Path
+from typing import Literal
+
+from envoy_recorder.logging import get_logger
+
+log = get_logger(__name__)
+
+type Codec = Literal["gzip", "zstd"]
+
+DICTIONARY_SUFFIX = ".zdict"
+# The name of the file (in the dictionary directory) which holds the ID of the dictionary to use
+# when compressing new responses.
+CURRENT_DICTIONARY_FILENAME = "current"
+
+FILE_SUFFIXES: dict[Codec, str] = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def compress(payload: bytes, codec: Codec, zstd_dict: zstd.ZstdDict | None = None) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(payload)
+    return zstd.compress(payload, zstd_dict=zstd_dict)
+
+
+def decompress(data: bytes, codec: Codec, dictionaries: dict[int, zstd.ZstdDict]) -> bytes:
+    """`dictionaries` maps from dictionary ID to dictionary. See `load_dictionaries`."""
+    if codec == "gzip":
+        return gzip.decompress(data)
+    dictionary_id = zstd.get_frame_info(data).dictionary_id
+    if dictionary_id == 0:
+        return zstd.decompress(data)
+    try:
+        zstd_dict = dictionaries[dictionary_id]
+    except KeyError:
+        raise ValueError(f"Zstandard dictionary {dictionary_id} not found!") from None
+    return zstd.decompress(data, zstd_dict=zstd_dict)
+
+
+def train_dictionary(samples: list[bytes], dict_size: int = 16 * 1024) -> zstd.ZstdDict:
+    """Train a dictionary on sample `device_data` responses from the Envoy."""
+    log.info("Training a %d byte Zstandard dictionary on %d samples...", dict_size, len(samples))
+    return zstd.train_dict(samples, dict_size)
+
+
+def save_dictionary(zstd_dict: zstd.ZstdDict, directory: Path, make_current: bool = True) -> Path:
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{zstd_dict.dict_id}{DICTIONARY_SUFFIX}"
+    path.write_bytes(zstd_dict.dict_content)
+    if make_current:
+        (directory / CURRENT_DICTIONARY_FILENAME).write_text(str(zstd_dict.dict_id))
+    log.info("Saved Zstandard dictionary to %s", path)
+    return path
+
+
+def current_dictionary_path(directory: Path) -> Path | None:
+    """Returns None if no dictionary has been trained yet."""
+    try:
+        dictionary_id = (directory / CURRENT_DICTIONARY_FILENAME).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return directory / f"{dictionary_id}{DICTIONARY_SUFFIX}"
+
+
+def load_dictionary(path: Path) -> zstd.ZstdDict:
+    return zstd.ZstdDict(path.read_bytes())
+
+
+def load_dictionaries(directory: Path) -> dict[int, zstd.ZstdDict]:
+    """Load all the dictionaries in `directory`, keyed by dictionary ID."""
+    dictionaries = {}
+    for path in directory.glob(f"*{DICTIONARY_SUFFIX}"):
+        zstd_dict = load_dictionary(path)
+        dictionaries[zstd_dict.dict_id] = zstd_dict
+    return dictionaries
+
+
+def copy_dictionary_into(dictionary_path: Path, directory: Path) -> None:
+    """Copy the dictionary into `directory`, if it isn't there already."""
+    destination = directory / dictionary_path.name
+    if not destination.exists():
+        shutil.copyfile(dictionary_path, destination)
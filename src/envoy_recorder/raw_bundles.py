@@ -0,0 +1,110 @@
+"""Monthly "bundles" of the raw responses from the Envoy, so the archive can be rebuilt.
+
+Each flush deletes the live buffer. So, without the bundles, the Parquet archive is the only copy of
+the data, and a bug in `json_to_dataframe.py` (or a change to the Envoy's JSON schema) can't be
+fixed retrospectively.
+
+With `live_buffer.keep_raw_payloads = true`, each flush first appends every response in the live
+buffer to a segment file (see `segment.py`) for the month (in UTC) in which the response was polled:
+`<raw_bundles>/<YYYY>-<MM>/segment.wal`. Each response is re-compressed with Zstandard, using the
+current dictionary (if there is one), and a copy of the dictionary is saved in the bundle. So each
+bundle is a directory which `convert_directory_of_json_files_to_dataframe` can read directly.
+`scripts/rebuild_archive.py` converts the bundles in parallel, one process per month.
+
+If we crash after bundling the live buffer but before deleting it, the same responses are bundled
+twice. That's harmless: duplicate rows are removed when the bundles are converted.
+"""
+
+import heapq
+import os
+from collections.abc import Iterator
+from compression import zstd
+from datetime import UTC, datetime
+from pathlib import Path
+
+from envoy_recorder.live_buffer import list_payload_files, timestamp_of_payload_file
+from envoy_recorder.logging import get_logger
+from envoy_recorder.payload_compression import (
+    FILE_SUFFIXES,
+    copy_dictionary_into,
+    decompress,
+    load_dictionaries,
+    load_dictionary,
+)
+from envoy_recorder.segment import SEGMENT_FILENAME, SEGMENT_SUFFIX, append_frame, iter_frames
+
+log = get_logger(__name__)
+
+
+def bundle_path(root: Path, timestamp: int) -> Path:
+    """The bundle which holds the responses polled in the same month as `timestamp`."""
+    t = datetime.fromtimestamp(timestamp, tz=UTC)
+    return root / f"{t.year:04d}-{t.month:02d}"
+
+
+def list_bundles(root: Path) -> list[Path]:
+    """All the bundles under `root`, oldest first."""
+    return sorted(path.parent for path in root.glob(f"*/{SEGMENT_FILENAME}"))
+
+
+def iter_payloads(directory: Path) -> Iterator[tuple[int, bytes]]:
+    """Yield `(timestamp, decompressed payload)` for every response in a live buffer directory, in
+    timestamp order.
+
+    The responses are read one at a time (each file is only read when its response is yielded), so
+    the memory used doesn't grow with the size of the live buffer. Duplicate responses (which are
+    recorded without a payload) are skipped.
+    """
+    dictionaries = load_dictionaries(directory)
+    # The frames in each segment are already in the order in which they were polled.
+    streams = [_iter_payload_files(directory, dictionaries)] + [
+        _iter_segment(segment, dictionaries)
+        for segment in sorted(directory.glob(f"*{SEGMENT_SUFFIX}"))
+    ]
+    return heapq.merge(*streams, key=lambda item: item[0])
+
+
+def _iter_payload_files(
+    directory: Path, dictionaries: dict[int, zstd.ZstdDict]
+) -> Iterator[tuple[int, bytes]]:
+    for path in sorted(list_payload_files(directory), key=timestamp_of_payload_file):
+        data = path.read_bytes()
+        for codec, suffix in FILE_SUFFIXES.items():
+            if path.suffix == suffix:
+                data = decompress(data, codec, dictionaries)
+        yield timestamp_of_payload_file(path), data
+
+
+def _iter_segment(
+    segment: Path, dictionaries: dict[int, zstd.ZstdDict]
+) -> Iterator[tuple[int, bytes]]:
+    for timestamp, payload in iter_frames(segment, dictionaries):
+        if payload:
+            yield timestamp, payload
+
+
+def append_to_bundles(
+    directory: Path, root: Path, zstd_dictionary_path: Path | None = None
+) -> int:
+    """Append every response in the live buffer `directory` to the monthly bundles under `root`.
+
+    Returns the number of responses which were appended.
+    """
+    zstd_dict = None if zstd_dictionary_path is None else load_dictionary(zstd_dictionary_path)
+    touched_bundles = set()
+    n_appended = 0
+    for timestamp, payload in iter_payloads(directory):
+        bundle = bundle_path(root, timestamp)
+        if bundle not in touched_bundles:
+            bundle.mkdir(parents=True, exist_ok=True)
+            if zstd_dictionary_path is not None:
+                copy_dictionary_into(zstd_dictionary_path, bundle)
+            touched_bundles.add(bundle)
+        append_frame(bundle / SEGMENT_FILENAME, timestamp, payload, "zstd", zstd_dict)
+        n_appended += 1
+    # The live buffer is deleted next, so make sure the bundles have reached the disk.
+    for bundle in touched_bundles:
+        with open(bundle / SEGMENT_FILENAME, "rb") as f:
+            os.fsync(f.fileno())
+    log.info("Appended %d responses to %d raw bundle(s).", n_appended, len(touched_bundles))
+    return n_appended
@@ -0,0 +1,277 @@
+"""Read rows from the Parquet archive for a time range, without scanning the whole archive.
+
+The archive is Hive-partitioned by the year and month of `period_end_time`, so a time range maps
+directly onto a handful of partition directories. We only ever open those directories. (Asking
+`pl.scan_parquet` to prune partitions would still mean listing every directory in the archive.)
+
+`ArchiveReader` keeps the most recently used partitions in memory. Each cached partition remembers
+the size and modification time of its Parquet file(s), so a partition is re-read from disk only
+if it has been re-written since it was cached. So repeated reads (e.g. a dashboard refreshing every
+minute, or the daemon flushing every 15 minutes) don't touch the disk at all.
+
+If the archive has a hot tier (see `hot_tier.py`), each partition is the union of the Parquet
+partition and the partition's Arrow IPC files in the hot tier.
+
+For example:
+
+    from datetime import UTC, datetime
+    from envoy_recorder import reader
+
+    df = reader.load(datetime(2026, 1, 1, tzinfo=UTC), datetime(2026, 2, 1, tzinfo=UTC))
+"""
+
+from collections import OrderedDict
+from collections.abc import Iterable, Sequence
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import patito as pt
+import polars as pl
+
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.json_to_dataframe import PARTITION_KEYS, PRIMARY_KEYS
+from envoy_recorder.logging import get_logger
+from envoy_recorder.schemas import ProcessedEnvoyDataFrame
+
+log = get_logger(__name__)
+
+type PartitionKey = tuple[int, ...]
+
+# The suffix of the Arrow IPC files in the hot tier. See `hot_tier.py`.
+HOT_TIER_SUFFIX = ".arrow"
+
+# The size and modification time (in nanoseconds) of each file in a partition (in both tiers).
+type _FileVersions = tuple[tuple[str, int, int], ...]
+
+
+def partition_path(root: Path, partition_keys: Sequence[str], key: PartitionKey) -> Path:
+    """Return the Hive partition directory, e.g. `root/year=2026/month=1`."""
+    return root.joinpath(*(f"{name}={value}" for name, value in zip(partition_keys, key)))
+
+
+def months_between(start: datetime, end: datetime) -> list[PartitionKey]:
+    """The `(year, month)` partitions which hold rows in the half-open interval `[start, end)`."""
+    if end <= start:
+        return []
+    # `end` is exclusive, so the last partition is the month of the last microsecond before `end`.
+    last = end - timedelta(microseconds=1)
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (last.year, last.month):
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _file_versions(paths: list[Path]) -> _FileVersions:
+    versions = []
+    for path in paths:
+        stat = path.stat()
+        versions.append((path.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(versions)
+
+
+class ArchiveReader:
+    """Read the Hive-partitioned Parquet archive of a single site, via an LRU partition cache."""
+
+    def __init__(
+        self, root: Path, max_cached_partitions: int = 12, hot_tier_root: Path | None = None
+    ) -> None:
+        """If `hot_tier_root` is given then each partition is the union of the Parquet partition
+        and any Arrow IPC files in the hot tier which haven't been compacted yet."""
+        self._root = root
+        self._hot_tier_root = hot_tier_root
+        self._max_cached_partitions = max_cached_partitions
+        self._cache: OrderedDict[PartitionKey, tuple[_FileVersions, pl.DataFrame]] = OrderedDict()
+        self.n_cache_hits = 0
+        self.n_cache_misses = 0
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    @property
+    def hot_tier_root(self) -> Path | None:
+        return self._hot_tier_root
+
+    def partition_files(self, key: PartitionKey) -> list[Path]:
+        return sorted(partition_path(self._root, PARTITION_KEYS, key).glob("*.parquet"))
+
+    def hot_tier_files(self, key: PartitionKey) -> list[Path]:
+        if self._hot_tier_root is None:
+            return []
+        directory = partition_path(self._hot_tier_root, PARTITION_KEYS, key)
+        return sorted(directory.glob(f"*{HOT_TIER_SUFFIX}"))
+
+    def partitions(self) -> list[PartitionKey]:
+        """The `(year, month)` of every partition on disk (in either tier), oldest first."""
+        roots = [self._root] if self._hot_tier_root is None else [self._root, self._hot_tier_root]
+        keys = set()
+        for root in roots:
+            for directory in root.glob("year=*/month=*"):
+                year = directory.parent.name.removeprefix("year=")
+                keys.add((int(year), int(directory.name.removeprefix("month="))))
+        return sorted(keys)
+
+    def load(
+        self, start: datetime, end: datetime, serials: Iterable[str] | None = None
+    ) -> pt.DataFrame[ProcessedEnvoyDataFrame]:
+        """Load the rows with `start <= period_end_time < end`, optionally only for `serials`.
+
+        Partitions are read through the cache. Use `scan` instead for one-off reads of long time
+        ranges (which would otherwise flush the cache).
+        """
+        partitions = [self.load_partition(key) for key in months_between(start, end)]
+        df = pl.concat([p for p in partitions if p is not None] or [_empty_df()])
+        return pt.DataFrame[ProcessedEnvoyDataFrame](
+            df.filter(_predicate(start, end, serials)).sort("serial_number", "period_end_time")
+        )
+
+    def scan(
+        self, start: datetime, end: datetime, serials: Iterable[str] | None = None
+    ) -> pl.LazyFrame:
+        """Lazily scan the rows with `start <= period_end_time < end`, bypassing the cache.
+
+        Only the partitions which overlap `[start, end)` are scanned, and the predicates are pushed
+        down into the Parquet reader (so it can skip row groups using the Parquet statistics).
+        """
+        keys = months_between(start, end)
+        parquet_paths = [path for key in keys for path in self.partition_files(key)]
+        hot_tier_paths = [path for key in keys for path in self.hot_tier_files(key)]
+        lazy_df = self._scan_files(parquet_paths, hot_tier_paths)
+        return lazy_df.filter(_predicate(start, end, serials))
+
+    def _scan_files(self, parquet_paths: list[Path], hot_tier_paths: list[Path]) -> pl.LazyFrame:
+        lazy_dfs = []
+        if parquet_paths:
+            lazy_dfs.append(pl.scan_parquet(parquet_paths, hive_partitioning=False))
+        if hot_tier_paths:
+            lazy_dfs.append(pl.scan_ipc(hot_tier_paths, hive_partitioning=False))
+        if len(lazy_dfs) == 0:
+            return _empty_df().lazy()
+        lazy_df = pl.concat(lazy_dfs)
+        if hot_tier_paths:
+            # A crash during compaction can leave the same rows in both tiers.
+            lazy_df = lazy_df.unique(subset=PRIMARY_KEYS, keep="first")
+        return lazy_df
+
+    def scan_all(self) -> pl.LazyFrame:
+        """Lazily scan every row in the archive (in both tiers), bypassing the cache."""
+        parquet_paths = sorted(self._root.glob("**/*.parquet"))
+        hot_tier_paths = []
+        if self._hot_tier_root is not None:
+            hot_tier_paths = sorted(self._hot_tier_root.glob(f"**/*{HOT_TIER_SUFFIX}"))
+        return self._scan_files(parquet_paths, hot_tier_paths)
+
+    def load_partitions(
+        self, partitions: Iterable[PartitionKey]
+    ) -> pt.DataFrame[ProcessedEnvoyDataFrame]:
+        """Load whole partitions. Partitions which don't exist on disk yet are ignored."""
+        dfs = [self.load_partition(key) for key in sorted(partitions)]
+        df = pl.concat([df for df in dfs if df is not None] or [_empty_df()])
+        return pt.DataFrame[ProcessedEnvoyDataFrame](df)
+
+    def load_partition(self, key: PartitionKey) -> pl.DataFrame | None:
+        """Load one whole partition, or return None if the partition doesn't exist."""
+        parquet_paths = self.partition_files(key)
+        hot_tier_paths = self.hot_tier_files(key)
+        if len(parquet_paths) + len(hot_tier_paths) == 0:
+            self._cache.pop(key, None)
+            return None
+        versions = _file_versions(parquet_paths + hot_tier_paths)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == versions:
+            self._cache.move_to_end(key)
+            self.n_cache_hits += 1
+            return cached[1]
+        self.n_cache_misses += 1
+        dfs = []
+        if parquet_paths:
+            dfs.append(pl.read_parquet(parquet_paths, hive_partitioning=False))
+        if hot_tier_paths:
+            # Uncompressed IPC files are memory-mapped, so this doesn't copy the data.
+            dfs.append(pl.scan_ipc(hot_tier_paths, hive_partitioning=False).collect())
+        df = pl.concat(dfs)
+        if hot_tier_paths:
+            # A crash during compaction can leave the same rows in both tiers.
+            df = df.unique(subset=PRIMARY_KEYS, keep="first").sort(PRIMARY_KEYS)
+        log.debug("Read %d rows from %s", df.height, parquet_paths + hot_tier_paths)
+        self._remember(key, versions, df)
+        return df
+
+    def remember(self, key: PartitionKey, df: pl.DataFrame) -> None:
+        """Cache a partition which we've just written to disk, so we don't have to read it back."""
+        versions = _file_versions(self.partition_files(key) + self.hot_tier_files(key))
+        self._remember(key, versions, df)
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def _remember(self, key: PartitionKey, versions: _FileVersions, df: pl.DataFrame) -> None:
+        if self._max_cached_partitions <= 0:
+            return
+        self._cache[key] = (versions, df)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._max_cached_partitions:
+            self._cache.popitem(last=False)
+
+
+def _predicate(start: datetime, end: datetime, serials: Iterable[str] | None) -> pl.Expr:
+    assert start.tzinfo is not None and end.tzinfo is not None, "Please use timezone-aware times."
+    predicate = pl.col("period_end_time").is_between(start, end, closed="left")
+    if serials is not None:
+        predicate &= pl.col("serial_number").cast(pl.String).is_in(list(serials))
+    return predicate
+
+
+def _empty_df() -> pl.DataFrame:
+    return pl.DataFrame(schema=ProcessedEnvoyDataFrame.dtypes)
+
+
+# One reader per archive, so that the module-level `load` function shares a cache across calls.
+_readers: dict[Path, ArchiveReader] = {}
+
+
+def get_reader(archive_path: Path | None = None, site: str | None = None) -> ArchiveReader:
+    """Return the shared reader for `archive_path` (by default, the archive in `config.toml`).
+
+    If `config.toml` lists multiple Envoys then `site` chooses which site's archive to read.
+    """
+    hot_tier_root = None
+    if archive_path is None:
+        paths = _site_config(site).paths
+        archive_path, hot_tier_root = paths.parquet_archive, paths.hot_tier
+    if archive_path not in _readers:
+        _readers[archive_path] = ArchiveReader(archive_path, hot_tier_root=hot_tier_root)
+    return _readers[archive_path]
+
+
+def load(
+    start: datetime,
+    end: datetime,
+    serials: Iterable[str] | None = None,
+    archive_path: Path | None = None,
+    site: str | None = None,
+) -> pt.DataFrame[ProcessedEnvoyDataFrame]:
+    """Load the rows with `start <= period_end_time < end`. See `ArchiveReader.load`."""
+    return get_reader(archive_path, site).load(start, end, serials)
+
+
+def scan(
+    start: datetime,
+    end: datetime,
+    serials: Iterable[str] | None = None,
+    archive_path: Path | None = None,
+    site: str | None = None,
+) -> pl.LazyFrame:
+    """Lazily scan the rows with `start <= period_end_time < end`. See `ArchiveReader.scan`."""
+    return get_reader(archive_path, site).scan(start, end, serials)
+
+
+def _site_config(site: str | None) -> EnvoyRecorderConfig:
+    site_configs = EnvoyRecorderConfig.load().site_configs()
+    if site is not None:
+        site_configs = [c for c in site_configs if c.envoy and c.envoy.name == site]
+    if len(site_configs) != 1:
+        raise ValueError("Please use `site` to choose exactly one Envoy.")
+    return site_configs[0]
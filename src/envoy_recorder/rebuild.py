@@ -0,0 +1,232 @@
+"""Rebuild the Parquet archive from the raw monthly bundles (see `raw_bundles.py`).
+
+The bundles are converted in parallel by a pool of processes, one bundle (i.e. one month) per task.
+Each worker writes its own month's partition straight into the new archive, at
+`<state>/rebuild/parquet_archive`, next to the old archive (which is left untouched in the
+meantime). The new archive is only swapped into place once it's complete. The old archive
+and hot tier are moved into `<state>/rebuild/` (delete them once you're happy with the new archive).
+So `paths.state` and `paths.parquet_archive` must be on the same filesystem (they're both under
+`./data` by default).
+
+A response can be bundled in a later month than its readings (e.g. the last reading of the month,
+polled just after midnight). A worker can't write those rows itself (another worker owns that
+month's partition), so it returns them to the parent process, which merges them into their
+partitions once every worker has finished. So the parent only ever holds one month of rows.
+
+Rows from before the first bundled response (i.e. from before `keep_raw_payloads` was enabled) can't
+be regenerated, so they're copied from the old archive, one partition at a time.
+
+Please stop the recorder whilst rebuilding. Anything flushed into the old archive during the rebuild
+would be lost when the archives are swapped.
+"""
+
+import multiprocessing
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from functools import partial
+from pathlib import Path
+
+import polars as pl
+
+from envoy_recorder.config_loader import ArchiveConfig, EnvoyRecorderConfig
+from envoy_recorder.json_to_dataframe import (
+    PARTITION_KEYS,
+    PRIMARY_KEYS,
+    iter_dataframe_chunks,
+)
+from envoy_recorder.logging import get_logger
+from envoy_recorder.parquet_archive import write_hive_partitions
+from envoy_recorder.raw_bundles import list_bundles
+from envoy_recorder.reader import ArchiveReader, PartitionKey
+from envoy_recorder.segment import SEGMENT_FILENAME, read_first_timestamp
+
+log = get_logger(__name__)
+
+
+@dataclass
+class RebuildResult:
+    n_bundles: int
+    n_rows: int
+    seconds: float
+    # Where the old archive (and hot tier) was moved to.
+    old_archive: Path
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.n_rows / self.seconds if self.seconds > 0 else float("nan")
+
+
+@dataclass
+class ConvertedBundle:
+    """What a worker process sends back to the parent: only small things, never a month of rows."""
+
+    n_rows: int
+    seconds: float
+    # The rows which belong to a different month's partition than the bundle's own month.
+    other_months: pl.DataFrame
+
+
+def bundle_partition(bundle: Path) -> PartitionKey:
+    """The `(year, month)` of a bundle, from its name (e.g. `2026-01`). See `raw_bundles.py`."""
+    year, month = bundle.name.split("-")
+    return int(year), int(month)
+
+
+def convert_bundle(
+    bundle: Path, new_archive: Path, layout: ArchiveConfig, max_chunk_json_bytes: int
+) -> ConvertedBundle:
+    """Convert one monthly bundle, and write the bundle's own month to `new_archive`. Runs in a
+    worker process.
+
+    A month of responses is far too big to parse in one go, so the bundle is parsed in chunks, and
+    each chunk is de-duplicated before the next chunk is parsed.
+    """
+    t0 = time.perf_counter()
+    df = None
+    for chunk in iter_dataframe_chunks(bundle, max_chunk_json_bytes):
+        if df is not None:
+            chunk = pl.concat([df, chunk])
+        df = chunk.unique(subset=PRIMARY_KEYS, maintain_order=True)
+    assert df is not None
+    year, month = bundle_partition(bundle)
+    in_own_month = (pl.col("year") == year) & (pl.col("month") == month)
+    own_month = df.filter(in_own_month).sort(PRIMARY_KEYS)
+    write_hive_partitions(own_month, new_archive, layout=layout)
+    return ConvertedBundle(
+        n_rows=df.height,
+        seconds=time.perf_counter() - t0,
+        # A plain `pl.DataFrame`, because Patito's DataFrame subclasses can't be pickled.
+        other_months=pl.DataFrame(df.filter(~in_own_month)),
+    )
+
+
+def rebuild_archive(
+    config: EnvoyRecorderConfig, max_workers: int | None = None
+) -> RebuildResult | None:
+    """Rebuild one site's archive from its bundles, and swap it into place.
+
+    Returns None (and leaves the archive alone) if there are no bundles.
+    """
+    paths = config.paths
+    bundles = list_bundles(paths.raw_bundles)
+    if len(bundles) == 0:
+        log.warning("No raw bundles found in %s. Nothing to rebuild.", paths.raw_bundles)
+        return None
+    t0 = time.perf_counter()
+    new_archive = paths.rebuild / "parquet_archive"
+    shutil.rmtree(new_archive, ignore_errors=True)
+
+    # Polars is multi-threaded, so don't fork a process which has already used Polars.
+    mp_context = multiprocessing.get_context("spawn")
+    other_months = []
+    convert = partial(
+        convert_bundle,
+        new_archive=new_archive,
+        layout=config.archive,
+        max_chunk_json_bytes=config.live_buffer.flush_chunk_json_bytes,
+    )
+    with ProcessPoolExecutor(max_workers, mp_context=mp_context) as executor:
+        for bundle, converted in zip(bundles, executor.map(convert, bundles)):
+            log.info(
+                "Converted %s: %d rows in %.1f seconds (%.0f rows per second per process).",
+                bundle.name,
+                converted.n_rows,
+                converted.seconds,
+                converted.n_rows / converted.seconds if converted.seconds > 0 else float("nan"),
+            )
+            other_months.append(converted.other_months)
+
+    first_timestamp = min(read_first_timestamp(b / SEGMENT_FILENAME) or 0 for b in bundles)
+    _merge_other_months_and_old_rows(
+        config,
+        new_archive,
+        other_months=pl.concat(other_months),
+        first_bundled=datetime.fromtimestamp(first_timestamp, tz=UTC),
+    )
+    shutil.rmtree(new_archive.parent / f".{new_archive.name}.staging", ignore_errors=True)
+    n_rows = _count_rows(new_archive)
+    old_archive = _swap_archives(config, new_archive)
+
+    result = RebuildResult(
+        n_bundles=len(bundles),
+        n_rows=n_rows,
+        seconds=time.perf_counter() - t0,
+        old_archive=old_archive,
+    )
+    log.info(
+        "Rebuilt %s from %d bundles: %d rows in %.1f seconds (%.0f rows per second). The old"
+        " archive is in %s",
+        paths.parquet_archive,
+        result.n_bundles,
+        result.n_rows,
+        result.seconds,
+        result.rows_per_second,
+        result.old_archive,
+    )
+    return result
+
+
+def _merge_other_months_and_old_rows(
+    config: EnvoyRecorderConfig,
+    new_archive: Path,
+    other_months: pl.DataFrame,
+    first_bundled: datetime,
+) -> None:
+    """Merge the rows which the workers couldn't write (see the top of this file), and the old
+    archive's rows from before `first_bundled`, into the new archive, one partition at a time.
+
+    The first bundled responses also hold readings from just before `first_bundled`, so, where the
+    old archive and a bundle have the same row, the regenerated row wins.
+    """
+    paths = config.paths
+    old_reader = ArchiveReader(
+        paths.parquet_archive, max_cached_partitions=0, hot_tier_root=paths.hot_tier
+    )
+    is_old = pl.col("period_end_time") < first_bundled
+    old_partitions = old_reader.scan_all().filter(is_old).select(PARTITION_KEYS).unique().collect()
+    new_reader = ArchiveReader(new_archive, max_cached_partitions=0)
+    other_months_by_partition = other_months.partition_by(PARTITION_KEYS, as_dict=True)
+    n_old_rows = 0
+    for key in sorted(set(old_partitions.rows()) | set(other_months_by_partition)):
+        key = (int(key[0]), int(key[1]))
+        dfs = [new_reader.load_partition(key), other_months_by_partition.get(key)]
+        old_rows = old_reader.load_partition(key)
+        if old_rows is not None:
+            old_rows = old_rows.filter(is_old)
+            n_old_rows += old_rows.height
+            dfs.append(old_rows)
+        df = pl.concat([df for df in dfs if df is not None])
+        df = df.unique(subset=PRIMARY_KEYS, keep="first").sort(PRIMARY_KEYS)
+        write_hive_partitions(df, new_archive, layout=config.archive)
+    log.info("Kept %d rows from before %s from the old archive.", n_old_rows, first_bundled)
+
+
+def _count_rows(archive: Path) -> int:
+    """Count the rows from the Parquet footers, without reading the data."""
+    parquet_paths = sorted(archive.glob("**/*.parquet"))
+    if not parquet_paths:
+        return 0
+    return (
+        pl.scan_parquet(parquet_paths, hive_partitioning=False).select(pl.len()).collect().item()
+    )
+
+
+def _swap_archives(config: EnvoyRecorderConfig, new_archive: Path) -> Path:
+    """Move the old archive out of the way, and the new archive into place."""
+    paths = config.paths
+    old_archive = paths.rebuild / f"old_{time.strftime('%Y%m%dT%H%M%S')}"
+    old_archive.mkdir(parents=True)
+    if paths.parquet_archive.exists():
+        paths.parquet_archive.rename(old_archive / "parquet_archive")
+    # The rows in the hot tier are now in the new archive.
+    if paths.hot_tier.exists():
+        paths.hot_tier.rename(old_archive / "hot_tier")
+    paths.parquet_archive.parent.mkdir(parents=True, exist_ok=True)
+    new_archive.rename(paths.parquet_archive)
+    # The manifest describes the old archive, so it's rebuilt from the new archive when next needed.
+    if paths.archive_manifest.exists():
+        paths.archive_manifest.rename(old_archive / paths.archive_manifest.name)
+    return old_archive
@@ -0,0 +1,235 @@
+"""Pre-aggregated "rollup" tables, so readers don't have to aggregate millions of raw rows.
+
+There are four tables, each stored as its own Hive-partitioned Parquet dataset (partitioned by the
+year and month of `period_start`) under `config.paths.rollups`:
+
+- `inverter_hourly` and `inverter_daily`: energy, peak power and maximum temperature per
+  micro-inverter. See `InverterRollupDataFrame`.
+- `site_hourly` and `site_daily`: the same, for the whole site. See `SiteRollupDataFrame`.
+
+Each reading covers the period from `period_end_time - period_duration` to `period_end_time`, and
+is assigned to the hour (or day) in which its period *starts*. Hours and days are in UTC.
+
+The rollups are maintained incrementally: each flush only recomputes the days which contain newly
+appended rows, from the archive partitions which the flush already has in memory, and replaces
+those days in the rollup tables. Recomputing whole days (rather than adding the new rows to the
+existing totals) means updating the rollups is idempotent, so a crash can't double-count anything.
+
+The days which need recomputing are saved to disk (see `mark_days_pending`) before the flush writes
+the archive and deletes the live buffer. So, if the flush crashes (or `update` raises) before the
+rollups are updated, the next flush recomputes those days, even though their rows are already in
+the archive.
+"""
+
+import json
+from collections.abc import Callable, Iterable
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import patito as pt
+import polars as pl
+
+from envoy_recorder.json_to_dataframe import PARTITION_KEYS
+from envoy_recorder.logging import get_logger
+from envoy_recorder.parquet_archive import write_hive_partitions
+from envoy_recorder.reader import PartitionKey, partition_path
+from envoy_recorder.schemas import InverterRollupDataFrame, SiteRollupDataFrame
+
+log = get_logger(__name__)
+
+ROLLUP_PERIODS = {"hourly": "1h", "daily": "1d"}
+
+# Readings from different micro-inverters don't end at exactly the same time, so, to compute the
+# site's peak power, we add up the power of every micro-inverter in each 15-minute slot.
+_SITE_POWER_SLOT = "15m"
+
+
+def _with_period_start_and_power(df: pl.DataFrame | pl.LazyFrame) -> pl.LazyFrame:
+    duration_seconds = pl.col("period_duration").dt.total_seconds()
+    return df.lazy().with_columns(
+        period_start=pl.col("period_end_time") - pl.col("period_duration"),
+        power_W=pl.when(duration_seconds > 0).then(pl.col("joules_produced") / duration_seconds),
+    )
+
+
+def _with_partition_keys(df: pl.LazyFrame) -> pl.LazyFrame:
+    return df.with_columns(
+        year=pl.col("period_start").dt.year().cast(pl.UInt16),
+        month=pl.col("period_start").dt.month().cast(pl.UInt8),
+    )
+
+
+def _energy_and_temperature() -> list[pl.Expr]:
+    return [
+        (pl.col("joules_produced").cast(pl.Float64).sum() / 3600).alias("energy_Wh"),
+        pl.col("inverter_temperature_Celsius").max().alias("max_inverter_temperature_Celsius"),
+    ]
+
+
+def compute_inverter_rollups(
+    df: pl.DataFrame, every: str
+) -> pt.DataFrame[InverterRollupDataFrame]:
+    """Aggregate raw rows (see `ProcessedEnvoyDataFrame`) into periods of length `every`."""
+    rollups = (
+        _with_period_start_and_power(df)
+        .group_by("serial_number", pl.col("period_start").dt.truncate(every))
+        .agg(
+            *_energy_and_temperature(),
+            pl.col("power_W").max().alias("peak_power_W"),
+            pl.len().alias("n_readings"),
+        )
+        .pipe(_with_partition_keys)
+        .select(InverterRollupDataFrame.columns)
+        .sort("serial_number", "period_start")
+        .collect()
+    )
+    return pt.DataFrame[InverterRollupDataFrame](
+        rollups.cast(pl.Schema(InverterRollupDataFrame.dtypes))
+    )
+
+
+def compute_site_rollups(df: pl.DataFrame, every: str) -> pt.DataFrame[SiteRollupDataFrame]:
+    """Aggregate raw rows (see `ProcessedEnvoyDataFrame`) across all the micro-inverters."""
+    rows = _with_period_start_and_power(df)
+    totals = rows.group_by(pl.col("period_start").dt.truncate(every)).agg(
+        *_energy_and_temperature(),
+        pl.col("serial_number").n_unique().alias("n_inverters"),
+    )
+    peaks = (
+        rows.group_by(pl.col("period_start").dt.truncate(_SITE_POWER_SLOT))
+        .agg(pl.col("power_W").sum())
+        .group_by(pl.col("period_start").dt.truncate(every))
+        .agg(pl.col("power_W").max().alias("peak_power_W"))
+    )
+    rollups = (
+        totals.join(peaks, on="period_start", how="left")
+        .pipe(_with_partition_keys)
+        .select(SiteRollupDataFrame.columns)
+        .sort("period_start")
+        .collect()
+    )
+    return pt.DataFrame[SiteRollupDataFrame](rollups.cast(pl.Schema(SiteRollupDataFrame.dtypes)))
+
+
+def _touched_days(new_df: pl.DataFrame) -> pl.Series:
+    return (
+        _with_period_start_and_power(new_df)
+        .select(pl.col("period_start").dt.truncate("1d").unique())
+        .collect()
+        .to_series()
+    )
+
+
+class RollupTables:
+    def __init__(self, root: Path, pending_days_path: Path | None = None) -> None:
+        """`pending_days_path` is where `mark_days_pending` saves the days which need recomputing."""
+        self._root = root
+        self._pending_days_path = pending_days_path
+
+    def table_path(self, name: str) -> Path:
+        """e.g. `table_path("inverter_hourly")`."""
+        return self._root / name
+
+    def update(
+        self,
+        merged_df: pl.DataFrame,
+        new_df: pl.DataFrame,
+        load_partitions: Callable[[Iterable[PartitionKey]], pl.DataFrame],
+    ) -> list[Path]:
+        """Recompute the rollups for every day which contains a row in `new_df`.
+
+        `merged_df` must hold the complete archive partitions which `new_df` touches (which is what
+        `ParquetArchive.merge_new_rows` returns). A day's readings can spill into a neighbouring
+        partition (e.g. the last reading of the month ends at midnight, in the next month), so any
+        other partitions we need are loaded with `load_partitions`.
+
+        The days saved by `mark_days_pending` are also recomputed, and are forgotten once the
+        rollups have been written.
+
+        Returns the paths of the Parquet files which were written.
+        """
+        touched_days = pl.concat([_touched_days(new_df), self._load_pending_days()]).unique()
+        if touched_days.len() == 0:
+            return []
+        needed_partitions = {
+            (t.year, t.month) for day in touched_days for t in (day, day + timedelta(days=1))
+        }
+        loaded_partitions = set(merged_df.select(PARTITION_KEYS).unique().rows())
+        missing_partitions = needed_partitions - loaded_partitions
+        rows = merged_df
+        if missing_partitions:
+            rows = rows.vstack(load_partitions(missing_partitions))
+        rows = (
+            _with_period_start_and_power(rows)
+            .filter(pl.col("period_start").dt.truncate("1d").is_in(touched_days.implode()))
+            .drop("period_start", "power_W")
+            .collect()
+        )
+        log.info("Recomputing rollups for %d day(s) from %d rows.", len(touched_days), rows.height)
+
+        written_paths = []
+        for period, every in ROLLUP_PERIODS.items():
+            written_paths += self._replace_days(
+                f"inverter_{period}", compute_inverter_rollups(rows, every), touched_days
+            )
+            written_paths += self._replace_days(
+                f"site_{period}", compute_site_rollups(rows, every), touched_days
+            )
+        if self._pending_days_path is not None:
+            self._pending_days_path.unlink(missing_ok=True)
+        return written_paths
+
+    def mark_days_pending(self, new_df: pl.DataFrame) -> None:
+        """Save the days which contain a row in `new_df`, so they're recomputed by the next `update`
+        if this flush doesn't get as far as updating the rollups.
+
+        Call this before writing `new_df` to the archive: once the rows are in the archive, a retry
+        of the flush will no longer see them as new rows."""
+        assert self._pending_days_path is not None, "No `pending_days_path` was given!"
+        days = pl.concat([_touched_days(new_df), self._load_pending_days()]).unique().sort()
+        path = self._pending_days_path
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(json.dumps([day.isoformat() for day in days]))
+        tmp_path.replace(path)
+
+    def has_pending_days(self) -> bool:
+        return self._pending_days_path is not None and self._pending_days_path.exists()
+
+    def _load_pending_days(self) -> pl.Series:
+        path = self._pending_days_path
+        days = []
+        if path is not None and path.exists():
+            days = [datetime.fromisoformat(day) for day in json.loads(path.read_text())]
+        return pl.Series("period_start", days, dtype=pl.Datetime(time_unit="us", time_zone="UTC"))
+
+    def rebuild(
+        self,
+        partitions: Iterable[PartitionKey],
+        load_partitions: Callable[[Iterable[PartitionKey]], pl.DataFrame],
+    ) -> list[Path]:
+        """Recompute every rollup from the archive, e.g. for an archive which predates the rollups.
+
+        The archive is processed one partition (month) at a time, using `update`, so only a month
+        (plus its neighbours, for the days which straddle a month boundary) is in memory at once.
+        """
+        written_paths = set()
+        for key in sorted(partitions):
+            df = load_partitions([key])
+            written_paths.update(self.update(df, df, load_partitions))
+        return sorted(written_paths)
+
+    def _replace_days(self, name: str, rollups: pl.DataFrame, days: pl.Series) -> list[Path]:
+        """Replace the rows for `days` in the rollup table `name`, and leave all other rows alone."""
+        if rollups.height == 0:
+            return []
+        root = self.table_path(name)
+        old_paths = []
+        for key in rollups.select(PARTITION_KEYS).unique().rows():
+            old_paths.extend(sorted(partition_path(root, PARTITION_KEYS, key).glob("*.parquet")))
+        if old_paths:
+            old_rows = pl.read_parquet(old_paths, hive_partitioning=False).filter(
+                ~pl.col("period_start").dt.truncate("1d").is_in(days.implode())
+            )
+            sort_keys = [c for c in ("serial_number", "period_start") if c in rollups.columns]
+            rollups = old_rows.vstack(rollups).sort(sort_keys)
+        return write_hive_partitions(rollups, root)
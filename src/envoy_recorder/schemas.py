@@ -21,3 +21,42 @@ class ProcessedEnvoyDataFrame(pt.Model):
     watt_hours_today: int = pt.Field(dtype=pl.UInt16)
     year: int = pt.Field(dtype=pl.UInt16)
     month: int = pt.Field(dtype=pl.UInt8)
+
+
+class InverterRollupDataFrame(pt.Model):
+    """Hourly or daily aggregates for each micro-inverter. See `rollups.py`."""
+
+    serial_number: str = pt.Field(dtype=pl.Categorical)
+    period_start: datetime = pt.Field(dtype=pl.Datetime(time_unit="us", time_zone="UTC"))
+    energy_Wh: float = pt.Field(dtype=pl.Float64)
+    peak_power_W: float = pt.Field(dtype=pl.Float64)
+    max_inverter_temperature_Celsius: int = pt.Field(dtype=pl.Int8)
+    n_readings: int = pt.Field(dtype=pl.UInt32)
+    year: int = pt.Field(dtype=pl.UInt16)
+    month: int = pt.Field(dtype=pl.UInt8)
+
+
+class SiteRollupDataFrame(pt.Model):
+    """Hourly or daily aggregates for the whole site (all micro-inverters). See `rollups.py`."""
+
+    period_start: datetime = pt.Field(dtype=pl.Datetime(time_unit="us", time_zone="UTC"))
+    energy_Wh: float = pt.Field(dtype=pl.Float64)
+    peak_power_W: float = pt.Field(dtype=pl.Float64)
+    max_inverter_temperature_Celsius: int = pt.Field(dtype=pl.Int8)
+    n_inverters: int = pt.Field(dtype=pl.UInt32)
+    year: int = pt.Field(dtype=pl.UInt16)
+    month: int = pt.Field(dtype=pl.UInt8)
+
+
+class LivePowerDataFrame(pt.Model):
+    """1-minute aggregates of the site's power, sampled every few seconds. See `live_power.py`."""
+
+    period_start: datetime = pt.Field(dtype=pl.Datetime(time_unit="us", time_zone="UTC"))
+    mean_production_W: float = pt.Field(dtype=pl.Float64)
+    min_production_W: float = pt.Field(dtype=pl.Float64)
+    max_production_W: float = pt.Field(dtype=pl.Float64)
+    # Null unless the Envoy has consumption meters.
+    mean_consumption_W: float | None = pt.Field(dtype=pl.Float64)
+    n_samples: int = pt.Field(dtype=pl.UInt16)
+    year: int = pt.Field(dtype=pl.UInt16)
+    month: int = pt.Field(dtype=pl.UInt8)
@@ -0,0 +1,166 @@
+"""An append-only "segment" file which holds many Envoy responses.
+
+This is an optional alternative to saving each Envoy response to its own file in the live buffer.
+Saving a file every minute means lots of small files, lots of inodes, and lots of filesystem metadata
+updates on the SSD. Instead, each buffer period can append all its responses to a single segment
+file.
+
+A segment file starts with a header which holds the timestamp of the first frame, so finding the age
+of the live buffer usually only needs to read the first few bytes of one file.
+
+The header is followed by zero or more frames. Each frame holds one compressed response from the
+Envoy, and starts with its own header which holds the unix timestamp of the poll, the compression
+codec, and the length of the compressed payload. A frame with an empty payload records a poll whose
+response was a duplicate of the previous response.
+
+If we crash half way through appending a frame then the last frame will be truncated. The first
+append by the next process cuts off the truncated frame before appending (later appends by the same
+process know where the last frame ends, so they don't re-read the frame headers), and readers log a
+warning and ignore a truncated frame at the end of the segment.
+"""
+
+import os
+import struct
+import threading
+from collections.abc import Iterator
+from compression import zstd
+from pathlib import Path
+from typing import BinaryIO
+
+from envoy_recorder.logging import get_logger
+from envoy_recorder.payload_compression import Codec, compress, decompress, load_dictionaries
+
+log = get_logger(__name__)
+
+SEGMENT_SUFFIX = ".wal"
+SEGMENT_FILENAME = f"segment{SEGMENT_SUFFIX}"
+
+_MAGIC = b"ENVOYWAL"
+_VERSION = 1
+# Magic bytes, format version, unix timestamp (in seconds) of the first frame.
+_SEGMENT_HEADER = struct.Struct("<8sBQ")
+# Unix timestamp (in seconds) of the poll, compression codec, length of the payload in bytes.
+_FRAME_HEADER = struct.Struct("<QBI")
+
+# The end of the last complete frame of each segment which this process has appended to, and the
+# `(device, inode)` of the segment, so that appending to a segment doesn't have to walk all its frame
+# headers every time.
+_known_ends: dict[Path, tuple[tuple[int, int], int]] = {}
+_known_ends_lock = threading.Lock()
+
+_CODEC_IDS: dict[Codec, int] = {"gzip": 0, "zstd": 1}
+_CODECS_BY_ID: dict[int, Codec] = {codec_id: codec for codec, codec_id in _CODEC_IDS.items()}
+
+
+def append_frame(
+    path: Path,
+    timestamp: int,
+    payload: bytes,
+    codec: Codec = "gzip",
+    zstd_dict: zstd.ZstdDict | None = None,
+) -> None:
+    """Compress `payload` and append it to the segment at `path`, creating the segment if needed.
+
+    Pass an empty `payload` to record a poll which returned a duplicate response. If `zstd_dict` is
+    used then a copy of the dictionary must be saved in the same directory as the segment.
+    """
+    compressed = compress(payload, codec, zstd_dict) if payload else b""
+    frame = _FRAME_HEADER.pack(timestamp, _CODEC_IDS[codec], len(compressed)) + compressed
+    with open(path, "ab+") as f:
+        end = f.seek(0, os.SEEK_END)
+        stat = os.fstat(f.fileno())
+        file_id = (stat.st_dev, stat.st_ino)
+        if end < _SEGMENT_HEADER.size:
+            # The segment is new (or we crashed whilst writing the segment header).
+            f.truncate(0)
+            end = 0
+            frame = _SEGMENT_HEADER.pack(_MAGIC, _VERSION, timestamp) + frame
+        elif _known_ends.get(path) != (file_id, end):
+            # We didn't write the last frame (e.g. this is a new process), so it may have been
+            # truncated by a crash. Only check once: after that, we know where each frame ends.
+            valid_end = _end_of_last_complete_frame(f, end)
+            if valid_end < end:
+                log.warning("Removing a truncated frame from the end of %s", path)
+                f.truncate(valid_end)
+                end = valid_end
+        f.write(frame)
+        with _known_ends_lock:
+            _known_ends[path] = (file_id, end + len(frame))
+
+
+def _end_of_last_complete_frame(f: BinaryIO, end: int) -> int:
+    """Walk the frame headers (seeking over the payloads, which is cheap)."""
+    position = _SEGMENT_HEADER.size
+    while position + _FRAME_HEADER.size <= end:
+        f.seek(position)
+        _, _, length = _FRAME_HEADER.unpack(f.read(_FRAME_HEADER.size))
+        next_position = position + _FRAME_HEADER.size + length
+        if next_position > end:
+            break
+        position = next_position
+    return position
+
+
+def read_first_timestamp(path: Path) -> int | None:
+    """Return the timestamp of the first response in the segment, or None if the segment doesn't
+    hold any responses.
+
+    Frames which record duplicate responses are skipped, so a segment which only holds duplicates
+    is treated like a live buffer which only holds `.dup` files. Those frames are just headers, so
+    skipping them is cheap. Usually the first frame holds a response, and only the segment header
+    and the first frame header are read.
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(_SEGMENT_HEADER.size)
+            if len(header) < _SEGMENT_HEADER.size:
+                return None
+            _unpack_segment_header(header, path)
+            while len(frame_header := f.read(_FRAME_HEADER.size)) == _FRAME_HEADER.size:
+                timestamp, _, length = _FRAME_HEADER.unpack(frame_header)
+                if length > 0:
+                    return timestamp
+    except FileNotFoundError:
+        return None
+    return None
+
+
+def iter_frames(
+    path: Path, dictionaries: dict[int, zstd.ZstdDict] | None = None
+) -> Iterator[tuple[int, bytes]]:
+    """Yield `(timestamp, decompressed payload)` for each frame in the segment at `path`.
+
+    If `dictionaries` is None then Zstandard dictionaries are loaded from the segment's directory.
+    """
+    if dictionaries is None:
+        dictionaries = load_dictionaries(path.parent)
+    with open(path, "rb") as f:
+        _unpack_segment_header(f.read(_SEGMENT_HEADER.size), path)
+        while header := f.read(_FRAME_HEADER.size):
+            if len(header) < _FRAME_HEADER.size:
+                log.warning("Ignoring truncated frame header at the end of %s", path)
+                return
+            timestamp, codec, length = _FRAME_HEADER.unpack(header)
+            compressed = f.read(length)
+            if len(compressed) < length:
+                log.warning(
+                    "Ignoring truncated frame (timestamp %d) at the end of %s", timestamp, path
+                )
+                return
+            if not compressed:
+                yield timestamp, b""
+            elif codec in _CODECS_BY_ID:
+                yield timestamp, decompress(compressed, _CODECS_BY_ID[codec], dictionaries)
+            else:
+                raise ValueError(f"Unknown compression codec {codec} in {path}!")
+
+
+def _unpack_segment_header(header: bytes, path: Path) -> tuple[bytes, int, int]:
+    if len(header) < _SEGMENT_HEADER.size:
+        raise ValueError(f"{path} is too short to be a segment file!")
+    magic, version, first_timestamp = _SEGMENT_HEADER.unpack(header)
+    if magic != _MAGIC:
+        raise ValueError(f"{path} is not a segment file!")
+    if version != _VERSION:
+        raise ValueError(f"{path} has unsupported segment version {version}!")
+    return magic, version, first_timestamp
@@ -0,0 +1,189 @@
+"""Generate realistic, synthetic `device_data` responses from an Envoy, for tests and benchmarks.
+
+The responses mimic a real Envoy (see `example_envoy_json_data/`):
+
+- Each micro-inverter reports a new reading every `report_every_seconds` (about 15 minutes), at its
+  own phase offset, so the inverters' readings don't all change at once. The Envoy repeats each
+  inverter's last reading until the inverter reports again, so consecutive responses mostly repeat
+  the same readings (which the pipeline has to de-duplicate).
+- Inverters only report whilst the sun is up (a crude, UTC-based solar curve). At night, the Envoy
+  repeats the last reading from the evening.
+- `duplicate_ratio` is the probability that a response is an exact copy of the previous response
+  (e.g. because the Envoy's cache hasn't been refreshed).
+- `n_other_devices` adds devices which aren't micro-inverters (e.g. relays), which the pipeline
+  must ignore.
+
+For example:
+
+    envoy = SyntheticEnvoy(n_inverters=30)
+    write_live_buffer(directory, envoy.payloads(start, start + 3600))
+"""
+
+import json
+import math
+import random
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, Literal
+
+from envoy_recorder.payload_compression import FILE_SUFFIXES, Codec, compress
+from envoy_recorder.segment import SEGMENT_FILENAME, append_frame
+
+# The device IDs of a real Envoy's micro-inverters go up in steps of 256.
+_FIRST_DEVICE_ID = 553648384
+_DEVICE_ID_STEP = 256
+_FIRST_SERIAL_NUMBER = 482202080000
+
+
+def _sun(timestamp: int) -> float:
+    """0 at night, rising to 1 at midday (UTC). Sunrise is at 06:00 and sunset at 18:00."""
+    hours = (timestamp % 86_400) / 3600
+    return max(0.0, math.sin(math.pi * (hours - 6) / 12))
+
+
+class SyntheticEnvoy:
+    def __init__(
+        self,
+        n_inverters: int = 10,
+        n_other_devices: int = 0,
+        duplicate_ratio: float = 0.0,
+        report_every_seconds: int = 900,
+        peak_watts: float = 300,
+        seed: int = 0,
+    ) -> None:
+        assert 0 <= duplicate_ratio <= 1, (
+            f"duplicate_ratio must be in [0, 1], not {duplicate_ratio}"
+        )
+        self._n_other_devices = n_other_devices
+        self._duplicate_ratio = duplicate_ratio
+        self._report_every_seconds = report_every_seconds
+        self._peak_watts = peak_watts
+        self._rng = random.Random(seed)
+        self._phases = [self._rng.randrange(report_every_seconds) for _ in range(n_inverters)]
+        # The last reading of each inverter, as `(endDate, device dict)`.
+        self._readings: list[tuple[int, dict[str, Any]] | None] = [None] * n_inverters
+        self._watt_hours_today = [0.0] * n_inverters
+        self._previous_payload: bytes | None = None
+        self._previous_timestamp = -1
+
+    @property
+    def serial_numbers(self) -> list[str]:
+        return [str(_FIRST_SERIAL_NUMBER + i) for i in range(len(self._phases))]
+
+    def payload(self, timestamp: int) -> bytes:
+        """The Envoy's response to a poll at `timestamp`. Timestamps must not go backwards."""
+        assert timestamp >= self._previous_timestamp, "Timestamps must not go backwards!"
+        self._previous_timestamp = timestamp
+        if self._previous_payload is not None and self._rng.random() < self._duplicate_ratio:
+            return self._previous_payload
+        devices: dict[str, Any] = {}
+        for i in range(len(self._phases)):
+            reading = self._latest_reading(i, timestamp)
+            if reading is not None:
+                devices[str(_FIRST_DEVICE_ID + i * _DEVICE_ID_STEP)] = reading
+        for j in range(self._n_other_devices):
+            devices[str(_FIRST_DEVICE_ID - (j + 1) * _DEVICE_ID_STEP)] = {
+                "devName": "nsrb",
+                "sn": f"12233{j:07d}",
+                "active": True,
+                "modGone": False,
+                "channels": [{"chanEid": 1, "created": timestamp}],
+            }
+        devices["deviceCount"] = len(devices)
+        devices["deviceDataLimit"] = 50
+        self._previous_payload = json.dumps(devices).encode()
+        return self._previous_payload
+
+    def payloads(
+        self, start: int, end: int, poll_every_seconds: int = 60
+    ) -> Iterator[tuple[int, bytes]]:
+        """Yield `(timestamp, payload)` for each poll in `[start, end)`."""
+        for timestamp in range(start, end, poll_every_seconds):
+            yield timestamp, self.payload(timestamp)
+
+    def _latest_reading(self, i: int, timestamp: int) -> dict[str, Any] | None:
+        """Inverter `i`'s most recent reading at `timestamp`, or None if it has never reported."""
+        period = self._report_every_seconds
+        end_date = timestamp - (timestamp - self._phases[i]) % period
+        previous = self._readings[i]
+        if previous is not None and previous[0] >= end_date:
+            return previous[1]
+        if _sun(end_date) == 0:
+            # Inverters don't report at night, so the Envoy repeats the last reading.
+            return None if previous is None else previous[1]
+        if previous is not None and previous[0] // 86_400 != end_date // 86_400:
+            self._watt_hours_today[i] = 0
+        watts = self._peak_watts * _sun(end_date) * self._rng.uniform(0.8, 1.0)
+        joules = round(watts * period)
+        self._watt_hours_today[i] += joules / 3600
+        dc_voltage_mV = self._rng.randrange(30_000, 40_000)
+        ac_voltage_mV = self._rng.randrange(235_000, 250_000)
+        eid = 1627390225 + i * _DEVICE_ID_STEP
+        reading = {
+            "devName": "pcu",
+            "sn": self.serial_numbers[i],
+            "active": True,
+            "modGone": False,
+            "channels": [
+                {
+                    "chanEid": eid,
+                    "created": end_date,
+                    "wattHours": {
+                        "today": round(self._watt_hours_today[i]),
+                        "yesterday": 697,
+                        "week": 4123,
+                    },
+                    "watts": {"now": round(watts), "nowUsed": 0, "max": round(self._peak_watts)},
+                    "lastReading": {
+                        "eid": eid,
+                        "interval_type": 0,
+                        "endDate": end_date,
+                        "duration": period,
+                        "flags": 2097152,
+                        "flags_hex": "0x0000000000200000",
+                        "joulesProduced": joules,
+                        "acVoltageINmV": ac_voltage_mV,
+                        "acFrequencyINmHz": self._rng.randrange(49_900, 50_100),
+                        "dcVoltageINmV": dc_voltage_mV,
+                        "dcCurrentINmA": round(watts / dc_voltage_mV * 1e6),
+                        "channelTemp": self._rng.randrange(5, 45),
+                        "pwrConvErrSecs": 0,
+                        "pwrConvMaxErrCycles": 0,
+                        "joulesUsed": 0,
+                        "leadingVArs": 15509,
+                        "laggingVArs": 0,
+                        "acCurrentInmA": round(watts / ac_voltage_mV * 1e6),
+                        "l1NAcVoltageInmV": 0,
+                        "l2NAcVoltageInmV": 0,
+                        "l3NAcVoltageInmV": 0,
+                        "rssi": 0,
+                        "issi": 0,
+                    },
+                    "lifetime": {"createdTime": 1766916403, "duration": 0, "joulesProduced": 0},
+                }
+            ],
+        }
+        self._readings[i] = (end_date, reading)
+        return reading
+
+
+def write_live_buffer(
+    directory: Path,
+    payloads: Iterable[tuple[int, bytes]],
+    live_buffer_format: Literal["files", "segment"] = "files",
+    codec: Codec = "gzip",
+) -> int:
+    """Save `payloads` to `directory`, in the same way as `EnvoyRecorder` saves the live buffer.
+
+    Returns the number of payloads written.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    n_payloads = 0
+    for timestamp, payload in payloads:
+        if live_buffer_format == "segment":
+            append_frame(directory / SEGMENT_FILENAME, timestamp, payload, codec)
+        else:
+            path = directory / f"{timestamp}.json{FILE_SUFFIXES[codec]}"
+            path.write_bytes(compress(payload, codec))
+        n_payloads += 1
+    return n_payloads
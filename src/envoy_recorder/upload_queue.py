@@ -0,0 +1,170 @@
+"""A durable, on-disk queue of archive files which need uploading to the cloud bucket.
+
+Flushing the live buffer only *enqueues* the changed Parquet files, which is quick and never touches
+the network. The queue is drained by a background worker: a thread when we're running as a daemon,
+or a detached `python -m envoy_recorder.upload_queue` process when we're run by cron. So a slow
+uplink never delays polling the Envoy.
+
+Each pending upload is a small JSON file in the queue directory, which records how many times the
+upload has failed, and when to try again (with jittered exponential backoff). Because the queue is
+on disk, uploads which fail are retried by later runs, even after a reboot.
+"""
+
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.locks import try_lock
+from envoy_recorder.logging import get_logger
+from envoy_recorder.monitoring import run_worker
+from envoy_recorder.uploader import (
+    Uploader,
+    UploadManifest,
+    find_changed_files,
+    make_uploader,
+    upload_file,
+)
+
+log = get_logger(__name__)
+
+_ENTRY_SUFFIX = ".json"
+
+
+class QueueEntry(BaseModel):
+    relative_path: str  # Relative to the archive root. e.g. "year=2026/month=1/00000000.parquet"
+    n_failed_attempts: int = 0
+    next_attempt_at: float = 0  # Unix timestamp.
+
+
+class UploadQueue:
+    def __init__(self, config: EnvoyRecorderConfig) -> None:
+        self._config = config
+        self._directory = config.paths.upload_queue
+
+    def enqueue_changed_files(self) -> int:
+        """Enqueue every archive file which differs from the uploaded version. Returns the number
+        of newly enqueued files. Files which are already in the queue keep their backoff state."""
+        paths = self._config.paths
+        manifest = UploadManifest.load(paths.upload_manifest)
+        # Don't save the manifest here: only the worker (which holds the lock) writes the manifest.
+        changed = find_changed_files(paths.parquet_archive, manifest)
+        n_enqueued = 0
+        for path, _ in changed:
+            relative_path = path.relative_to(paths.parquet_archive).as_posix()
+            if not self._entry_path(relative_path).exists():
+                self._save_entry(QueueEntry(relative_path=relative_path))
+                n_enqueued += 1
+        log.info("Enqueued %d file(s) for upload.", n_enqueued)
+        return n_enqueued
+
+    def entries(self) -> list[QueueEntry]:
+        if not self._directory.exists():
+            return []
+        return [
+            QueueEntry.model_validate_json(path.read_bytes())
+            for path in sorted(self._directory.glob(f"*{_ENTRY_SUFFIX}"))
+        ]
+
+    def has_due_entries(self, now: float | None = None) -> bool:
+        now = time.time() if now is None else now
+        return any(entry.next_attempt_at <= now for entry in self.entries())
+
+    def drain(self, uploader: Uploader | None = None) -> int:
+        """Upload every entry which is due. Returns the number of files uploaded.
+
+        Only one process (or thread) drains a given queue at a time. If another worker is already
+        draining this queue then return 0 immediately.
+        """
+        paths = self._config.paths
+        with try_lock(paths.upload_lock) as locked:
+            if not locked:
+                log.info("Another worker is already draining %s.", self._directory)
+                return 0
+            if uploader is None:
+                uploader = make_uploader(self._config.upload.uploader, paths.storage_bucket)
+            return self._drain(uploader)
+
+    def _drain(self, uploader: Uploader) -> int:
+        paths = self._config.paths
+        manifest = UploadManifest.load(paths.upload_manifest)
+        n_uploaded = 0
+        for entry in self.entries():
+            if entry.next_attempt_at > time.time():
+                continue
+            local_path = paths.parquet_archive / entry.relative_path
+            if not local_path.exists():
+                log.warning("%s no longer exists. Removing it from the queue.", local_path)
+                self._entry_path(entry.relative_path).unlink()
+                continue
+            try:
+                unchanged = upload_file(paths.parquet_archive, local_path, uploader, manifest)
+            except Exception:
+                entry.n_failed_attempts += 1
+                backoff = self._backoff_seconds(entry.n_failed_attempts)
+                entry.next_attempt_at = time.time() + backoff
+                self._save_entry(entry)
+                log.exception(
+                    "Failed to upload %s (attempt %d). Retrying in %.0f seconds.",
+                    entry.relative_path,
+                    entry.n_failed_attempts,
+                    backoff,
+                )
+            else:
+                if not unchanged:
+                    # A flush replaced the file mid-upload (and re-enqueued it). Keep the entry, so
+                    # the new version is uploaded by the next drain.
+                    continue
+                # Save the manifest *before* removing the entry, so a crash in between causes (at
+                # worst) one redundant upload, rather than a missed upload.
+                manifest.save(paths.upload_manifest)
+                self._entry_path(entry.relative_path).unlink()
+                n_uploaded += 1
+        log.info("Uploaded %d file(s) to %s", n_uploaded, paths.storage_bucket)
+        return n_uploaded
+
+    def _backoff_seconds(self, n_failed_attempts: int) -> float:
+        """Exponential backoff with "full jitter"."""
+        upload_config = self._config.upload
+        return random.uniform(
+            0,
+            min(
+                upload_config.retry_max_backoff_seconds,
+                upload_config.retry_base_backoff_seconds * 2 ** (n_failed_attempts - 1),
+            ),
+        )
+
+    def _entry_path(self, relative_path: str) -> Path:
+        return self._directory / (relative_path.replace("/", "__") + _ENTRY_SUFFIX)
+
+    def _save_entry(self, entry: QueueEntry) -> None:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        path = self._entry_path(entry.relative_path)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(entry.model_dump_json())
+        tmp_path.replace(path)
+
+
+def start_worker_process() -> subprocess.Popen:
+    """Drain the queue(s) in a detached process, so the caller doesn't wait for the uploads.
+
+    The worker inherits our working directory (so it finds the same `config.toml`) and our stdout
+    and stderr (so its logs end up in the same log file).
+    """
+    cmd = [sys.executable, "-m", "envoy_recorder.upload_queue"]
+    log.info("Starting background upload worker: %s", cmd)
+    return subprocess.Popen(cmd, stdin=subprocess.DEVNULL, start_new_session=True)
+
+
+def main() -> None:
+    """Drain the upload queue of each site."""
+    for site_config in EnvoyRecorderConfig.load().site_configs():
+        UploadQueue(site_config).drain()
+
+
+if __name__ == "__main__":
+    run_worker(main, "Upload worker")
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Protocol
+
+from pydantic import BaseModel
+
+from envoy_recorder import metrics
+from envoy_recorder.logging import get_logger
+
+log = get_logger(__name__)
+
+
+class Uploader(Protocol):
+    def upload(self, local_path: Path, relative_path: str) -> None:
+        """Upload `local_path` to `relative_path` within the bucket. Raise if the upload fails."""
+        ...
+
+
+class RcloneUploader:
+    """Upload individual files to a cloud bucket with `rclone copyto`."""
+
+    def __init__(self, bucket: str) -> None:
+        self._bucket = bucket.rstrip("/")
+
+    def upload(self, local_path: Path, relative_path: str) -> None:
+        cmd: list[str | Path] = [
+            "rclone",
+            "copyto",
+            local_path,
+            f"{self._bucket}/{relative_path}",
+            # We already know that the file has changed (from the upload manifest), so don't waste
+            # API calls (Class B ops) checking the destination.
+            "--no-check-dest",
+        ]
+        try:
+            subprocess.run(cmd, check=True, text=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            log.error("rclone failed to upload %s: %s", local_path, e.stderr)
+            raise
+
+
+class LocalDirectoryUploader:
+    """A stand-in for a cloud bucket, which copies files into a local directory."""
+
+    def __init__(self, root: Path) -> None:
+        self._root = root
+
+    def upload(self, local_path: Path, relative_path: str) -> None:
+        destination = self._root / relative_path
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = destination.with_name(f".{destination.name}.tmp")
+        shutil.copyfile(local_path, tmp_path)
+        tmp_path.replace(destination)
+
+
+class UploadedFile(BaseModel):
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+class UploadManifest(BaseModel):
+    """What we've uploaded to the bucket, keyed by the path relative to the archive.
+
+    This means we only need to upload the partitions which have changed, without listing or
+    comparing anything in the bucket (which costs Class B operations).
+    """
+
+    files: dict[str, UploadedFile] = {}
+
+    @classmethod
+    def load(cls, path: Path) -> UploadManifest:
+        try:
+            return cls.model_validate_json(path.read_bytes())
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path: Path) -> None:
+        """Atomically replace the manifest on disk."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(self.model_dump_json(indent=2))
+            f.flush()
+            os.fsync(f.fileno())
+        tmp_path.replace(path)
+
+
+def make_uploader(kind: str, bucket: str) -> Uploader:
+    if kind == "local":
+        return LocalDirectoryUploader(Path(bucket))
+    return RcloneUploader(bucket)
+
+
+def find_changed_files(archive_root: Path, manifest: UploadManifest) -> list[tuple[Path, str]]:
+    """Returns `(local path, sha256)` for each Parquet file which differs from the uploaded version.
+
+    We only compute the checksum of files whose size or modification time has changed, so this is
+    cheap to call after every flush.
+    """
+    changed = []
+    for path in sorted(archive_root.glob("**/*.parquet")):
+        relative_path = path.relative_to(archive_root).as_posix()
+        stat = path.stat()
+        uploaded = manifest.files.get(relative_path)
+        if uploaded and (uploaded.size, uploaded.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            continue
+        sha256 = _sha256(path)
+        if uploaded and uploaded.sha256 == sha256:
+            # Same contents, new mtime. Remember the new mtime so we don't hash this file again.
+            manifest.files[relative_path] = uploaded.model_copy(
+                update={"mtime_ns": stat.st_mtime_ns}
+            )
+            continue
+        changed.append((path, sha256))
+    return changed
+
+
+def upload_changed_files(archive_root: Path, uploader: Uploader, manifest_path: Path) -> int:
+    """Upload every Parquet file in the archive which has changed since it was last uploaded.
+
+    This blocks until every upload has finished. See `UploadQueue` for uploading in the background.
+    Files which fail to upload will be retried next time, because they won't have been recorded in
+    the manifest. Returns the number of files uploaded.
+    """
+    manifest = UploadManifest.load(manifest_path)
+    changed = find_changed_files(archive_root, manifest)
+    log.info("%d file(s) have changed since the last upload.", len(changed))
+    n_uploaded = 0
+    try:
+        for path, sha256 in changed:
+            if upload_file(archive_root, path, uploader, manifest, sha256):
+                n_uploaded += 1
+    finally:
+        manifest.save(manifest_path)
+    return n_uploaded
+
+
+def upload_file(
+    archive_root: Path,
+    path: Path,
+    uploader: Uploader,
+    manifest: UploadManifest,
+    sha256: str | None = None,
+) -> bool:
+    """Upload a single file, and record it in `manifest` (but don't save the manifest).
+
+    A flush can replace the file whilst it's being uploaded, in which case we can't tell which
+    version was uploaded. So, if the file's size or modification time changed during the upload,
+    nothing is recorded in `manifest`, and we return False (so the caller uploads it again).
+    """
+    relative_path = path.relative_to(archive_root).as_posix()
+    stat = path.stat()
+    if sha256 is None:
+        sha256 = _sha256(path)
+    log.info("Uploading %s", relative_path)
+    with metrics.timed("upload.file"):
+        uploader.upload(path, relative_path)
+    metrics.distribution("upload.size", stat.st_size, "bytes")
+    new_stat = path.stat()
+    if (new_stat.st_size, new_stat.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+        log.info("%s changed whilst it was being uploaded.", relative_path)
+        metrics.count(name="upload.changed_during_upload")
+        return False
+    manifest.files[relative_path] = UploadedFile(
+        size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha256=sha256
+    )
+    return True
+
+
+def _sha256(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from envoy_recorder.config_loader import EnvoyConfig, EnvoyRecorderConfig, PathsConfig
+from envoy_recorder.schemas import ProcessedEnvoyDataFrame
+
+
+def make_df(
+    serial_number: str, period_end_times: list[datetime], joules: int = 900
+) -> pl.DataFrame:
+    """Rows of `ProcessedEnvoyDataFrame` for one micro-inverter, each covering 15 minutes. The
+    default `joules` is 1 W, and the temperature rises by 1 °C per row."""
+    n = len(period_end_times)
+    df = pl.DataFrame(
+        {
+            "serial_number": [serial_number] * n,
+            "period_end_time": period_end_times,
+            "period_duration": [timedelta(minutes=15)] * n,
+            "joules_produced": [joules] * n,
+            "ac_voltage_mV": [240_000] * n,
+            "ac_current_mA": [0] * n,
+            "dc_voltage_mV": [30_000] * n,
+            "dc_current_mA": [1000] * n,
+            "ac_frequency_mHz": [50_000] * n,
+            "inverter_temperature_Celsius": list(range(20, 20 + n)),
+            "power_conversion_error_seconds": [0] * n,
+            "power_conversion_max_error_cycles": [0] * n,
+            "flags": [0] * n,
+            "watt_hours_today": [10] * n,
+            "year": [t.year for t in period_end_times],
+            "month": [t.month for t in period_end_times],
+        }
+    )
+    return df.cast(pl.Schema(ProcessedEnvoyDataFrame.dtypes))
+
+
+@pytest.fixture
+def config(tmp_path: Path) -> EnvoyRecorderConfig:
+    """A single site, with every path under `tmp_path`, which "uploads" to `tmp_path / "bucket"`."""
+    config = EnvoyRecorderConfig(
+        envoy=EnvoyConfig(ip_address="127.0.0.1", token="secret"),
+        paths=PathsConfig(
+            live_buffer=tmp_path / "live_buffer",
+            parquet_archive=tmp_path / "parquet_archive",
+            rollups=tmp_path / "rollups",
+            hot_tier=tmp_path / "hot_tier",
+            raw_bundles=tmp_path / "raw_bundles",
+            live_power=tmp_path / "live_power",
+            state=tmp_path / "state",
+            storage_bucket=str(tmp_path / "bucket"),
+        ),
+    )
+    config.upload.uploader = "local"
+    return config
@@ -15,6 +15,11 @@ def test_default_paths() -> None:
     assert paths.live_buffer == Path("./data/live_buffer")
     assert paths.live_buffer_incoming == Path("./data/live_buffer/incoming")
     assert paths.parquet_archive == Path("./data/parquet_archive")
+    assert paths.rollups == Path("./data/rollups")
+    assert paths.hot_tier == Path("./data/hot_tier")
+    assert paths.raw_bundles == Path("./data/raw_bundles")
+    assert paths.state == Path("./data/state")
+    assert paths.archive_manifest == Path("./data/state/archive_manifest.json")
     assert paths.storage_bucket == "r2:bucket/directory"
 
 
@@ -54,6 +59,7 @@ flush_buffer_every_n_minutes = 30
 
     config = EnvoyRecorderConfig.load(str(config_file))
 
+    assert config.envoy is not None
     assert str(config.envoy.ip_address) == "192.168.1.100"
     assert config.envoy.token == "envoy_secret"
     assert config.paths.live_buffer == Path("/tmp/live_buffer")
@@ -71,6 +77,7 @@ def test_load_with_env_vars(monkeypatch: pytest.MonkeyPatch) -> None:
     # but BaseSettings should pick up environment variables.
     config = EnvoyRecorderConfig.load("non_existent.toml")
 
+    assert config.envoy is not None
     assert str(config.envoy.ip_address) == "1.2.3.4"
     assert config.envoy.token == "envoy_env_token"
     assert config.paths.storage_bucket == "remote:bucket/path"
@@ -91,6 +98,7 @@ storage_bucket = "foo/bar"
 
     config = EnvoyRecorderConfig.load(str(config_file))
 
+    assert config.envoy is not None
     assert str(config.envoy.ip_address) == "192.168.1.100"
     assert config.paths.live_buffer == Path("./data/live_buffer")  # default
     assert config.intervals.flush_buffer_every_n_minutes == 15  # default
@@ -130,3 +138,69 @@ storage_bucket = "foo/bar"
     with pytest.raises(ValidationError) as excinfo:
         EnvoyRecorderConfig.load(str(config_file))
     assert "ip_address" in str(excinfo.value)
+
+
+def test_multiple_envoys(tmp_path: Path) -> None:
+    config_file = tmp_path / "config.toml"
+    content = """
+[[envoys]]
+name = "home"
+ip_address = "192.168.1.100"
+token = "home_secret"
+
+[[envoys]]
+name = "office"
+ip_address = "192.168.2.100"
+token = "office_secret"
+
+[paths]
+live_buffer = "/tmp/live_buffer"
+parquet_archive = "/tmp/parquet_archive"
+storage_bucket = "remote:bucket/directory"
+"""
+    config_file.write_text(content)
+
+    site_configs = EnvoyRecorderConfig.load(str(config_file)).site_configs()
+
+    assert [c.envoy.name for c in site_configs if c.envoy] == ["home", "office"]
+    office = site_configs[1]
+    assert office.envoy and office.envoy.token == "office_secret"
+    assert office.paths.live_buffer_incoming == Path("/tmp/live_buffer/office/incoming")
+    assert office.paths.parquet_archive == Path("/tmp/parquet_archive/site=office")
+    assert office.paths.rollups == Path("data/rollups/site=office")
+    assert office.paths.hot_tier == Path("data/hot_tier/site=office")
+    assert office.paths.raw_bundles == Path("data/raw_bundles/office")
+    assert office.paths.storage_bucket == "remote:bucket/directory/site=office"
+
+
+def test_single_envoy_keeps_original_paths(tmp_path: Path) -> None:
+    config = EnvoyRecorderConfig(
+        envoy={"ip_address": "192.168.1.100", "token": "secret"},
+        paths={"storage_bucket": "remote:bucket"},
+    )
+    assert config.site_configs() == [config]
+
+
+@pytest.mark.parametrize(
+    "envoys",
+    [
+        [{"ip_address": "1.2.3.4", "token": "a"}],  # Missing name.
+        [
+            {"name": "home", "ip_address": "1.2.3.4", "token": "a"},
+            {"name": "home", "ip_address": "1.2.3.5", "token": "b"},
+        ],
+        [{"name": "not/a/valid/name", "ip_address": "1.2.3.4", "token": "a"}],
+    ],
+)
+def test_invalid_envoys(envoys: list[dict]) -> None:
+    with pytest.raises(ValidationError):
+        EnvoyRecorderConfig(envoys=envoys, paths={"storage_bucket": "remote:bucket"})
+
+
+def test_envoy_and_envoys_are_mutually_exclusive() -> None:
+    with pytest.raises(ValidationError):
+        EnvoyRecorderConfig(
+            envoy={"ip_address": "1.2.3.4", "token": "a"},
+            envoys=[{"name": "home", "ip_address": "1.2.3.5", "token": "b"}],
+            paths={"storage_bucket": "remote:bucket"},
+        )
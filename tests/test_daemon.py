@@ -0,0 +1,90 @@
+import threading
+
+from envoy_recorder.daemon import BackgroundTask, Scheduler
+
+
+def test_scheduler_runs_tasks_until_stopped():
+    scheduler = Scheduler()
+    calls: list[str] = []
+
+    def poll():
+        calls.append("poll")
+        if calls.count("poll") == 3:
+            scheduler.stop()
+
+    scheduler.every(0.01, poll)
+    scheduler.every(60, lambda: calls.append("flush"), name="flush", delay_first_run=True)
+    scheduler.run_forever()
+
+    assert calls == ["poll", "poll", "poll"]
+
+
+def test_scheduler_survives_exceptions():
+    scheduler = Scheduler()
+    n_calls = 0
+
+    def flaky():
+        nonlocal n_calls
+        n_calls += 1
+        if n_calls == 2:
+            scheduler.stop()
+        raise RuntimeError("Envoy is not responding!")
+
+    scheduler.every(0.01, flaky)
+    scheduler.run_forever()
+
+    assert n_calls == 2
+
+
+def test_scheduler_stop_from_another_thread():
+    scheduler = Scheduler()
+    scheduler.every(3600, lambda: None, delay_first_run=True)
+    threading.Timer(0.05, scheduler.stop).start()
+    scheduler.run_forever()  # Should return promptly, rather than sleeping for an hour.
+
+
+def test_scheduler_in_its_own_thread_isnt_delayed_by_a_stalled_scheduler():
+    stalled = Scheduler()
+    release = threading.Event()
+
+    def poll_stalled_envoy():
+        release.wait(timeout=5)
+
+    stalled.every(0.01, poll_stalled_envoy)
+    sampler = Scheduler()
+    n_samples = 0
+
+    def sample():
+        nonlocal n_samples
+        n_samples += 1
+        if n_samples == 3:
+            sampler.stop()
+
+    sampler.every(0.01, sample)
+    stalled_thread = stalled.start_thread("stalled")
+    sampler.start_thread("sampler").join(timeout=5)
+    assert n_samples == 3
+    stalled.stop()
+    release.set()
+    stalled_thread.join(timeout=5)
+    assert not stalled_thread.is_alive()
+
+
+def test_background_task_runs_when_woken():
+    n_calls = 0
+    called = threading.Event()
+
+    def upload():
+        nonlocal n_calls
+        n_calls += 1
+        called.set()
+
+    task = BackgroundTask(60, upload)
+    task.start()
+    assert called.wait(timeout=5)  # The first run happens straight away.
+    called.clear()
+    task.wake()
+    assert called.wait(timeout=5)
+    task.stop(timeout=5)
+
+    assert n_calls == 2
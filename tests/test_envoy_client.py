@@ -0,0 +1,95 @@
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import ClassVar
+
+import pytest
+import requests
+
+from envoy_recorder import envoy_client
+from envoy_recorder.config_loader import EnvoyConfig
+from envoy_recorder.envoy_client import EnvoyClient
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Each test sets the status codes which the server returns, in order.
+    statuses: ClassVar[list[int]] = []
+    authorization_headers: ClassVar[list[str | None]] = []
+    protocol_version = "HTTP/1.1"  # Enables keep-alive.
+
+    def do_GET(self) -> None:
+        type(self).authorization_headers.append(self.headers["Authorization"])
+        status = type(self).statuses.pop(0)
+        body = b'{"ok": true}' if status == 200 else b"error"
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+@pytest.fixture
+def server() -> Iterator[ThreadingHTTPServer]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    _Handler.authorization_headers = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+
+
+def make_client(server: ThreadingHTTPServer, **kwargs) -> EnvoyClient:
+    config = EnvoyConfig(
+        ip_address="127.0.0.1",
+        port=server.server_address[1],
+        token="secret",
+        retry_base_backoff_seconds=0.001,
+        retry_max_backoff_seconds=0.01,
+        **kwargs,
+    )
+    return EnvoyClient(config)
+
+
+def test_retries_server_errors(server: ThreadingHTTPServer):
+    _Handler.statuses = [503, 500, 200]
+    assert make_client(server).fetch_device_data() == '{"ok": true}'
+    assert _Handler.authorization_headers == ["Bearer secret"] * 3
+
+
+def test_gives_up_after_max_attempts(server: ThreadingHTTPServer):
+    _Handler.statuses = [503, 503, 503]
+    with pytest.raises(requests.HTTPError):
+        make_client(server, max_attempts=2).fetch_device_data()
+    assert _Handler.statuses == [503]  # Only two requests were made.
+
+
+def test_does_not_retry_unauthorized(server: ThreadingHTTPServer):
+    _Handler.statuses = [401, 200]
+    with pytest.raises(requests.HTTPError):
+        make_client(server).fetch_device_data()
+    assert _Handler.statuses == [200]
+
+
+def test_does_not_retry_beyond_retry_window(server: ThreadingHTTPServer):
+    _Handler.statuses = [503, 200]
+    with pytest.raises(requests.HTTPError):
+        make_client(server, retry_window_seconds=0.0001).fetch_device_data()
+
+
+def test_gives_up_if_the_backoff_overshoots_the_retry_window(
+    server: ThreadingHTTPServer, monkeypatch
+):
+    _Handler.statuses = [503, 200]
+
+    def oversleep(seconds: float) -> None:
+        time.sleep(0.6)
+
+    monkeypatch.setattr(
+        envoy_client, "time", SimpleNamespace(monotonic=time.monotonic, sleep=oversleep)
+    )
+    with pytest.raises(requests.HTTPError):
+        make_client(server, retry_window_seconds=0.5).fetch_device_data()
+    assert _Handler.statuses == [200]
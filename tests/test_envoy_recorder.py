@@ -0,0 +1,345 @@
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from envoy_recorder import envoy_recorder, metrics
+from envoy_recorder.config_loader import EnvoyConfig, EnvoyRecorderConfig
+from envoy_recorder.envoy_recorder import EnvoyRecorder, MultiSiteRecorder
+from envoy_recorder.payload_compression import save_dictionary, train_dictionary
+
+EXAMPLE_JSON_PATH = Path(__file__).parent.parent / "example_envoy_json_data"
+
+
+def test_importing_envoy_recorder_does_not_import_polars():
+    # Most cron runs only fetch data from the Envoy, so they shouldn't pay for importing Polars.
+    code = (
+        "import sys; import envoy_recorder.envoy_recorder; "
+        "assert 'polars' not in sys.modules, 'polars was imported!'; "
+        "assert 'patito' not in sys.modules, 'patito was imported!'"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_fetch_only_cycle_writes_to_live_buffer(config: EnvoyRecorderConfig, monkeypatch):
+    recorder = EnvoyRecorder(config)
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+    monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: envoy_json)
+
+    recorder.run()
+
+    files = list(recorder.config.paths.live_buffer_incoming.glob("*.json.gz"))
+    assert len(files) == 1
+    with gzip.open(files[0], "rt") as f:
+        assert f.read() == envoy_json
+    assert not any(recorder.config.paths.parquet_archive.iterdir())
+
+
+def test_flush_writes_parquet_archive(config: EnvoyRecorderConfig, monkeypatch):
+    recorder = EnvoyRecorder(config)
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+    monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: envoy_json)
+
+    recorder.fetch_and_buffer()
+    recorder.flush()
+
+    assert list(recorder.config.paths.parquet_archive.glob("year=*/month=*/*.parquet"))
+    assert not recorder.config.paths.live_buffer_incoming.exists()
+    assert not list(recorder.config.paths.live_buffer.glob("processing_*"))
+
+
+def test_flush_keeps_raw_payloads_in_bundles(config: EnvoyRecorderConfig, monkeypatch):
+    config.live_buffer.keep_raw_payloads = True
+    recorder = EnvoyRecorder(config)
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+    monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: envoy_json)
+
+    recorder.fetch_and_buffer()
+    recorder.flush()
+
+    bundles = list(config.paths.raw_bundles.glob("*/segment.wal"))
+    assert [path.parent.name for path in bundles] == [time.strftime("%Y-%m", time.gmtime())]
+    assert not list(config.paths.live_buffer.glob("processing_*"))
+
+
+def test_flush_recovers_orphaned_live_buffers_in_one_pass(
+    config: EnvoyRecorderConfig, monkeypatch
+):
+    from envoy_recorder.parquet_archive import ParquetArchive
+    from envoy_recorder.reader import ArchiveReader
+
+    recorder = EnvoyRecorder(config)
+    paths = recorder.config.paths
+    json_paths = sorted(EXAMPLE_JSON_PATH.glob("device_data_*.json"))
+    envoy_json = json_paths[0].read_text()
+    monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: envoy_json)
+    recorder.fetch_and_buffer()
+    # Simulate a flush which crashed after moving the live buffer.
+    orphaned_path = recorder._move_live_buffer()
+    (paths.live_buffer / "processing_1").mkdir()  # An empty orphan.
+    envoy_json = json_paths[-1].read_text()
+    recorder.fetch_and_buffer()
+
+    # The archive must only be written once, even though there are two live buffers.
+    writes = []
+    write = ParquetArchive.write
+    monkeypatch.setattr(
+        ParquetArchive, "write", lambda self, *args: writes.append(1) or write(self, *args)
+    )
+    recorder.flush_if_old_enough()
+
+    assert len(writes) == 1
+    assert not orphaned_path.exists()
+    assert not list(paths.live_buffer.glob("processing_*"))
+    df = ArchiveReader(paths.parquet_archive, hot_tier_root=paths.hot_tier).scan_all().collect()
+    created = set()
+    for json_path in (json_paths[0], json_paths[-1]):
+        devices = json.loads(json_path.read_text()).values()
+        for device in devices:
+            if isinstance(device, dict) and device.get("devName") == "pcu":
+                created.add(device["channels"][0]["created"])
+    timestamps = set(df["period_end_time"].dt.epoch(time_unit="s"))
+    assert created <= timestamps
+
+
+def test_live_buffer_survives_failed_archive_write(config: EnvoyRecorderConfig, monkeypatch):
+    from envoy_recorder.parquet_archive import ParquetArchive
+
+    recorder = EnvoyRecorder(config)
+    paths = recorder.config.paths
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+    monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: envoy_json)
+    recorder.fetch_and_buffer()
+
+    def fail(*args):
+        raise OSError("Disk full!")
+
+    with monkeypatch.context() as m:
+        m.setattr(ParquetArchive, "write", fail)
+        with pytest.raises(OSError, match="Disk full"):
+            recorder.flush()
+    assert len(list(paths.live_buffer.glob("processing_*"))) == 1
+
+    # The next flush recovers the live buffer.
+    recorder.flush()
+    assert list(paths.parquet_archive.glob("year=*/month=*/*.parquet"))
+    assert not list(paths.live_buffer.glob("processing_*"))
+
+
+def test_flush_records_the_duration_of_each_stage(
+    tmp_path: Path, config: EnvoyRecorderConfig, monkeypatch
+):
+    metrics_file = tmp_path / "metrics.jsonl"
+    metrics.set_metrics_file(metrics_file)
+    try:
+        recorder = EnvoyRecorder(config)
+        envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+        monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: envoy_json)
+
+        recorder.fetch_and_buffer()
+        recorder.flush()
+    finally:
+        metrics.set_metrics_file(None)
+
+    names = {json.loads(line)["name"] for line in metrics_file.read_text().splitlines()}
+    stages = ["envoy.fetch", "live_buffer.write", "live_buffer.move", "flush.parse_json"]
+    stages += ["flush.load_archive", "flush.merge", "flush.write_archive", "flush"]
+    assert {f"{stage}.duration" for stage in stages} <= names
+    assert "flush.max_rss" in names
+
+
+def test_duplicate_payloads_are_recorded_as_markers(config: EnvoyRecorderConfig, monkeypatch):
+    recorder = EnvoyRecorder(config)
+    incoming = recorder.config.paths.live_buffer_incoming
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696802.json").read_text()
+    times = iter([1000, 1060, 1120])
+    monkeypatch.setattr(envoy_recorder, "time", SimpleNamespace(time=lambda: next(times)))
+
+    recorder._save_to_live_buffer(envoy_json)
+    recorder._save_to_live_buffer(envoy_json)  # Duplicate.
+    recorder._save_to_live_buffer("not valid JSON")  # Always kept.
+
+    assert sorted(p.name for p in incoming.iterdir()) == [
+        "1000.json.gz",
+        "1060.dup",
+        "1120.json.gz",
+    ]
+
+
+def test_segment_format(config: EnvoyRecorderConfig, monkeypatch):
+    config.live_buffer.format = "segment"
+    recorder = EnvoyRecorder(config)
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696802.json").read_text()
+    times = iter([1000, 1060])
+    monkeypatch.setattr(envoy_recorder, "time", SimpleNamespace(time=lambda: next(times)))
+
+    recorder._save_to_live_buffer(envoy_json)
+    recorder._save_to_live_buffer(envoy_json)  # Duplicate.
+
+    incoming = recorder.config.paths.live_buffer_incoming
+    assert [p.name for p in incoming.iterdir()] == ["segment.wal"]
+    assert recorder._timestamp_of_oldest_file_in_live_buffer() == 1000
+
+
+@pytest.mark.parametrize("live_buffer_format", ["files", "segment"])
+def test_live_buffer_of_only_duplicates_holds_no_responses(
+    config: EnvoyRecorderConfig, live_buffer_format, monkeypatch
+):
+    config.live_buffer.format = live_buffer_format
+    recorder = EnvoyRecorder(config)
+    paths = recorder.config.paths
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696802.json").read_text()
+    times = iter([1000, 1060, 1120])
+    monkeypatch.setattr(envoy_recorder, "time", SimpleNamespace(time=lambda: next(times)))
+    recorder._save_to_live_buffer(envoy_json)
+    # Flushing deletes the live buffer, but not the fingerprint of the last response.
+    shutil.rmtree(paths.live_buffer_incoming)
+
+    recorder._save_to_live_buffer(envoy_json)  # Duplicate.
+    recorder._save_to_live_buffer(envoy_json)  # Duplicate.
+
+    assert any(paths.live_buffer_incoming.iterdir())
+    assert recorder._timestamp_of_oldest_file_in_live_buffer() is None
+    orphaned_path = paths.live_buffer_incoming.rename(paths.live_buffer / "processing_1")
+    assert recorder._orphaned_live_buffers() == []
+    assert not orphaned_path.exists()
+
+
+@pytest.mark.parametrize("live_buffer_format", ["files", "segment"])
+def test_zstd_compression_with_dictionary(
+    config: EnvoyRecorderConfig, live_buffer_format, monkeypatch
+):
+    config.live_buffer.format = live_buffer_format
+    config.live_buffer.compression = "zstd"
+    samples = [path.read_bytes() for path in EXAMPLE_JSON_PATH.glob("*.json")]
+    zstd_dict = train_dictionary(samples)
+    save_dictionary(zstd_dict, config.paths.zstd_dictionaries)
+    recorder = EnvoyRecorder(config)
+    monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: samples[0].decode())
+
+    recorder.fetch_and_buffer()
+    incoming = recorder.config.paths.live_buffer_incoming
+    assert (incoming / f"{zstd_dict.dict_id}.zdict").exists()
+    if live_buffer_format == "files":
+        assert len(list(incoming.glob("*.json.zst"))) == 1
+    recorder.flush()
+
+    assert list(recorder.config.paths.parquet_archive.glob("year=*/month=*/*.parquet"))
+
+
+def test_multi_site_recorder_isolates_failures(
+    tmp_path: Path, config: EnvoyRecorderConfig, monkeypatch
+):
+    recorder = MultiSiteRecorder(
+        EnvoyRecorderConfig(
+            envoys=[
+                EnvoyConfig(name="home", ip_address="127.0.0.1", token="a"),
+                EnvoyConfig(name="office", ip_address="127.0.0.2", token="b"),
+            ],
+            paths=config.paths,
+        )
+    )
+    home, office = recorder.recorders
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+    monkeypatch.setattr(home, "_fetch_data_from_envoy", lambda: envoy_json)
+
+    def fail():
+        raise ConnectionError("The office Envoy is down!")
+
+    monkeypatch.setattr(office, "_fetch_data_from_envoy", fail)
+
+    with pytest.raises(ExceptionGroup) as excinfo:
+        recorder.fetch_and_buffer()
+
+    assert excinfo.group_contains(ConnectionError)
+    assert len(list(home.config.paths.live_buffer_incoming.glob("*.json.gz"))) == 1
+    assert home.config.paths.live_buffer_incoming == tmp_path / "live_buffer/home/incoming"
+    assert not any(office.config.paths.live_buffer_incoming.iterdir())
+
+
+def test_multi_site_recorder_doesnt_group_keyboard_interrupts(
+    config: EnvoyRecorderConfig, monkeypatch
+):
+    recorder = MultiSiteRecorder(
+        EnvoyRecorderConfig(
+            envoys=[
+                EnvoyConfig(name="home", ip_address="127.0.0.1", token="a"),
+                EnvoyConfig(name="office", ip_address="127.0.0.2", token="b"),
+            ],
+            paths=config.paths,
+        )
+    )
+    home, office = recorder.recorders
+    assert home.config.envoy is not office.config.envoy
+    assert home.config.intervals is not office.config.intervals
+
+    def interrupt():
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(home, "_fetch_data_from_envoy", interrupt)
+    monkeypatch.setattr(office, "_fetch_data_from_envoy", interrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        recorder.fetch_and_buffer()
+
+
+def test_cron_run_flushes_in_a_worker_process(config: EnvoyRecorderConfig, monkeypatch):
+    recorder = MultiSiteRecorder(config)
+    (site,) = recorder.recorders
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+    monkeypatch.setattr(site, "_fetch_data_from_envoy", lambda: envoy_json)
+    monkeypatch.setattr(site, "wants_to_flush", lambda: True)
+    monkeypatch.setattr(site, "flush", lambda: pytest.fail("Flushed in the cron process!"))
+    workers = []
+    monkeypatch.setattr(
+        envoy_recorder.flush_worker, "start_worker_process", lambda: workers.append(1)
+    )
+
+    recorder.run()
+    assert len(workers) == 1
+    assert len(list(site.config.paths.live_buffer_incoming.glob("*.json.gz"))) == 1
+
+    # Whilst a flush is running, the poll still happens, but we don't start another flush worker.
+    with envoy_recorder.try_lock(site.config.paths.flush_lock):
+        recorder.run()
+    assert len(workers) == 1
+    assert len(list(site.config.paths.live_buffer_incoming.glob("*.json.gz"))) >= 1
+
+
+def test_overlapping_polls_are_skipped(config: EnvoyRecorderConfig, monkeypatch):
+    recorder = EnvoyRecorder(config)
+    monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: pytest.fail("Polled!"))
+    with envoy_recorder.try_lock(recorder.config.paths.fetch_lock) as locked:
+        assert locked
+        recorder.fetch_and_buffer()
+    assert not any(recorder.config.paths.live_buffer_incoming.iterdir())
+
+
+def test_adaptive_night_polling(config: EnvoyRecorderConfig, monkeypatch):
+    config.intervals.adaptive_night_polling = True
+    recorder = EnvoyRecorder(config)
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+    fetches = []
+    monkeypatch.setattr(
+        recorder, "_fetch_data_from_envoy", lambda: fetches.append(1) or envoy_json
+    )
+    monkeypatch.setattr(recorder, "flush", lambda: pytest.fail("Flushed at night!"))
+
+    # A new reading with non-zero energy means it's daytime.
+    recorder.fetch_and_buffer()
+    assert config.paths.last_production.exists()
+
+    # Pretend the last production was two hours ago.
+    two_hours_ago = time.time() - 2 * 3600
+    os.utime(config.paths.last_production, (two_hours_ago, two_hours_ago))
+    monkeypatch.setattr(envoy_recorder.NightSchedule, "should_poll", lambda self: False)
+    recorder.fetch_and_buffer()
+    recorder.flush_unless_night()
+    assert len(fetches) == 1
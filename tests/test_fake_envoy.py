@@ -0,0 +1,87 @@
+import json
+from collections.abc import Iterator
+from datetime import UTC, datetime
+
+import pytest
+import requests
+
+from envoy_recorder.config_loader import EnvoyConfig
+from envoy_recorder.envoy_client import EnvoyClient
+from envoy_recorder.fake_envoy import FakeEnvoy, Misbehaviour
+from envoy_recorder.synthetic_payloads import SyntheticEnvoy
+
+MIDDAY = int(datetime(2026, 6, 1, 12, tzinfo=UTC).timestamp())
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = MIDDAY
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+@pytest.fixture
+def envoy(clock: Clock) -> Iterator[FakeEnvoy]:
+    with FakeEnvoy(SyntheticEnvoy(n_inverters=3), clock=clock, token="secret") as envoy:
+        yield envoy
+
+
+def make_client(envoy: FakeEnvoy, token: str = "secret", **kwargs) -> EnvoyClient:
+    config = EnvoyConfig(
+        ip_address="127.0.0.1",
+        port=envoy.port,
+        token=token,
+        retry_base_backoff_seconds=0.001,
+        retry_max_backoff_seconds=0.01,
+        **kwargs,
+    )
+    return EnvoyClient(config)
+
+
+def test_serves_readings_at_the_envoys_time(envoy: FakeEnvoy, clock: Clock):
+    client = make_client(envoy)
+    first = json.loads(client.fetch_device_data())
+    clock.now += 3600
+    second = json.loads(client.fetch_device_data())
+
+    assert first["deviceCount"] == second["deviceCount"] == 3
+    devices = [device for device in second.values() if isinstance(device, dict)]
+    created = [device["channels"][0]["created"] for device in devices]
+    assert all(MIDDAY < t <= MIDDAY + 3600 for t in created)
+    assert envoy.stats.n_ok == 2
+    assert len(envoy.stats.readings) == 6
+
+
+def test_rejects_the_wrong_token(envoy: FakeEnvoy):
+    with pytest.raises(requests.HTTPError):
+        make_client(envoy, token="expired").fetch_device_data()
+    # 401 Unauthorized isn't retried.
+    assert envoy.stats.n_unauthorized == envoy.stats.n_requests == 1
+
+
+def test_server_errors_are_retried(envoy: FakeEnvoy):
+    envoy.misbehaviour = Misbehaviour(server_error_probability=1)
+    with pytest.raises(requests.HTTPError):
+        make_client(envoy, max_attempts=3).fetch_device_data()
+    assert envoy.stats.n_server_errors == 3
+
+
+def test_truncated_responses_look_successful(envoy: FakeEnvoy):
+    envoy.misbehaviour = Misbehaviour(truncated_probability=1)
+    text = make_client(envoy).fetch_device_data()
+    with pytest.raises(ValueError):
+        json.loads(text)
+    assert envoy.stats.n_truncated == 1
+
+
+def test_stalls_time_out(envoy: FakeEnvoy):
+    envoy.misbehaviour = Misbehaviour(stall_probability=1, stall_seconds=1)
+    with pytest.raises(requests.Timeout):
+        make_client(envoy, request_timeout_seconds=0.05, max_attempts=1).fetch_device_data()
+    assert envoy.stats.n_stalled == 1
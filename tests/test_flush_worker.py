@@ -0,0 +1,48 @@
+import time
+from pathlib import Path
+
+from envoy_recorder import flush_worker
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.envoy_recorder import EnvoyRecorder
+
+EXAMPLE_JSON_PATH = Path(__file__).parent.parent / "example_envoy_json_data"
+
+
+def test_worker_process_flushes_live_buffer(
+    tmp_path: Path, config: EnvoyRecorderConfig, monkeypatch
+):
+    recorder = EnvoyRecorder(config)
+    envoy_json = (EXAMPLE_JSON_PATH / "device_data_1767696755.json").read_text()
+    monkeypatch.setattr(recorder, "_fetch_data_from_envoy", lambda: envoy_json)
+    recorder.fetch_and_buffer()
+    # Make the live buffer old enough to flush.
+    (path,) = config.paths.live_buffer_incoming.iterdir()
+    path.rename(path.with_name(f"{round(time.time()) - 3600}.json.gz"))
+    paths = config.paths
+    (tmp_path / "config.toml").write_text(
+        f"""
+[envoy]
+ip_address = "127.0.0.1"
+token = "secret"
+
+[paths]
+live_buffer = "{paths.live_buffer}"
+parquet_archive = "{paths.parquet_archive}"
+rollups = "{paths.rollups}"
+hot_tier = "{paths.hot_tier}"
+raw_bundles = "{paths.raw_bundles}"
+state = "{paths.state}"
+storage_bucket = "{paths.storage_bucket}"
+
+[upload]
+uploader = "local"
+"""
+    )
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SENTRY_DSN", "")  # Don't report to Sentry from the worker.
+
+    assert flush_worker.start_worker_process().wait(timeout=60) == 0
+
+    assert list(paths.parquet_archive.glob("year=*/month=*/*.parquet"))
+    assert not list(paths.live_buffer.glob("processing_*"))
+    assert not paths.live_buffer_incoming.exists()
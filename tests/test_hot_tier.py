@@ -0,0 +1,124 @@
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+import pytest
+from conftest import make_df
+
+from envoy_recorder.config_loader import ArchiveConfig
+from envoy_recorder.hot_tier import HotTier
+from envoy_recorder.parquet_archive import ParquetArchive
+from envoy_recorder.reader import ArchiveReader
+
+# Far in the future, so that this month's partition is never "from an earlier month".
+THIS_MONTH = datetime(2999, 1, 1, tzinfo=UTC)
+
+
+def make_archive(tmp_path: Path, **config) -> ParquetArchive:
+    config.setdefault("hot_tier", True)
+    return ParquetArchive(
+        tmp_path / "parquet_archive",
+        tmp_path / "state/archive_manifest.json",
+        config=ArchiveConfig(**config),
+        hot_tier=HotTier(tmp_path / "hot_tier"),
+    )
+
+
+def flush(archive: ParquetArchive, new_df: pl.DataFrame) -> list[Path]:
+    merged_df = archive.merge_new_rows(new_df)
+    assert merged_df is not None
+    return archive.write(merged_df, new_df)
+
+
+def test_flushes_append_to_the_hot_tier(tmp_path: Path):
+    archive = make_archive(tmp_path)
+    times = [THIS_MONTH + timedelta(minutes=15 * i) for i in range(4)]
+
+    assert flush(archive, make_df("SN1", times[:2])) == []
+    assert flush(archive, make_df("SN1", times[2:])) == []
+
+    assert not (tmp_path / "parquet_archive").exists()
+    assert len(HotTier(tmp_path / "hot_tier").files((2999, 1))) == 2
+    # A fresh reader sees both flushes, via the hot tier.
+    reader = ArchiveReader(tmp_path / "parquet_archive", hot_tier_root=tmp_path / "hot_tier")
+    df = reader.load(THIS_MONTH, THIS_MONTH + timedelta(days=1))
+    assert df["period_end_time"].to_list() == times
+    assert archive.manifest.partition_row_counts == {"year=2999/month=1": 4}
+
+
+def test_compaction_moves_the_hot_tier_into_parquet(tmp_path: Path):
+    archive = make_archive(tmp_path)
+    times = [THIS_MONTH + timedelta(minutes=15 * i) for i in range(3)]
+    flush(archive, make_df("SN2", times))
+    flush(archive, make_df("SN1", times))
+
+    [path] = archive.compact_hot_tier(force=True)
+
+    assert HotTier(tmp_path / "hot_tier").partitions() == []
+    df = pl.read_parquet(path)
+    assert df.height == 6
+    assert df.equals(df.sort("serial_number", "period_end_time"))
+
+
+def test_partitions_are_compacted_when_due(tmp_path: Path):
+    january = datetime(2026, 1, 31, 23, 45, tzinfo=UTC)
+    HotTier(tmp_path / "hot_tier").append(make_df("SN1", [january, THIS_MONTH]))
+    archive = make_archive(tmp_path)
+
+    # January is an earlier month, so it's compacted. This month isn't due yet.
+    assert archive.compact_hot_tier(now=THIS_MONTH) == [
+        tmp_path / "parquet_archive/year=2026/month=1/00000000.parquet"
+    ]
+    assert HotTier(tmp_path / "hot_tier").partitions() == [(2999, 1)]
+
+    archive = make_archive(tmp_path, compact_hot_tier_every_n_minutes=0)
+    assert len(archive.compact_hot_tier(now=THIS_MONTH)) == 1
+    assert HotTier(tmp_path / "hot_tier").partitions() == []
+
+
+def test_disabling_the_hot_tier_compacts_it(tmp_path: Path):
+    times = [THIS_MONTH + timedelta(minutes=15 * i) for i in range(2)]
+    flush(make_archive(tmp_path), make_df("SN1", times[:1]))
+
+    archive = make_archive(tmp_path, hot_tier=False)
+    flush(archive, make_df("SN1", times[1:]))
+
+    assert HotTier(tmp_path / "hot_tier").partitions() == []
+    df = pl.read_parquet(tmp_path / "parquet_archive")
+    assert df["period_end_time"].to_list() == times
+
+
+def test_reader_ignores_rows_in_both_tiers(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """e.g. if we crash during compaction, after writing the Parquet but before removing the IPC."""
+    archive = make_archive(tmp_path)
+    times = [THIS_MONTH + timedelta(minutes=15 * i) for i in range(2)]
+    flush(archive, make_df("SN1", times))
+    hot_tier = HotTier(tmp_path / "hot_tier")
+    ipc_paths = hot_tier.files((2999, 1))
+    monkeypatch.setattr(HotTier, "remove", lambda self, paths: None)  # Simulate the crash.
+
+    archive.compact_hot_tier(force=True)
+
+    assert hot_tier.files((2999, 1)) == ipc_paths
+    reader = ArchiveReader(tmp_path / "parquet_archive", hot_tier_root=tmp_path / "hot_tier")
+    assert reader.load(THIS_MONTH, THIS_MONTH + timedelta(days=1)).height == 2
+
+
+def test_manifest_is_rebuilt_from_both_tiers(tmp_path: Path):
+    flush(make_archive(tmp_path), make_df("SN1", [THIS_MONTH]))
+    (tmp_path / "state/archive_manifest.json").unlink()
+
+    assert make_archive(tmp_path).manifest.watermarks == {"SN1": THIS_MONTH}
+
+
+@pytest.mark.parametrize("reader_hot_tier", [None, "elsewhere"])
+def test_reader_must_read_the_same_hot_tier(tmp_path: Path, reader_hot_tier: str | None):
+    hot_tier_root = None if reader_hot_tier is None else tmp_path / reader_hot_tier
+    reader = ArchiveReader(tmp_path / "parquet_archive", hot_tier_root=hot_tier_root)
+    with pytest.raises(AssertionError):
+        ParquetArchive(
+            tmp_path / "parquet_archive",
+            tmp_path / "manifest.json",
+            reader,
+            hot_tier=HotTier(tmp_path / "hot_tier"),
+        )
@@ -1,9 +1,13 @@
+import gzip
 import json
 from pathlib import Path
 
 import polars as pl
 
-from envoy_recorder.json_to_dataframe import convert_directory_of_json_files_to_dataframe
+from envoy_recorder.json_to_dataframe import (
+    convert_directory_of_json_files_to_dataframe,
+    iter_dataframe_chunks,
+)
 
 
 def test_envoy_json_to_dataframe_real_data():
@@ -133,3 +137,55 @@ def test_deduplication(tmp_path: Path):
 
     # Should only have 1 row after deduplication
     assert len(df) == 1
+
+
+def test_gzipped_files_match_plain_files(tmp_path: Path):
+    json_path = Path(__file__).parent.parent / "example_envoy_json_data"
+    for path in json_path.glob("*.json"):
+        with gzip.open(tmp_path / f"{path.name}.gz", "wb") as f:
+            f.write(path.read_bytes())
+
+    expected = convert_directory_of_json_files_to_dataframe(json_path)
+    df = convert_directory_of_json_files_to_dataframe(tmp_path, max_workers=4)
+
+    assert df.equals(expected)
+
+
+def test_truncated_responses_are_skipped(tmp_path: Path):
+    json_path = Path(__file__).parent.parent / "example_envoy_json_data"
+    paths = sorted(json_path.glob("*.json"))
+    for path in paths:
+        (tmp_path / path.name).write_bytes(path.read_bytes())
+    truncated = paths[0].read_bytes()
+    (tmp_path / "1767696000.json").write_bytes(truncated[: len(truncated) // 2])
+
+    df = convert_directory_of_json_files_to_dataframe(tmp_path)
+
+    assert df.equals(convert_directory_of_json_files_to_dataframe(json_path))
+
+
+def test_responses_with_a_different_schema_are_skipped(tmp_path: Path):
+    json_path = Path(__file__).parent.parent / "example_envoy_json_data"
+    for path in json_path.glob("*.json"):
+        (tmp_path / path.name).write_bytes(path.read_bytes())
+    # Valid JSON which isn't an object, and a micro-inverter without "channels".
+    (tmp_path / "1767696000.json").write_text("[1, 2, 3]")
+    drifted = {"123": {"devName": "pcu", "sn": "123", "readings": []}}
+    (tmp_path / "1767696060.json").write_text(json.dumps(drifted))
+
+    df = convert_directory_of_json_files_to_dataframe(tmp_path)
+
+    assert df.equals(convert_directory_of_json_files_to_dataframe(json_path))
+
+
+def test_chunks_hold_the_same_rows(tmp_path: Path):
+    json_path = Path(__file__).parent.parent / "example_envoy_json_data"
+    n_responses = len(list(json_path.glob("*.json")))
+
+    # One chunk per response.
+    chunks = list(iter_dataframe_chunks(json_path, max_chunk_json_bytes=1))
+
+    assert len(chunks) == n_responses
+    df = pl.concat(chunks).unique(subset=["serial_number", "period_end_time"])
+    expected = convert_directory_of_json_files_to_dataframe(json_path)
+    assert df.sort("serial_number", "period_end_time").equals(expected)
@@ -0,0 +1,128 @@
+import json
+from datetime import UTC, datetime
+from pathlib import Path
+
+import polars as pl
+import pytest
+from pydantic import ValidationError
+
+from envoy_recorder.config_loader import (
+    EnvoyRecorderConfig,
+    LivePowerConfig,
+)
+from envoy_recorder.live_power import LivePowerSampler, PowerRingBuffer, parse_production
+
+MIDDAY = int(datetime(2026, 6, 1, 12, tzinfo=UTC).timestamp())
+
+
+@pytest.fixture
+def config(config: EnvoyRecorderConfig) -> EnvoyRecorderConfig:
+    config.live_power = LivePowerConfig(
+        enabled=True, sample_every_n_seconds=10, ring_buffer_size=12
+    )
+    return config
+
+
+def make_production_json(production_W: float, consumption_W: float | None = None) -> str:
+    production = [{"type": "inverters", "activeCount": 10, "wNow": production_W + 1}]
+    consumption = []
+    if consumption_W is not None:
+        production.append(
+            {
+                "type": "eim",
+                "activeCount": 1,
+                "measurementType": "production",
+                "wNow": production_W,
+            }
+        )
+        consumption.append(
+            {
+                "type": "eim",
+                "activeCount": 1,
+                "measurementType": "total-consumption",
+                "wNow": consumption_W,
+            }
+        )
+    return json.dumps({"production": production, "consumption": consumption})
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = MIDDAY
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ring_buffer_overwrites_the_oldest_samples():
+    ring_buffer = PowerRingBuffer(capacity=3)
+    for t in range(5):
+        ring_buffer.append(t, production_W=t * 10, consumption_W=None if t % 2 else t)
+
+    assert len(ring_buffer) == 3
+    samples = ring_buffer.samples()
+    assert [s.timestamp for s in samples] == [2, 3, 4]
+    assert [s.production_W for s in samples] == [20, 30, 40]
+    assert [s.consumption_W for s in samples] == [2, None, 4]
+    assert [s.timestamp for s in ring_buffer.samples(start=3, end=4)] == [3]
+    with pytest.raises(AssertionError):
+        ring_buffer.append(1, production_W=0, consumption_W=None)
+
+
+def test_parse_production():
+    # Without meters, the production is the total of the micro-inverters' last readings.
+    assert parse_production(make_production_json(100)) == (101, None)
+    assert parse_production(make_production_json(100, consumption_W=250)) == (100, 250)
+    with pytest.raises(ValueError):
+        parse_production('{"production": []}')
+
+
+def test_ring_buffer_must_hold_two_minutes():
+    with pytest.raises(ValidationError):
+        LivePowerConfig(sample_every_n_seconds=10, ring_buffer_size=11)
+
+
+def test_sampler_writes_one_row_per_minute(config: EnvoyRecorderConfig, monkeypatch):
+    clock = Clock()
+    sampler = LivePowerSampler(config, clock=clock)
+    production_W = iter(range(1000))
+    monkeypatch.setattr(
+        sampler,
+        "_fetch_production",
+        lambda: make_production_json(next(production_W), consumption_W=500),
+    )
+
+    # Two and a half minutes of samples, every 10 seconds.
+    for t in range(0, 150, 10):
+        clock.now = MIDDAY + t
+        sampler.sample()
+    assert len(sampler.ring_buffer) == 12
+    paths = sampler.write()
+
+    (path,) = paths
+    assert path.parent.relative_to(config.paths.live_power) == Path("year=2026/month=6")
+    df = pl.read_parquet(config.paths.live_power, hive_partitioning=False)
+    # The third minute hasn't finished yet.
+    assert df["period_start"].dt.epoch(time_unit="s").to_list() == [MIDDAY, MIDDAY + 60]
+    assert df["mean_production_W"].to_list() == [2.5, 8.5]
+    assert df["min_production_W"].to_list() == [0, 6]
+    assert df["max_production_W"].to_list() == [5, 11]
+    assert df["mean_consumption_W"].to_list() == [500, 500]
+    assert df["n_samples"].to_list() == [6, 6]
+
+    # The next write appends the third minute.
+    clock.now = MIDDAY + 180
+    sampler.write()
+    df = pl.read_parquet(config.paths.live_power, hive_partitioning=False)
+    assert df["period_start"].dt.epoch(time_unit="s").to_list() == [
+        MIDDAY + 60 * i for i in range(3)
+    ]
+    assert df["n_samples"].to_list() == [6, 6, 3]
+
+
+def test_failed_samples_are_skipped(config: EnvoyRecorderConfig, monkeypatch):
+    sampler = LivePowerSampler(config, clock=Clock())
+    monkeypatch.setattr(sampler, "_fetch_production", lambda: '{"production": [')
+    sampler.sample()
+    assert len(sampler.ring_buffer) == 0
+    assert sampler.write() == []
@@ -0,0 +1,42 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from envoy_recorder import metrics
+
+
+@pytest.fixture
+def metrics_file(tmp_path: Path):
+    path = tmp_path / "logs/metrics.jsonl"
+    metrics.set_metrics_file(path)
+    yield path
+    metrics.set_metrics_file(None)
+
+
+def read_metrics(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def test_metrics_are_written_locally(metrics_file: Path):
+    metrics.distribution("dataframe.n_rows", 42, "rows")
+    with metrics.with_attributes(site="home"):
+        metrics.count("envoy.request.failures")
+
+    [n_rows, failures] = read_metrics(metrics_file)
+    assert n_rows["type"] == "distribution"
+    assert (n_rows["name"], n_rows["value"], n_rows["unit"]) == ("dataframe.n_rows", 42, "rows")
+    assert n_rows["attributes"] == {}
+    assert failures["type"] == "count"
+    assert failures["attributes"] == {"site": "home"}
+
+
+def test_timed_records_duration_even_on_failure(metrics_file: Path):
+    with metrics.timed("flush.parse_json"):
+        pass
+    with pytest.raises(ValueError), metrics.timed("flush.merge"):
+        raise ValueError("Boom!")
+
+    records = read_metrics(metrics_file)
+    assert [r["name"] for r in records] == ["flush.parse_json.duration", "flush.merge.duration"]
+    assert all(r["value"] >= 0 and r["unit"] == "seconds" for r in records)
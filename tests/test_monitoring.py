@@ -0,0 +1,19 @@
+import pytest
+
+from envoy_recorder import monitoring
+
+
+def test_run_worker_reports_exceptions(monkeypatch):
+    monkeypatch.setenv("SENTRY_DSN", "")
+    captured = []
+    monkeypatch.setattr(monitoring.sentry_sdk, "capture_exception", captured.append)
+
+    def main():
+        raise OSError("Disk full!")
+
+    with pytest.raises(OSError, match="Disk full"):
+        monitoring.run_worker(main, "Test worker")
+    assert [str(e) for e in captured] == ["Disk full!"]
+
+    monitoring.run_worker(lambda: None, "Test worker")
+    assert len(captured) == 1
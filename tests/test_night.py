@@ -0,0 +1,62 @@
+import os
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+
+from envoy_recorder.config_loader import EnvoyConfig, IntervalsConfig
+from envoy_recorder.night import NightSchedule, solar_elevation_degrees
+
+LONDON = (51.5, -0.13)
+MIDSUMMER_NOON = datetime(2026, 6, 21, 12, tzinfo=UTC).timestamp()
+MIDSUMMER_MIDNIGHT = datetime(2026, 6, 21, 0, tzinfo=UTC).timestamp()
+
+
+def make_schedule(tmp_path: Path, **envoy_kwargs) -> NightSchedule:
+    intervals = IntervalsConfig(adaptive_night_polling=True)
+    envoy = EnvoyConfig(ip_address="127.0.0.1", token="secret", **envoy_kwargs)
+    return NightSchedule(intervals, envoy, tmp_path / "last_production")
+
+
+def set_last_production(tmp_path: Path, timestamp: float) -> None:
+    path = tmp_path / "last_production"
+    path.touch()
+    os.utime(path, (timestamp, timestamp))
+
+
+def test_solar_elevation():
+    # At midsummer, the sun reaches 90 - 51.5 + 23.4 = 62 degrees above London.
+    assert solar_elevation_degrees(MIDSUMMER_NOON, *LONDON) == pytest.approx(62, abs=1)
+    assert solar_elevation_degrees(MIDSUMMER_MIDNIGHT, *LONDON) == pytest.approx(-15, abs=1)
+    # The sun is overhead at the equator at noon on the March equinox.
+    equinox = datetime(2026, 3, 20, 12, 7, tzinfo=UTC).timestamp()
+    assert solar_elevation_degrees(equinox, 0, 0) == pytest.approx(90, abs=1)
+
+
+def test_night_after_inactivity(tmp_path: Path):
+    schedule = make_schedule(tmp_path)
+    # We haven't seen any production yet.
+    assert not schedule.is_night(MIDSUMMER_MIDNIGHT)
+
+    set_last_production(tmp_path, MIDSUMMER_MIDNIGHT - 59 * 60)
+    assert not schedule.is_night(MIDSUMMER_MIDNIGHT)
+    set_last_production(tmp_path, MIDSUMMER_MIDNIGHT - 61 * 60)
+    assert schedule.is_night(MIDSUMMER_MIDNIGHT)
+
+    schedule.record_production()
+    assert not schedule.is_night()
+
+
+def test_the_sun_ends_the_night(tmp_path: Path):
+    schedule = make_schedule(tmp_path, latitude=LONDON[0], longitude=LONDON[1])
+    set_last_production(tmp_path, MIDSUMMER_MIDNIGHT - 3 * 3600)
+    assert schedule.is_night(MIDSUMMER_MIDNIGHT)
+    # The sun rises at about 03:45 UTC at midsummer in London, long before the first production.
+    assert not schedule.is_night(MIDSUMMER_MIDNIGHT + 4 * 3600)
+
+
+def test_polls_less_often_at_night(tmp_path: Path):
+    schedule = make_schedule(tmp_path)
+    set_last_production(tmp_path, MIDSUMMER_MIDNIGHT - 3 * 3600)
+    polls = [t for t in range(0, 3600, 60) if schedule.should_poll(MIDSUMMER_MIDNIGHT + t)]
+    assert polls == list(range(0, 3600, 600))
@@ -0,0 +1,144 @@
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+import pytest
+from conftest import make_df
+
+from envoy_recorder.config_loader import ArchiveConfig
+from envoy_recorder.parquet_archive import (
+    PARTITION_FILENAME,
+    ParquetArchive,
+    write_hive_partitions,
+)
+
+
+def test_write_only_replaces_touched_partitions(tmp_path: Path):
+    archive_path = tmp_path / "parquet_archive"
+    december = datetime(2025, 12, 31, 23, 45, tzinfo=UTC)
+    january = datetime(2026, 1, 1, 0, 0, tzinfo=UTC)
+    write_hive_partitions(make_df("SN1", [december, january]), archive_path)
+    december_file = archive_path / "year=2025" / "month=12" / PARTITION_FILENAME
+    december_mtime = december_file.stat().st_mtime_ns
+
+    written = write_hive_partitions(
+        make_df("SN1", [january, january + timedelta(minutes=15)]), archive_path
+    )
+
+    assert written == [archive_path / "year=2026" / "month=1" / PARTITION_FILENAME]
+    assert december_file.stat().st_mtime_ns == december_mtime
+    df = pl.read_parquet(archive_path)
+    assert df.height == 3  # 1 row in December and the 2 rows we just wrote for January.
+    # No temporary files should be left behind.
+    assert not any((tmp_path / ".parquet_archive.staging").iterdir())
+
+
+def test_failed_write_leaves_partition_intact(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    archive_path = tmp_path / "parquet_archive"
+    january = datetime(2026, 1, 1, tzinfo=UTC)
+    write_hive_partitions(make_df("SN1", [january]), archive_path)
+
+    def crash(*args, **kwargs):
+        raise OSError("Disk full!")
+
+    monkeypatch.setattr(pl.DataFrame, "write_parquet", crash)
+    with pytest.raises(OSError):
+        write_hive_partitions(make_df("SN2", [january]), archive_path)
+    monkeypatch.undo()
+
+    df = pl.read_parquet(archive_path)
+    assert df["serial_number"].to_list() == ["SN1"]
+    assert not any((tmp_path / ".parquet_archive.staging").iterdir())
+
+
+def test_load_partitions_ignores_missing_partitions(tmp_path: Path):
+    archive_path = tmp_path / "parquet_archive"
+    archive_path.mkdir()
+    archive = ParquetArchive(archive_path, tmp_path / "archive_manifest.json")
+    assert archive.load_partitions([(2026, 1)]).height == 0
+
+    archive.write(make_df("SN1", [datetime(2026, 1, 1, tzinfo=UTC)]))
+    assert archive.load_partitions([(2026, 1), (2026, 2)]).height == 1
+
+
+EXAMPLE_JSON_PATH = Path(__file__).parent.parent / "example_envoy_json_data"
+
+
+def test_watermarks_skip_reading_parquet_when_nothing_is_new(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    archive_path = tmp_path / "parquet_archive"
+    archive_path.mkdir()
+    manifest_path = tmp_path / "archive_manifest.json"
+    archive = ParquetArchive(archive_path, manifest_path)
+    merged_df = archive.append_to_parquet_in_memory(EXAMPLE_JSON_PATH)
+    assert merged_df is not None
+    archive.write(merged_df)
+    assert len(archive.manifest.watermarks) == merged_df["serial_number"].n_unique()
+    assert sum(archive.manifest.partition_row_counts.values()) == merged_df.height
+
+    # Flushing the same data again shouldn't need to read any Parquet.
+    def fail(*args, **kwargs):
+        raise AssertionError("Parquet should not be read!")
+
+    archive = ParquetArchive(archive_path, manifest_path)
+    monkeypatch.setattr(archive, "load_partitions", fail)
+    assert archive.append_to_parquet_in_memory(EXAMPLE_JSON_PATH) is None
+
+
+def test_live_buffer_is_loaded_in_chunks(tmp_path: Path):
+    archive = ParquetArchive(tmp_path / "parquet_archive", tmp_path / "archive_manifest.json")
+    expected = archive.load_new_rows(EXAMPLE_JSON_PATH)
+    # A chunk per response.
+    df = archive.load_new_rows(EXAMPLE_JSON_PATH, max_chunk_json_bytes=1)
+    assert df.sort("serial_number", "period_end_time").equals(
+        expected.sort("serial_number", "period_end_time")
+    )
+
+
+def test_manifest_is_rebuilt_if_missing(tmp_path: Path):
+    archive_path = tmp_path / "parquet_archive"
+    archive_path.mkdir()
+    manifest_path = tmp_path / "archive_manifest.json"
+    archive = ParquetArchive(archive_path, manifest_path)
+    january = datetime(2026, 1, 1, tzinfo=UTC)
+    archive.write(make_df("SN1", [january, january + timedelta(minutes=15)]))
+    original_manifest = archive.manifest
+
+    manifest_path.unlink()
+    rebuilt_manifest = ParquetArchive(archive_path, manifest_path).manifest
+
+    assert rebuilt_manifest == original_manifest
+    assert rebuilt_manifest.partition_row_counts == {"year=2026/month=1": 2}
+    assert manifest_path.exists()
+
+
+@pytest.mark.parametrize(
+    "layout",
+    [
+        ArchiveConfig(row_groups="default", statistics="min_max"),
+        ArchiveConfig(row_groups="per_serial_number"),
+        ArchiveConfig(
+            row_groups="per_serial_number", writer="pyarrow", serial_number_bloom_filter=True
+        ),
+    ],
+    ids=["polars-default", "polars-per-serial-number", "pyarrow-per-serial-number"],
+)
+def test_parquet_layouts_round_trip(tmp_path: Path, layout: ArchiveConfig):
+    if layout.writer == "pyarrow":
+        pytest.importorskip("pyarrow")
+    january = datetime(2026, 1, 1, tzinfo=UTC)
+    times = [january + timedelta(minutes=15 * i) for i in range(3)]
+    df = pl.concat([make_df("SN1", times), make_df("SN2", times[:2])])
+    archive = ParquetArchive(
+        tmp_path / "parquet_archive", tmp_path / "manifest.json", None, layout
+    )
+
+    [path] = archive.write(df)
+
+    assert pl.read_parquet(path).equals(df)
+    if layout.writer == "pyarrow":
+        import pyarrow.parquet as pq
+
+        metadata = pq.ParquetFile(path).metadata
+        assert [metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)] == [3, 2]
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import pytest
+
+from envoy_recorder.json_to_dataframe import convert_directory_of_json_files_to_dataframe
+from envoy_recorder.payload_compression import (
+    compress,
+    current_dictionary_path,
+    decompress,
+    load_dictionaries,
+    save_dictionary,
+    train_dictionary,
+)
+
+EXAMPLE_JSON_PATH = Path(__file__).parent.parent / "example_envoy_json_data"
+
+
+@pytest.fixture
+def samples() -> list[bytes]:
+    return [path.read_bytes() for path in sorted(EXAMPLE_JSON_PATH.glob("*.json"))]
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd"])
+def test_round_trip_without_dictionary(samples: list[bytes], codec):
+    assert decompress(compress(samples[0], codec), codec, dictionaries={}) == samples[0]
+
+
+def test_old_responses_stay_readable_after_retraining(tmp_path: Path, samples: list[bytes]):
+    old_dict = train_dictionary(samples, dict_size=8 * 1024)
+    save_dictionary(old_dict, tmp_path)
+    compressed_with_old_dict = compress(samples[0], "zstd", old_dict)
+    assert len(compressed_with_old_dict) < len(compress(samples[0], "zstd"))
+
+    new_dict = train_dictionary(samples)
+    save_dictionary(new_dict, tmp_path)
+    assert current_dictionary_path(tmp_path) == tmp_path / f"{new_dict.dict_id}.zdict"
+
+    dictionaries = load_dictionaries(tmp_path)
+    assert decompress(compressed_with_old_dict, "zstd", dictionaries) == samples[0]
+
+
+def test_missing_dictionary_raises(samples: list[bytes]):
+    zstd_dict = train_dictionary(samples)
+    with pytest.raises(ValueError, match="dictionary"):
+        decompress(compress(samples[0], "zstd", zstd_dict), "zstd", dictionaries={})
+
+
+def test_zstd_files_match_plain_files(tmp_path: Path, samples: list[bytes]):
+    zstd_dict = train_dictionary(samples)
+    save_dictionary(zstd_dict, tmp_path, make_current=False)
+    for i, sample in enumerate(samples):
+        (tmp_path / f"{1000 + i}.json.zst").write_bytes(compress(sample, "zstd", zstd_dict))
+
+    expected = convert_directory_of_json_files_to_dataframe(EXAMPLE_JSON_PATH)
+    df = convert_directory_of_json_files_to_dataframe(tmp_path)
+
+    assert df.equals(expected)
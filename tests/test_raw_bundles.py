@@ -0,0 +1,77 @@
+import gzip
+import os
+import shutil
+import tracemalloc
+from datetime import UTC, datetime
+from pathlib import Path
+
+from envoy_recorder.json_to_dataframe import convert_directory_of_json_files_to_dataframe
+from envoy_recorder.payload_compression import save_dictionary, train_dictionary
+from envoy_recorder.raw_bundles import append_to_bundles, bundle_path, list_bundles
+from envoy_recorder.segment import append_frame, iter_frames
+
+EXAMPLE_JSON_PATH = Path(__file__).parent.parent / "example_envoy_json_data"
+
+JANUARY_31 = int(datetime(2026, 1, 31, 23, 59, tzinfo=UTC).timestamp())
+FEBRUARY_1 = int(datetime(2026, 2, 1, 0, 0, tzinfo=UTC).timestamp())
+
+
+def test_responses_are_bundled_by_month(tmp_path: Path):
+    live_buffer = tmp_path / "processing_1"
+    live_buffer.mkdir()
+    (live_buffer / f"{JANUARY_31}.json.gz").write_bytes(gzip.compress(b'{"a": 1}'))
+    (live_buffer / f"{JANUARY_31 + 30}.dup").touch()
+    append_frame(live_buffer / "segment.wal", FEBRUARY_1, b'{"b": 2}')
+    append_frame(live_buffer / "segment.wal", FEBRUARY_1 + 60, b"")  # A duplicate response.
+    root = tmp_path / "raw_bundles"
+
+    assert append_to_bundles(live_buffer, root) == 2
+    assert append_to_bundles(live_buffer, root) == 2  # e.g. after a crash. Bundles only grow.
+
+    assert list_bundles(root) == [root / "2026-01", root / "2026-02"]
+    assert bundle_path(root, FEBRUARY_1) == root / "2026-02"
+    january = list(iter_frames(root / "2026-01/segment.wal"))
+    assert january == [(JANUARY_31, b'{"a": 1}')] * 2
+
+
+def test_bundles_with_a_dictionary_can_be_converted(tmp_path: Path):
+    samples = [path.read_bytes() for path in sorted(EXAMPLE_JSON_PATH.glob("*.json"))]
+    dictionary_path = save_dictionary(train_dictionary(samples), tmp_path / "dictionaries")
+    live_buffer = tmp_path / "processing_1"
+    live_buffer.mkdir()
+    for path in EXAMPLE_JSON_PATH.glob("*.json"):
+        shutil.copy(path, live_buffer / path.name.removeprefix("device_data_"))
+    root = tmp_path / "raw_bundles"
+
+    append_to_bundles(live_buffer, root, dictionary_path)
+
+    [bundle] = list_bundles(root)
+    assert (bundle / dictionary_path.name).exists()
+    expected = convert_directory_of_json_files_to_dataframe(EXAMPLE_JSON_PATH)
+    assert convert_directory_of_json_files_to_dataframe(bundle).equals(expected)
+
+
+def test_responses_are_streamed_in_timestamp_order(tmp_path: Path):
+    live_buffer = tmp_path / "processing_1"
+    live_buffer.mkdir()
+    # 8 MB of incompressible responses, interleaved between files and a segment.
+    n_responses, response_size = 80, 100_000
+    for i in range(n_responses):
+        payload = os.urandom(response_size // 2).hex().encode()
+        if i % 2:
+            append_frame(live_buffer / "segment.wal", FEBRUARY_1 + 60 * i, payload)
+        else:
+            (live_buffer / f"{FEBRUARY_1 + 60 * i}.json.gz").write_bytes(gzip.compress(payload))
+    root = tmp_path / "raw_bundles"
+
+    tracemalloc.start()
+    try:
+        assert append_to_bundles(live_buffer, root) == n_responses
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Only a few responses are held in memory at once.
+    assert peak < 10 * response_size
+    timestamps = [timestamp for timestamp, _ in iter_frames(root / "2026-02/segment.wal")]
+    assert timestamps == [FEBRUARY_1 + 60 * i for i in range(n_responses)]
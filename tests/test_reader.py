@@ -0,0 +1,102 @@
+import os
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+import pytest
+from conftest import make_df
+
+from envoy_recorder import reader
+from envoy_recorder.parquet_archive import ParquetArchive, write_hive_partitions
+from envoy_recorder.reader import ArchiveReader, months_between
+
+JANUARY = datetime(2026, 1, 15, tzinfo=UTC)
+FEBRUARY = datetime(2026, 2, 15, tzinfo=UTC)
+MARCH = datetime(2026, 3, 15, tzinfo=UTC)
+
+
+@pytest.fixture
+def archive_path(tmp_path: Path) -> Path:
+    path = tmp_path / "parquet_archive"
+    df = pl.concat(
+        [make_df("SN1", [JANUARY, FEBRUARY, MARCH]), make_df("SN2", [JANUARY, FEBRUARY, MARCH])]
+    )
+    write_hive_partitions(df, path)
+    return path
+
+
+def test_months_between():
+    assert months_between(datetime(2025, 11, 5), datetime(2026, 2, 1)) == [
+        (2025, 11),
+        (2025, 12),
+        (2026, 1),
+    ]
+    assert months_between(datetime(2026, 2, 1), datetime(2026, 2, 1)) == []
+
+
+def test_load_only_reads_partitions_in_range(archive_path: Path, monkeypatch):
+    archive_reader = ArchiveReader(archive_path)
+    read_paths = []
+    original_read_parquet = pl.read_parquet
+
+    def read_parquet(paths, **kwargs):
+        read_paths.extend(paths)
+        return original_read_parquet(paths, **kwargs)
+
+    monkeypatch.setattr(pl, "read_parquet", read_parquet)
+
+    df = archive_reader.load(JANUARY, FEBRUARY + timedelta(days=1), serials=["SN2"])
+
+    assert df.rows(named=True)[0]["serial_number"] == "SN2"
+    assert df["period_end_time"].to_list() == [JANUARY, FEBRUARY]
+    assert [p.parent.name for p in read_paths] == ["month=1", "month=2"]
+
+
+def test_repeat_reads_come_from_cache(archive_path: Path):
+    archive_reader = ArchiveReader(archive_path)
+    first = archive_reader.load(JANUARY, MARCH)
+    second = archive_reader.load(JANUARY, MARCH)
+
+    assert first.equals(second)
+    assert (archive_reader.n_cache_misses, archive_reader.n_cache_hits) == (3, 3)
+
+
+def test_cache_is_invalidated_when_a_partition_is_rewritten(archive_path: Path):
+    archive_reader = ArchiveReader(archive_path)
+    assert archive_reader.load(JANUARY, FEBRUARY).height == 2
+
+    write_hive_partitions(make_df("SN3", [JANUARY]), archive_path)
+    # Make sure the mtime changes, even on filesystems with coarse timestamps.
+    january_file = archive_reader.partition_files((2026, 1))[0]
+    stat = january_file.stat()
+    os.utime(january_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert archive_reader.load(JANUARY, FEBRUARY)["serial_number"].to_list() == ["SN3"]
+
+
+def test_least_recently_used_partition_is_evicted(archive_path: Path):
+    archive_reader = ArchiveReader(archive_path, max_cached_partitions=2)
+    for key in [(2026, 1), (2026, 2), (2026, 1), (2026, 3)]:
+        archive_reader.load_partition(key)
+    assert archive_reader.n_cache_misses == 3
+
+    archive_reader.load_partition((2026, 1))  # Still cached.
+    archive_reader.load_partition((2026, 2))  # Evicted.
+    assert (archive_reader.n_cache_misses, archive_reader.n_cache_hits) == (4, 2)
+
+
+def test_scan_pushes_down_predicates(archive_path: Path):
+    lazy_df = reader.scan(JANUARY, MARCH, serials=["SN1"], archive_path=archive_path)
+    assert lazy_df.collect()["period_end_time"].to_list() == [JANUARY, FEBRUARY]
+    # Empty time ranges don't touch the disk.
+    assert reader.scan(MARCH, JANUARY, archive_path=archive_path).collect().height == 0
+
+
+def test_partitions_written_by_the_archive_are_cached(tmp_path: Path):
+    archive_path = tmp_path / "parquet_archive"
+    archive_reader = ArchiveReader(archive_path)
+    archive = ParquetArchive(archive_path, tmp_path / "archive_manifest.json", archive_reader)
+    archive.write(make_df("SN1", [JANUARY]))
+
+    assert archive.load_partitions([(2026, 1)]).height == 1
+    assert (archive_reader.n_cache_misses, archive_reader.n_cache_hits) == (0, 1)
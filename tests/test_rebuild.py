@@ -0,0 +1,66 @@
+import shutil
+from pathlib import Path
+
+import polars as pl
+
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.json_to_dataframe import convert_directory_of_json_files_to_dataframe
+from envoy_recorder.parquet_archive import ParquetArchive, write_hive_partitions
+from envoy_recorder.raw_bundles import append_to_bundles, list_bundles
+from envoy_recorder.rebuild import rebuild_archive
+
+EXAMPLE_JSON_PATH = Path(__file__).parent.parent / "example_envoy_json_data"
+
+
+def test_rebuild_archive_from_bundles(tmp_path: Path, config: EnvoyRecorderConfig):
+    paths = config.paths
+    live_buffer = tmp_path / "processing_1"
+    live_buffer.mkdir()
+    for path in EXAMPLE_JSON_PATH.glob("*.json"):
+        shutil.copy(path, live_buffer / path.name.removeprefix("device_data_"))
+    append_to_bundles(live_buffer, paths.raw_bundles)
+    expected = convert_directory_of_json_files_to_dataframe(EXAMPLE_JSON_PATH)
+    # The old archive has a row from before the first bundle, which must be kept, and rows which
+    # were converted by an old (buggy) version of `json_to_dataframe.py`, which must be replaced.
+    older_row = expected.head(1).with_columns(pl.col("period_end_time").dt.offset_by("-1y"))
+    older_row = older_row.with_columns(year=pl.lit(2025, pl.UInt16))
+    buggy_rows = expected.with_columns(joules_produced=pl.lit(0, pl.UInt32))
+    write_hive_partitions(pl.concat([older_row, buggy_rows]), paths.parquet_archive)
+    assert ParquetArchive(paths.parquet_archive, paths.archive_manifest).manifest.watermarks
+
+    result = rebuild_archive(config, max_workers=1)
+
+    assert result is not None
+    assert result.n_rows == expected.height + 1
+    df = pl.read_parquet(paths.parquet_archive, hive_partitioning=False)
+    assert df.equals(pl.concat([older_row, expected]))
+    assert (result.old_archive / "parquet_archive").exists()
+    assert not paths.archive_manifest.exists()
+    assert not (paths.rebuild / "parquet_archive").exists()
+
+
+def test_rebuild_merges_rows_bundled_in_a_later_month(tmp_path: Path, config: EnvoyRecorderConfig):
+    paths = config.paths
+    live_buffer = tmp_path / "processing_1"
+    live_buffer.mkdir()
+    # Pretend that half of the responses were polled a month later. So the February bundle holds
+    # rows for the January partition, which is written by the January bundle's worker.
+    for i, path in enumerate(sorted(EXAMPLE_JSON_PATH.glob("*.json"))):
+        timestamp = int(path.stem.removeprefix("device_data_"))
+        if i % 2:
+            timestamp += 31 * 24 * 60 * 60
+        shutil.copy(path, live_buffer / f"{timestamp}.json")
+    append_to_bundles(live_buffer, paths.raw_bundles)
+    assert [bundle.name for bundle in list_bundles(paths.raw_bundles)] == ["2026-01", "2026-02"]
+
+    result = rebuild_archive(config, max_workers=2)
+
+    assert result is not None
+    expected = convert_directory_of_json_files_to_dataframe(EXAMPLE_JSON_PATH)
+    assert result.n_rows == expected.height
+    df = pl.read_parquet(paths.parquet_archive, hive_partitioning=False)
+    assert df.equals(expected)
+
+
+def test_rebuild_without_bundles_does_nothing(config: EnvoyRecorderConfig):
+    assert rebuild_archive(config) is None
@@ -0,0 +1,145 @@
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+import pytest
+from conftest import make_df
+
+from envoy_recorder.parquet_archive import ParquetArchive, write_hive_partitions
+from envoy_recorder.reader import ArchiveReader
+from envoy_recorder.rollups import (
+    ROLLUP_PERIODS,
+    RollupTables,
+    compute_inverter_rollups,
+    compute_site_rollups,
+)
+
+QUARTER_HOUR = timedelta(minutes=15)
+
+
+def quarter_hours(start: datetime, n: int) -> list[datetime]:
+    """`n` consecutive period end times, the first of which ends 15 minutes after `start`."""
+    return [start + QUARTER_HOUR * (i + 1) for i in range(n)]
+
+
+def test_inverter_rollups():
+    midnight = datetime(2026, 6, 1, tzinfo=UTC)
+    df = make_df("SN1", quarter_hours(midnight, 8))  # Two hours of readings. 1 W each.
+
+    hourly = compute_inverter_rollups(df, "1h")
+    daily = compute_inverter_rollups(df, "1d")
+
+    assert hourly["period_start"].to_list() == [midnight, midnight + timedelta(hours=1)]
+    assert hourly["energy_Wh"].to_list() == [1, 1]
+    assert hourly["peak_power_W"].to_list() == [1, 1]
+    assert hourly["max_inverter_temperature_Celsius"].to_list() == [23, 27]
+    assert hourly["n_readings"].to_list() == [4, 4]
+    assert daily.rows() == [("SN1", midnight, 2, 1, 27, 8, 2026, 6)]
+
+
+def test_site_rollups_add_up_all_inverters():
+    midnight = datetime(2026, 6, 1, tzinfo=UTC)
+    # The inverters' readings end a few seconds apart.
+    sn1 = make_df("SN1", quarter_hours(midnight, 4))
+    sn2 = make_df("SN2", quarter_hours(midnight + timedelta(seconds=5), 4), joules=1800)
+
+    daily = compute_site_rollups(sn1.vstack(sn2), "1d")
+
+    assert daily.height == 1
+    assert daily["energy_Wh"].item() == 3
+    assert daily["peak_power_W"].item() == 3
+    assert daily["n_inverters"].item() == 2
+
+
+@pytest.fixture
+def archive(tmp_path: Path) -> ParquetArchive:
+    return ParquetArchive(tmp_path / "parquet_archive", tmp_path / "state/archive_manifest.json")
+
+
+def flush(archive: ParquetArchive, rollups: RollupTables, new_df: pl.DataFrame) -> None:
+    """Mimic `EnvoyRecorder.flush`."""
+    merged_df = archive.merge_new_rows(new_df)
+    assert merged_df is not None
+    archive.write(merged_df)
+    rollups.update(merged_df, new_df, archive.load_partitions)
+
+
+def test_update_only_recomputes_touched_days(tmp_path: Path, archive: ParquetArchive):
+    rollups = RollupTables(tmp_path / "rollups")
+    day1 = datetime(2026, 6, 1, tzinfo=UTC)
+    day2 = day1 + timedelta(days=1)
+    flush(archive, rollups, make_df("SN1", quarter_hours(day1, 4)))
+    flush(archive, rollups, make_df("SN1", quarter_hours(day1 + timedelta(hours=1), 4)))
+    flush(archive, rollups, make_df("SN1", quarter_hours(day2, 4)))
+
+    daily = pl.read_parquet(rollups.table_path("inverter_daily"))
+    assert daily["period_start"].to_list() == [day1, day2]
+    # Day 1 was recomputed (not double-counted) when its second hour arrived.
+    assert daily["energy_Wh"].to_list() == [2, 1]
+    site_hourly = pl.read_parquet(rollups.table_path("site_hourly"))
+    assert site_hourly["energy_Wh"].to_list() == [1, 1, 1]
+
+
+def test_update_loads_neighbouring_partition_at_month_end(tmp_path: Path, archive):
+    rollups = RollupTables(tmp_path / "rollups")
+    last_day_of_may = datetime(2026, 5, 31, tzinfo=UTC)
+    # The last reading of the day ends at midnight, so it's in the June partition.
+    flush(
+        archive, rollups, make_df("SN1", quarter_hours(last_day_of_may + timedelta(hours=23), 4))
+    )
+    assert (archive._path / "year=2026/month=6").exists()
+    # Only the June partition has new rows, but the rollup for the 31st of May needs both.
+    flush(archive, rollups, make_df("SN1", quarter_hours(last_day_of_may + timedelta(days=1), 1)))
+
+    daily = pl.read_parquet(rollups.table_path("inverter_daily"))
+    assert daily["period_start"].to_list() == [
+        last_day_of_may,
+        last_day_of_may + timedelta(days=1),
+    ]
+    assert daily["n_readings"].to_list() == [4, 1]
+
+
+def test_pending_days_are_retried(tmp_path: Path, archive: ParquetArchive, monkeypatch):
+    rollups = RollupTables(tmp_path / "rollups", tmp_path / "pending_rollup_days.json")
+    day = datetime(2026, 6, 1, tzinfo=UTC)
+    new_df = make_df("SN1", quarter_hours(day, 4))
+    merged_df = archive.merge_new_rows(new_df)
+    assert merged_df is not None
+    rollups.mark_days_pending(new_df)
+    archive.write(merged_df)
+
+    def fail(*args):
+        raise OSError("Disk full!")
+
+    # The flush crashes before the rollups are written.
+    with monkeypatch.context() as m:
+        m.setattr(rollups, "_replace_days", fail)
+        with pytest.raises(OSError, match="Disk full"):
+            rollups.update(merged_df, new_df, archive.load_partitions)
+    assert rollups.has_pending_days()
+
+    # The next flush has no new rows for that day, but still recomputes it.
+    empty_df = new_df.clear()
+    rollups.update(empty_df, empty_df, archive.load_partitions)
+    assert not rollups.has_pending_days()
+    daily = pl.read_parquet(rollups.table_path("inverter_daily"))
+    assert daily["period_start"].to_list() == [day]
+    assert daily["energy_Wh"].to_list() == [1]
+
+
+def test_rebuild_month_by_month(tmp_path: Path):
+    rollups = RollupTables(tmp_path / "rollups")
+    last_day_of_may = datetime(2026, 5, 31, tzinfo=UTC)
+    # Eight hours of readings, which straddle the May and June partitions.
+    df = make_df("SN1", quarter_hours(last_day_of_may + timedelta(hours=20), 32))
+    archive_path = tmp_path / "parquet_archive"
+    write_hive_partitions(df, archive_path)
+    reader = ArchiveReader(archive_path)
+    assert reader.partitions() == [(2026, 5), (2026, 6)]
+
+    rollups.rebuild(reader.partitions(), reader.load_partitions)
+
+    for name, compute in (("inverter", compute_inverter_rollups), ("site", compute_site_rollups)):
+        for period, every in ROLLUP_PERIODS.items():
+            rebuilt = pl.read_parquet(rollups.table_path(f"{name}_{period}"))
+            assert rebuilt.sort("period_start").equals(compute(df, every).sort("period_start"))
@@ -0,0 +1,79 @@
+from pathlib import Path
+from typing import BinaryIO
+
+from envoy_recorder import segment as segment_module
+from envoy_recorder.json_to_dataframe import convert_directory_of_json_files_to_dataframe
+from envoy_recorder.segment import append_frame, iter_frames, read_first_timestamp
+
+EXAMPLE_JSON_PATH = Path(__file__).parent.parent / "example_envoy_json_data"
+
+
+def test_append_and_read_frames(tmp_path: Path):
+    segment = tmp_path / "segment.wal"
+    assert read_first_timestamp(segment) is None
+
+    append_frame(segment, 1000, b'{"a": 1}')
+    append_frame(segment, 1060, b"")  # A duplicate response.
+    append_frame(segment, 1120, b'{"b": 2}')
+
+    assert read_first_timestamp(segment) == 1000
+    assert list(iter_frames(segment)) == [(1000, b'{"a": 1}'), (1060, b""), (1120, b'{"b": 2}')]
+
+
+def test_first_timestamp_skips_duplicate_responses(tmp_path: Path):
+    segment = tmp_path / "segment.wal"
+    append_frame(segment, 1000, b"")
+    append_frame(segment, 1060, b"")
+    assert read_first_timestamp(segment) is None
+
+    append_frame(segment, 1120, b'{"a": 1}')
+    assert read_first_timestamp(segment) == 1120
+
+
+def test_truncated_frame_is_ignored_and_then_repaired(tmp_path: Path):
+    segment = tmp_path / "segment.wal"
+    append_frame(segment, 1000, b'{"a": 1}')
+    append_frame(segment, 1060, b'{"b": 2}')
+    # Simulate a crash half way through appending the second frame:
+    segment.write_bytes(segment.read_bytes()[:-5])
+
+    assert list(iter_frames(segment)) == [(1000, b'{"a": 1}')]
+
+    append_frame(segment, 1120, b'{"c": 3}')
+    assert list(iter_frames(segment)) == [(1000, b'{"a": 1}'), (1120, b'{"c": 3}')]
+
+
+def test_segment_matches_individual_files(tmp_path: Path):
+    for i, path in enumerate(sorted(EXAMPLE_JSON_PATH.glob("*.json"))):
+        append_frame(tmp_path / "segment.wal", 1000 + i, path.read_bytes())
+
+    expected = convert_directory_of_json_files_to_dataframe(EXAMPLE_JSON_PATH)
+    df = convert_directory_of_json_files_to_dataframe(tmp_path)
+
+    assert df.equals(expected)
+
+
+def test_appends_only_walk_the_frame_headers_once(tmp_path: Path, monkeypatch):
+    segment = tmp_path / "segment.wal"
+    append_frame(segment, 1000, b'{"a": 1}')
+    segment_module._known_ends.clear()  # e.g. a new process appends to the segment.
+    walks = []
+    end_of_last_complete_frame = segment_module._end_of_last_complete_frame
+
+    def counting_end_of_last_complete_frame(f: BinaryIO, end: int) -> int:
+        walks.append(end)
+        return end_of_last_complete_frame(f, end)
+
+    monkeypatch.setattr(
+        segment_module, "_end_of_last_complete_frame", counting_end_of_last_complete_frame
+    )
+
+    for i in range(1, 10):
+        append_frame(segment, 1000 + 60 * i, b'{"b": 2}')
+    assert len(walks) == 1
+
+    # Another process truncates the segment, so the next append checks the tail again.
+    segment.write_bytes(segment.read_bytes()[:-5])
+    append_frame(segment, 2000, b'{"c": 3}')
+    assert len(walks) == 2
+    assert list(iter_frames(segment))[-2:] == [(1480, b'{"b": 2}'), (2000, b'{"c": 3}')]
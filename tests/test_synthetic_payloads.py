@@ -0,0 +1,63 @@
+import json
+from datetime import UTC, datetime
+from pathlib import Path
+
+import polars as pl
+
+from envoy_recorder.json_to_dataframe import convert_directory_of_json_files_to_dataframe
+from envoy_recorder.synthetic_payloads import SyntheticEnvoy, write_live_buffer
+
+MIDNIGHT = int(datetime(2026, 6, 1, tzinfo=UTC).timestamp())
+
+
+def test_one_day_of_payloads_is_parsed(tmp_path: Path):
+    envoy = SyntheticEnvoy(n_inverters=3, n_other_devices=2)
+    n_payloads = write_live_buffer(tmp_path, envoy.payloads(MIDNIGHT, MIDNIGHT + 86_400))
+    assert n_payloads == 24 * 60
+
+    df = convert_directory_of_json_files_to_dataframe(tmp_path)
+
+    # The other devices are ignored.
+    assert sorted(df["serial_number"].cast(pl.String).unique()) == envoy.serial_numbers
+    # Each inverter reports every 15 minutes, but only during the day (06:00 to 18:00).
+    min_readings, max_readings = (
+        df.group_by("serial_number").len().select(min=pl.min("len"), max=pl.max("len")).row(0)
+    )
+    assert int(min_readings) >= 47
+    assert int(max_readings) <= 48
+    hour = pl.col("period_end_time").dt.hour()
+    assert int(df.select(hour.min()).item()) >= 6
+    assert int(df.select(hour.max()).item()) < 18
+    assert int(df.select(pl.min("joules_produced")).item()) > 0
+
+
+def test_segment_live_buffer(tmp_path: Path):
+    envoy = SyntheticEnvoy(n_inverters=2)
+    payloads = list(envoy.payloads(MIDNIGHT + 12 * 3600, MIDNIGHT + 13 * 3600))
+    write_live_buffer(tmp_path, payloads, live_buffer_format="segment", codec="zstd")
+    df = convert_directory_of_json_files_to_dataframe(tmp_path)
+    # Each inverter's last reading from before 12:00, plus 3 or 4 new readings.
+    readings = {
+        (device["sn"], device["channels"][0]["lastReading"]["endDate"])
+        for _, payload in payloads
+        for key, device in json.loads(payload).items()
+        if key.isdigit()
+    }
+    assert df.height == len(readings)
+    assert 2 * 4 <= df.height <= 2 * 5
+
+
+def test_payloads_are_reproducible():
+    def make_payloads(seed: int) -> list[bytes]:
+        envoy = SyntheticEnvoy(n_inverters=2, duplicate_ratio=0.5, seed=seed)
+        return [payload for _, payload in envoy.payloads(MIDNIGHT, MIDNIGHT + 86_400, 600)]
+
+    assert make_payloads(seed=1) == make_payloads(seed=1)
+    assert make_payloads(seed=1) != make_payloads(seed=2)
+
+
+def test_duplicate_ratio():
+    envoy = SyntheticEnvoy(n_inverters=2, duplicate_ratio=1)
+    payloads = [payload for _, payload in envoy.payloads(MIDNIGHT + 12 * 3600, MIDNIGHT + 86_400)]
+    assert len(set(payloads)) == 1
+    assert json.loads(payloads[0])["deviceCount"] == 2
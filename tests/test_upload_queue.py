@@ -0,0 +1,127 @@
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from envoy_recorder import upload_queue
+from envoy_recorder.config_loader import EnvoyRecorderConfig
+from envoy_recorder.locks import try_lock
+from envoy_recorder.upload_queue import UploadQueue
+from envoy_recorder.uploader import LocalDirectoryUploader, UploadManifest
+
+
+class FlakyUploader(LocalDirectoryUploader):
+    def __init__(self, root: Path, n_failures: int) -> None:
+        super().__init__(root)
+        self.n_failures = n_failures
+
+    def upload(self, local_path: Path, relative_path: str) -> None:
+        if self.n_failures > 0:
+            self.n_failures -= 1
+            raise RuntimeError("Network down!")
+        super().upload(local_path, relative_path)
+
+
+def write_partition(config: EnvoyRecorderConfig, month: int, contents: bytes) -> None:
+    path = config.paths.parquet_archive / f"year=2026/month={month}/00000000.parquet"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(contents)
+
+
+def test_enqueue_and_drain(tmp_path: Path, config: EnvoyRecorderConfig):
+    queue = UploadQueue(config)
+    write_partition(config, 1, b"january")
+    write_partition(config, 2, b"february")
+
+    assert queue.enqueue_changed_files() == 2
+    assert queue.enqueue_changed_files() == 0  # Already in the queue.
+    assert queue.has_due_entries()
+    assert queue.drain() == 2
+
+    assert queue.entries() == []
+    assert (tmp_path / "bucket/year=2026/month=1/00000000.parquet").read_bytes() == b"january"
+    assert queue.enqueue_changed_files() == 0  # Nothing has changed since the upload.
+
+
+def test_failed_uploads_back_off_and_are_retried(
+    tmp_path: Path, config: EnvoyRecorderConfig, monkeypatch
+):
+    queue = UploadQueue(config)
+    write_partition(config, 1, b"january")
+    queue.enqueue_changed_files()
+    uploader = FlakyUploader(tmp_path / "bucket", n_failures=1)
+    monkeypatch.setattr(UploadQueue, "_backoff_seconds", lambda self, n_failed_attempts: 100)
+
+    assert queue.drain(uploader) == 0
+    [entry] = queue.entries()
+    assert entry.n_failed_attempts == 1
+    assert not queue.has_due_entries()
+    assert queue.drain(uploader) == 0  # Not due yet.
+
+    # A later run (with a new queue object) retries once the backoff has elapsed.
+    now = time.time() + 200
+    monkeypatch.setattr(upload_queue, "time", SimpleNamespace(time=lambda: now))
+    queue = UploadQueue(config)
+    assert queue.drain(uploader) == 1
+    assert queue.entries() == []
+
+
+def test_file_replaced_during_upload_stays_in_the_queue(
+    tmp_path: Path, config: EnvoyRecorderConfig
+):
+    queue = UploadQueue(config)
+    write_partition(config, 1, b"january")
+    queue.enqueue_changed_files()
+
+    class FlushDuringUpload(LocalDirectoryUploader):
+        def upload(self, local_path: Path, relative_path: str) -> None:
+            super().upload(local_path, relative_path)
+            write_partition(config, 1, b"january, with more rows")
+
+    assert queue.drain(FlushDuringUpload(tmp_path / "bucket")) == 0
+    assert len(queue.entries()) == 1
+    assert UploadManifest.load(config.paths.upload_manifest).files == {}
+
+    assert queue.drain() == 1
+    bucket_path = tmp_path / "bucket/year=2026/month=1/00000000.parquet"
+    assert bucket_path.read_bytes() == b"january, with more rows"
+    assert queue.enqueue_changed_files() == 0
+
+
+def test_only_one_worker_drains_at_a_time(config: EnvoyRecorderConfig):
+    queue = UploadQueue(config)
+    write_partition(config, 1, b"january")
+    queue.enqueue_changed_files()
+
+    with try_lock(config.paths.upload_lock) as locked:
+        assert locked
+        assert queue.drain() == 0
+
+    assert queue.drain() == 1
+
+
+def test_worker_process_drains_queue(tmp_path: Path, config: EnvoyRecorderConfig, monkeypatch):
+    write_partition(config, 1, b"january")
+    UploadQueue(config).enqueue_changed_files()
+    (tmp_path / "config.toml").write_text(
+        f"""
+[envoy]
+ip_address = "127.0.0.1"
+token = "secret"
+
+[paths]
+parquet_archive = "{config.paths.parquet_archive}"
+state = "{config.paths.state}"
+live_buffer = "{config.paths.live_buffer}"
+storage_bucket = "{config.paths.storage_bucket}"
+
+[upload]
+uploader = "local"
+"""
+    )
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SENTRY_DSN", "")  # Don't report to Sentry from the worker.
+
+    assert upload_queue.start_worker_process().wait(timeout=30) == 0
+
+    assert (tmp_path / "bucket/year=2026/month=1/00000000.parquet").read_bytes() == b"january"
+    assert UploadQueue(config).entries() == []
@@ -0,0 +1,73 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from envoy_recorder.uploader import LocalDirectoryUploader, UploadManifest, upload_changed_files
+
+
+class RecordingUploader(LocalDirectoryUploader):
+    def __init__(self, root: Path) -> None:
+        super().__init__(root)
+        self.uploaded: list[str] = []
+
+    def upload(self, local_path: Path, relative_path: str) -> None:
+        super().upload(local_path, relative_path)
+        self.uploaded.append(relative_path)
+
+
+def write_partition(archive: Path, month: int, contents: bytes) -> Path:
+    path = archive / f"year=2026/month={month}/00000000.parquet"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(contents)
+    return path
+
+
+def test_only_changed_files_are_uploaded(tmp_path: Path):
+    archive = tmp_path / "archive"
+    bucket = tmp_path / "bucket"
+    manifest_path = tmp_path / "state" / "upload_manifest.json"
+    write_partition(archive, 1, b"january")
+    february = write_partition(archive, 2, b"february")
+    uploader = RecordingUploader(bucket)
+
+    assert upload_changed_files(archive, uploader, manifest_path) == 2
+    assert (bucket / "year=2026/month=2/00000000.parquet").read_bytes() == b"february"
+
+    # Nothing has changed.
+    assert upload_changed_files(archive, uploader, manifest_path) == 0
+
+    # Rewriting a partition with identical contents doesn't trigger an upload.
+    stat = february.stat()
+    february.write_bytes(b"february")
+    os.utime(february, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert upload_changed_files(archive, uploader, manifest_path) == 0
+
+    write_partition(archive, 2, b"february, with more rows")
+    assert upload_changed_files(archive, uploader, manifest_path) == 1
+    assert uploader.uploaded[-1] == "year=2026/month=2/00000000.parquet"
+    assert (bucket / "year=2026/month=2/00000000.parquet").read_bytes() == (
+        b"february, with more rows"
+    )
+
+
+def test_failed_uploads_are_retried(tmp_path: Path):
+    archive = tmp_path / "archive"
+    manifest_path = tmp_path / "upload_manifest.json"
+    write_partition(archive, 1, b"january")
+    write_partition(archive, 2, b"february")
+
+    class FailOnFebruary(RecordingUploader):
+        def upload(self, local_path: Path, relative_path: str) -> None:
+            if "month=2" in relative_path:
+                raise RuntimeError("Network down!")
+            super().upload(local_path, relative_path)
+
+    with pytest.raises(RuntimeError):
+        upload_changed_files(archive, FailOnFebruary(tmp_path / "bucket"), manifest_path)
+
+    # January's upload was recorded, so only February is uploaded next time.
+    assert list(UploadManifest.load(manifest_path).files) == ["year=2026/month=1/00000000.parquet"]
+    uploader = RecordingUploader(tmp_path / "bucket")
+    assert upload_changed_files(archive, uploader, manifest_path) == 1
+    assert uploader.uploaded == ["year=2026/month=2/00000000.parquet"]